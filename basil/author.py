@@ -5,8 +5,8 @@ import discord
 import json
 from typing import Any, Dict, Set, Tuple, Optional
 
-from . import series
-from .helper import get_client
+from . import directory, series
+from .helper import get_client, has_client
 from .config import config
 
 
@@ -15,8 +15,16 @@ def get_member_names(user_id: int) -> Tuple[Set[str], str, str]:
     username: str = None
     discriminator: str = None
 
+    if not has_client():
+        names = directory.get_member_names(user_id)
+        if names is not None:
+            return names
+        guilds = []
+    else:
+        guilds = get_client().guilds
+
     guild: discord.Guild
-    for guild in get_client().guilds:
+    for guild in guilds:
         member: discord.User = guild.get_member(user_id)
 
         if member is None:
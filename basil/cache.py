@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class TTLCache(Generic[T]):
+    """A bounded in-process LRU cache whose entries expire after a time limit.
+
+    When the cache is full, the least recently used entry is evicted. Caches
+    may be shared with threads in the offload pool, so all access is locked.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self._entries: OrderedDict[Hashable, Tuple[float, T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Optional[T] = None) -> Optional[T]:
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: T, ttl: Optional[float] = None):
+        """Add an entry, optionally with a shorter lifetime than the default."""
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        with self._lock:
+            if ttl <= 0:
+                self._entries.pop(key, None)
+                return
+
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[T] = None) -> Optional[T]:
+        with self._lock:
+            try:
+                return self._entries.pop(key)[1]
+            except KeyError:
+                return default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
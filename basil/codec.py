@@ -0,0 +1,199 @@
+"""Compression for snippet content stored in Redis.
+
+Encoded values start with a NUL character, the name of the codec and a colon,
+followed by the codec's output (which must be a string, since the Redis client
+decodes all responses as UTF-8). Values without that header are stored
+verbatim. Discord messages cannot contain NUL characters, so the two cannot be
+confused.
+"""
+
+from __future__ import annotations
+
+import base64
+import logging
+from typing import Callable, Dict, Optional, Tuple
+import zlib
+
+import aioredis
+
+from .config import config
+from .metrics import Counter
+
+HEADER_MARKER = "\x00"
+
+# Codec used for newly written values.
+DEFAULT_CODEC = "zlib85"
+
+REPORT_KEY = "snippet_codec:report"
+SETTINGS_KEY = "snippet_codec:settings"
+
+# Compare-and-set, so that recompression never overwrites a concurrent edit.
+#
+# KEYS[1] is the content key.
+#
+# ARGV[1] is the value that was read.
+# ARGV[2] is the value to write.
+RECOMPRESS_SCRIPT = r"""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+CONTENT_BYTES_SAVED = Counter(
+    "basil_content_compression_saved_bytes_total",
+    "Bytes of snippet content saved by compression when writing to Redis.",
+)
+
+
+def _zlib85_encode(content: str) -> str:
+    compressed = zlib.compress(content.encode("utf-8"), 6)
+    return base64.b85encode(compressed).decode("ascii")
+
+
+def _zlib85_decode(data: str) -> str:
+    return zlib.decompress(base64.b85decode(data)).decode("utf-8")
+
+
+CODECS: Dict[str, Tuple[Callable[[str], str], Callable[[str], str]]] = {
+    "zlib85": (_zlib85_encode, _zlib85_decode),
+}
+
+
+class UnknownCodec(Exception):
+    pass
+
+
+def codec_of(stored: str) -> Optional[str]:
+    """Get the name of the codec used for a stored value, if any."""
+    if not stored.startswith(HEADER_MARKER):
+        return None
+    return stored[1:].split(":", 1)[0]
+
+
+def encode(content: str) -> str:
+    """Encode content for storage, compressing it if that saves space."""
+    if len(content) < config.content_compression_threshold:
+        return content
+
+    encoder, _ = CODECS[DEFAULT_CODEC]
+    encoded = HEADER_MARKER + DEFAULT_CODEC + ":" + encoder(content)
+
+    saved = len(content.encode("utf-8")) - len(encoded)
+    if saved <= 0:
+        return content
+
+    CONTENT_BYTES_SAVED.inc(saved)
+    return encoded
+
+
+def decode(stored: Optional[str]) -> Optional[str]:
+    """Decode a value read from Redis. Passes None through unchanged."""
+    if stored is None or not stored.startswith(HEADER_MARKER):
+        return stored
+
+    name, data = stored[1:].split(":", 1)
+    try:
+        _, decoder = CODECS[name]
+    except KeyError:
+        raise UnknownCodec(name) from None
+    return decoder(data)
+
+
+class CompressionReport(object):
+    def __init__(self):
+        self.keys_scanned: int = 0
+        self.keys_rewritten: int = 0
+        self.bytes_before: int = 0
+        self.bytes_after: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "keys_scanned": self.keys_scanned,
+            "keys_rewritten": self.keys_rewritten,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def __str__(self) -> str:
+        return (
+            "{} of {} snippets rewritten; {} bytes before, {} after ({} saved)".format(
+                self.keys_rewritten,
+                self.keys_scanned,
+                self.bytes_before,
+                self.bytes_after,
+                self.bytes_saved,
+            )
+        )
+
+
+async def recompress_all(
+    redis: aioredis.Redis, batch_size: int = 100
+) -> CompressionReport:
+    """Re-encode all stored snippet content with the current settings.
+
+    This compresses content saved before compression was enabled, and
+    re-encodes content stored with other codecs. The report covers all
+    snippet content, not just rewritten values, and is also saved to Redis.
+    """
+    report = CompressionReport()
+    script = redis.register_script(RECOMPRESS_SCRIPT)
+    keys = []
+
+    async def process(keys):
+        values = await redis.mget(keys)
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, stored in zip(keys, values):
+                if stored is None:
+                    continue
+
+                report.keys_scanned += 1
+                before = len(stored.encode("utf-8"))
+                report.bytes_before += before
+
+                try:
+                    content = decode(stored)
+                except UnknownCodec:
+                    logging.error("Unknown codec for key {}".format(key))
+                    report.bytes_after += before
+                    continue
+
+                encoded = encode(content)
+                report.bytes_after += len(encoded.encode("utf-8"))
+                if encoded != stored:
+                    await script([key], [stored, encoded], client=pipe)
+
+            results = await pipe.execute()
+        report.keys_rewritten += sum(results)
+
+    key: str
+    async for key in redis.scan_iter(match="snippet:*:content", count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            await process(keys)
+            keys = []
+
+    if len(keys) > 0:
+        await process(keys)
+
+    await redis.hset(REPORT_KEY, mapping=report.as_dict)
+    logging.info("Recompressed snippet content: " + str(report))
+    return report
+
+
+async def check_content_encoding(redis: aioredis.Redis):
+    """Recompress stored content if the codec settings have changed."""
+    settings = "{}:{}".format(DEFAULT_CODEC, config.content_compression_threshold)
+    if await redis.get(SETTINGS_KEY) == settings:
+        return
+
+    await recompress_all(redis)
+    await redis.set(SETTINGS_KEY, settings)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import discord
 import re
+import time
 from typing import Optional, Iterable, Any
 
 from .router import (
@@ -14,12 +15,24 @@ from .router import (
 
 from ..config import config
 from .. import main
+from .. import tracing
+from ..metrics import Histogram
 from .context import CommandContext
 
 
 COMMANDS = CommandRouter("")
 CMD_REGEX = r"\"([^\"]+)\"|\'([^\']+)\'|\`\`\`([^\`]+)\`\`\`|\`([^\`]+)\`|(\S+)"
 
+COMMAND_LATENCY = Histogram(
+    "basil_command_duration_seconds",
+    "Time taken to route and execute bot commands, by command and outcome.",
+    ("command", "outcome"),
+)
+
+# Label used for commands that could not be routed, to keep user input out of
+# metric labels.
+UNROUTED_COMMAND = "<unrouted>"
+
 
 def command(
     name: str,
@@ -109,13 +122,24 @@ async def dispatch(client: main.BasilClient, msg: discord.Message):
 
     # Route command:
 
+    start_time = time.perf_counter()
+    trace = tracing.start_trace("command", UNROUTED_COMMAND)
+
+    def record_outcome(cmd_name: str, outcome: str):
+        COMMAND_LATENCY.labels(cmd_name, outcome).observe(
+            time.perf_counter() - start_time
+        )
+        tracing.end_trace()
+
     try:
         cmd_obj, final_args = COMMANDS.route(ctx, (cmd,) + tuple(args[1:]))
     except CommandNotFoundError:
+        record_outcome(UNROUTED_COMMAND, "not_found")
         return await ctx.reply(
             "I can't find any commands like that. Maybe try checking the general help section?",
         )
     except AmbiguousCommandError as e:
+        record_outcome(UNROUTED_COMMAND, "ambiguous")
         cur_path = " ".join(e.args[0])
         lines = [
             "There's more than one command you could mean by that:".format(
@@ -128,6 +152,7 @@ async def dispatch(client: main.BasilClient, msg: discord.Message):
 
         return await ctx.reply("\n".join(lines))
     except CommandNotAuthorizedError:
+        record_outcome(UNROUTED_COMMAND, "unauthorized")
         return await ctx.reply("You aren't authorized to access that command.")
 
     # Shouldn't happen
@@ -136,9 +161,14 @@ async def dispatch(client: main.BasilClient, msg: discord.Message):
 
     # Execute command:
 
+    cmd_name = " ".join(cmd_obj.cmd_path)
+    trace.name = cmd_name
     try:
-        return await cmd_obj(ctx, final_args)
+        ret = await cmd_obj(ctx, final_args)
+        record_outcome(cmd_name, "ok")
+        return ret
     except Exception:
+        record_outcome(cmd_name, "error")
         await ctx.reply(
             "I seem to have run into an unexpected error while processing that command.\nIf you see any of my developers, could you ask them to check the logs? Sorry!"
         )
@@ -146,4 +176,5 @@ async def dispatch(client: main.BasilClient, msg: discord.Message):
 
 
 from . import snippet
+from . import search_cmd
 from . import help_cmd
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Optional
+
 import aioredis
 import discord
 
@@ -47,17 +49,26 @@ class CommandContext(object):
             return False
 
     async def reply(
-        self, content: str, as_reply=True, mention_author=True, ephemeral=True, **kwargs
+        self,
+        content: str,
+        as_reply=True,
+        mention_author=True,
+        ephemeral=True,
+        allowed_mentions: Optional[discord.AllowedMentions] = None,
+        **kwargs
     ) -> discord.Message:
         if as_reply:
             reply_msg = await self.channel.send(
                 content=content,
                 reference=self.message,
                 mention_author=mention_author,
+                allowed_mentions=allowed_mentions,
                 **kwargs
             )
         else:
-            reply_msg = await self.channel.send(content=content, **kwargs)
+            reply_msg = await self.channel.send(
+                content=content, allowed_mentions=allowed_mentions, **kwargs
+            )
 
         if ephemeral:
             await reply_msg.delete(delay=7.0)
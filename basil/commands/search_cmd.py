@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from typing import Tuple
+import urllib.parse
+
+import discord
+
+from . import command, CommandContext, Command
+from .. import search
+from ..config import config
+from ..helper import fit_message
+
+MAX_RESULTS = 5
+
+# Longest query echoed back in the reply, in characters.
+MAX_ECHOED_QUERY = 100
+
+
+@command("search")
+async def search_snippets(ctx: CommandContext, args: Tuple[str], cmd: Command):
+    """Search the text of all registered snippets.
+
+    **Usage:** `b!search [words to search for]`
+
+    Shows the snippets that best match your search, along with the series
+    they belong to.
+    """
+    if len(args) < 1:
+        return await ctx.reply(
+            "**USAGE:** `" + config.summon_prefix + "search [words to search for]`",
+        )
+
+    query = " ".join(args).strip()
+    hits = await search.search(ctx.redis, query, limit=MAX_RESULTS)
+
+    if len(hits) == 0:
+        return await ctx.reply("❌  I couldn't find any snippets matching that.")
+
+    if len(query) > MAX_ECHOED_QUERY:
+        query = query[: MAX_ECHOED_QUERY - 1] + "…"
+
+    header = '🔎  Top results for "{}":'.format(discord.utils.escape_markdown(query))
+    results = []
+    for hit in hits:
+        series = hit.series[0]
+        url = urllib.parse.urljoin(
+            config.api_base_url, "/series/" + urllib.parse.quote(series["tag"])
+        )
+        excerpt = hit.highlighted("**", "**", discord.utils.escape_markdown)
+
+        results.append(
+            "**{}** (`{}`) — <{}>\n> {}".format(
+                discord.utils.escape_markdown(series["title"]),
+                series["tag"],
+                url,
+                " ".join(excerpt.split()),
+            )
+        )
+
+    # excerpts are quoted from snippets, which may mention users or roles
+    return await ctx.reply(
+        fit_message([header], results),
+        ephemeral=False,
+        allowed_mentions=discord.AllowedMentions.none(),
+    )
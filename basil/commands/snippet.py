@@ -1,15 +1,29 @@
 from __future__ import annotations
-import logging
 
 import discord
 from typing import Tuple
 import urllib.parse
 
 from . import command, CommandContext, Command
+from .. import media, notify, subscriptions
 from ..snippet import Snippet
-from ..series import SERIES_INDEX_KEY, Series, SeriesNotFound
+from ..series import (
+    SERIES_INDEX_KEY,
+    Series,
+    SeriesAmbiguous,
+    SeriesNotFound,
+    get_author_summaries,
+)
 from ..config import config
 from ..author import Author
+from ..helper import fit_message
+
+# Most subscriptions listed by b!subscriptions; fewer are listed if their
+# titles do not fit in one message.
+MAX_LISTED_SUBSCRIPTIONS = 50
+
+# Most series listed by b!works, with the same caveat.
+MAX_LISTED_WORKS = 25
 
 
 @command("register")
@@ -56,11 +70,19 @@ async def register_snippet(ctx: CommandContext, args: Tuple[str], cmd: Command):
         series = await Series.resolve(ctx, name, ctx.user.id)
         if not series.can_edit(author):
             return await ctx.reply("❌  That series does not belong to you.")
+    except SeriesAmbiguous as e:
+        return await ctx.reply(
+            "❌  `{}` could refer to more than one of your series: {}\nℹ️ Use the exact series tag instead.".format(
+                name, ", ".join("`" + tag + "`" for tag in e.candidates)
+            )
+        )
     except SeriesNotFound:
         series = Series(ctx.redis, name, set([ctx.user.id]), [])
         new_series = True
 
     previous_snippet_ids = set(s.message_id for s in series.snippets)
+    # reuse the message it replies to, if Discord sent it along
+    ctx.client.rest.remember(reply_msg)
     new_snippets = []
     cur_msg = reply_msg
 
@@ -83,12 +105,8 @@ async def register_snippet(ctx: CommandContext, args: Tuple[str], cmd: Command):
         if message_id is None:
             break
 
-        channel: discord.TextChannel = ctx.client.get_channel(channel_id)
-        if channel is None:
-            break
-
         try:
-            cur_msg = await channel.fetch_message(message_id)
+            cur_msg = await ctx.client.rest.fetch_message(channel_id, message_id)
         except (discord.NotFound, discord.Forbidden) as e:
             break
 
@@ -104,6 +122,7 @@ async def register_snippet(ctx: CommandContext, args: Tuple[str], cmd: Command):
 
     series.snippets.extend(reversed(new_snippets))
     await series.save()
+    await media.queue_prefetch(ctx.redis, new_snippets)
 
     if new_series:
         await ctx.reply(
@@ -135,22 +154,14 @@ async def register_snippet(ctx: CommandContext, args: Tuple[str], cmd: Command):
             "⚠️  **Warning:** Your snippet tag has spaces in it. You'll need to **surround the tag name with quotes** if you're using it in other commands!"
         )
 
-    for subscriber_id in series.subscriber_ids:
-        user: discord.User = ctx.client.get_user(subscriber_id)
-
-        if user is None:
-            continue
-
-        try:
-            await user.send(
-                "ℹ️  Snippet series **{}** has updated!\n**Link to series:** {}".format(
-                    series.title, series.view_url
-                )
-            )
-        except Exception:
-            logging.error(
-                "Caught error when sending update notifications", exc_info=True
-            )
+    await notify.notify_subscribers(
+        ctx.client,
+        ctx.redis,
+        series.tag,
+        series.title,
+        list(series.subscriber_ids),
+        len(new_snippets),
+    )
 
 
 @command("title")
@@ -173,7 +184,7 @@ async def set_title(ctx: CommandContext, args: Tuple[str], cmd: Command):
     author = Author.get_by_id(ctx.user.id)
 
     try:
-        series = await Series.load(ctx, tag)
+        series = await Series.load(ctx, tag, fields=("title", "channels"))
     except SeriesNotFound:
         return await ctx.reply(
             "❌  There exists no series going by the tag `{}`.".format(tag)
@@ -210,7 +221,9 @@ async def rename_series(ctx: CommandContext, args: Tuple[str], cmd: Command):
     author = Author.get_by_id(ctx.user.id)
 
     try:
-        series = await Series.load(ctx, old_tag)
+        series = await Series.load(
+            ctx, old_tag, fields=("title", "updated", "subscribers", "channels")
+        )
     except SeriesNotFound:
         return await ctx.reply(
             "❌  There exists no series going by the tag `{}`.".format(old_tag)
@@ -220,7 +233,7 @@ async def rename_series(ctx: CommandContext, args: Tuple[str], cmd: Command):
         return await ctx.reply("❌  That series does not belong to you.")
 
     try:
-        await Series.load(ctx, new_tag)
+        await Series.load(ctx, new_tag, fields=())
         return await ctx.reply(
             "❌  There already exists a series going by the tag `{}`!".format(new_tag)
         )
@@ -251,7 +264,9 @@ async def delete_series(ctx: CommandContext, args: Tuple[str], cmd: Command):
     author = Author.get_by_id(ctx.user.id)
 
     try:
-        series = await Series.load(ctx, tag)
+        series = await Series.load(
+            ctx, tag, fields=("title", "subscribers", "channels")
+        )
     except SeriesNotFound:
         return await ctx.reply(
             "❌  There exists no series going by the tag `{}`.".format(tag)
@@ -285,16 +300,13 @@ async def subscribe_to_series(ctx: CommandContext, args: Tuple[str], cmd: Comman
     tag = args[0]
 
     try:
-        series = await Series.load(ctx, tag)
+        series = await Series.load(ctx, tag, fields=("title",))
     except SeriesNotFound:
         return await ctx.reply(
             "❌  There exists no series going by the tag `{}`.".format(tag)
         )
 
-    if ctx.user.id not in series.subscriber_ids:
-        series.subscriber_ids.add(ctx.user.id)
-        await series.save(update_time=False)
-
+    if await subscriptions.subscribe(ctx.redis, series.tag, ctx.user.id):
         return await ctx.reply(
             "✅  Subscribed to series **{}** (`{}`).".format(series.title, tag)
         )
@@ -303,40 +315,106 @@ async def subscribe_to_series(ctx: CommandContext, args: Tuple[str], cmd: Comman
 
 
 @command("unsubscribe")
-async def subscribe_to_series(ctx: CommandContext, args: Tuple[str], cmd: Command):
+async def unsubscribe_from_series(ctx: CommandContext, args: Tuple[str], cmd: Command):
     """Unsubscribe from updates for a series.
 
-    **Usage:** `b!unsubscribe [series tag]`
+    **Usage:** `b!unsubscribe [series tag]` or `b!unsubscribe all`
     ⚠️  Series tags must be surrounded by quotes if they contain spaces!
 
     This command unsubscribes you from update notifications for the given series;
     you will no longer receive DMs from that series whenever it updates with
     new snippets.
+
+    `b!unsubscribe all` unsubscribes you from every series at once.
     """
 
     if len(args) != 1:
         return await ctx.reply(
-            "**USAGE:** `" + config.summon_prefix + "unsubscribe [series tag]`",
+            "**USAGE:** `"
+            + config.summon_prefix
+            + "unsubscribe [series tag]` or `"
+            + config.summon_prefix
+            + "unsubscribe all`",
         )
 
     tag = args[0]
 
-    try:
-        series = await Series.load(ctx, tag)
-    except SeriesNotFound:
+    if tag.casefold() == "all":
+        removed = await subscriptions.unsubscribe_all(ctx.redis, ctx.user.id)
+        if len(removed) == 0:
+            return await ctx.reply("ℹ️  You are not subscribed to any series.")
+
         return await ctx.reply(
-            "❌  There exists no series going by the tag `{}`.".format(tag)
+            "✅  Unsubscribed from {} series.".format(len(removed)),
         )
 
-    if ctx.user.id in series.subscriber_ids:
-        series.subscriber_ids.remove(ctx.user.id)
-        await series.save(update_time=False)
+    if await subscriptions.unsubscribe(ctx.redis, tag, ctx.user.id):
+        return await ctx.reply("✅  Unsubscribed from series `{}`.".format(tag))
+    else:
+        return await ctx.reply("ℹ️  You are not subscribed to that series.")
+
 
+@command("subscriptions")
+async def list_subscriptions(ctx: CommandContext, args: Tuple[str], cmd: Command):
+    """List the series you are subscribed to.
+
+    **Usage:** `b!subscriptions`
+    """
+
+    tags = sorted(await subscriptions.get_subscriptions(ctx.redis, ctx.user.id))
+    if len(tags) == 0:
+        return await ctx.reply("ℹ️  You are not subscribed to any series.")
+
+    shown = tags[:MAX_LISTED_SUBSCRIPTIONS]
+    titles = await ctx.redis.mget(["series:" + tag + ":title" for tag in shown])
+
+    lines = []
+    for tag, title in zip(shown, titles):
+        if title is None:
+            title = tag.replace("_", " ").replace("-", " ").strip()
+        lines.append(
+            "-    **{}** (`{}`)".format(discord.utils.escape_markdown(title), tag)
+        )
+
+    return await ctx.reply(
+        fit_message(["ℹ️  You are subscribed to:"], lines, total=len(tags)),
+        ephemeral=False,
+    )
+
+
+@command("digest")
+async def set_digest_mode(ctx: CommandContext, args: Tuple[str], cmd: Command):
+    """Choose how often you are notified about series updates.
+
+    **Usage:** `b!digest [immediate|hourly|daily]`
+
+    In `immediate` mode (the default), you receive a DM whenever a series you
+    are subscribed to updates. In `hourly` or `daily` mode, updates are
+    collected into a single DM sent at the end of each hour or day (UTC).
+
+    Without an argument, this command shows your current mode.
+    """
+
+    modes = "|".join(notify.DIGEST_WINDOWS)
+    if len(args) > 1:
         return await ctx.reply(
-            "✅  Unsubscribed from series **{}** (`{}`).".format(series.title, tag)
+            "**USAGE:** `" + config.summon_prefix + "digest [" + modes + "]`",
         )
-    else:
-        return await ctx.reply("ℹ️  You are not subscribed to that series.")
+
+    if len(args) == 0:
+        mode = await notify.get_mode(ctx.redis, ctx.user.id)
+        return await ctx.reply("ℹ️  Your notification mode is `{}`.".format(mode))
+
+    mode = args[0].casefold()
+    if mode not in notify.DIGEST_WINDOWS:
+        return await ctx.reply(
+            "❌  Unknown notification mode `{}`; choose one of `{}`.".format(
+                args[0], modes
+            )
+        )
+
+    await notify.set_mode(ctx.redis, ctx.user.id, mode)
+    return await ctx.reply("✅  Set your notification mode to `{}`.".format(mode))
 
 
 @command("link")
@@ -354,7 +432,7 @@ async def get_link(ctx: CommandContext, args: Tuple[str], cmd: Command):
     tag = args[0]
 
     try:
-        series = await Series.load(ctx, tag)
+        series = await Series.load(ctx, tag, fields=())
     except SeriesNotFound:
         return await ctx.reply(
             "❌  There exists no series going by the tag `{}`.".format(tag)
@@ -365,6 +443,59 @@ async def get_link(ctx: CommandContext, args: Tuple[str], cmd: Command):
     )
 
 
+@command("works")
+async def list_works(ctx: CommandContext, args: Tuple[str], cmd: Command):
+    """List the series by an author.
+
+    **Usage:** `b!works [@user]`
+
+    Without a mention, this lists your own series.
+    """
+
+    mentions = ctx.message.mentions
+    if len(args) > 1 or (len(args) == 1 and len(mentions) != 1):
+        return await ctx.reply(
+            "**USAGE:** `" + config.summon_prefix + "works [@user]`",
+        )
+
+    user: discord.abc.User = mentions[0] if len(args) == 1 else ctx.user
+    summaries = await get_author_summaries(ctx.redis, user.id)
+    if len(summaries) == 0:
+        return await ctx.reply(
+            "ℹ️  **{}** has no series.".format(
+                discord.utils.escape_markdown(user.display_name)
+            )
+        )
+
+    author_url = urllib.parse.urljoin(
+        config.api_base_url, "/authors/{}".format(user.id)
+    )
+    header = "ℹ️  Series by **{}** ({:,} words):".format(
+        discord.utils.escape_markdown(user.display_name),
+        sum(summary.wordcount for summary in summaries),
+    )
+    lines = [
+        "-    **{}** (`{}`): {} snippet{}, {:,} words".format(
+            discord.utils.escape_markdown(summary.title),
+            summary.tag,
+            summary.snippet_count,
+            "s" if summary.snippet_count != 1 else "",
+            summary.wordcount,
+        )
+        for summary in summaries[:MAX_LISTED_WORKS]
+    ]
+
+    return await ctx.reply(
+        fit_message(
+            [header],
+            lines,
+            ["**Link to author page:** " + author_url],
+            total=len(summaries),
+        ),
+        ephemeral=False,
+    )
+
+
 @command("index")
 async def get_index(ctx: CommandContext, args: Tuple[str], cmd: Command):
     """Get a link to the series index.
@@ -4,7 +4,7 @@ import json
 from pathlib import Path
 import os
 import typing
-from typing import Any, Set, Dict
+from typing import Any, Optional, Set, Dict
 
 
 class Config:
@@ -32,6 +32,40 @@ class Config:
     dev_mode: bool
     administrators: Set[int]
 
+    # Options below have defaults and may be omitted from the config file.
+    trace_slow_roundtrips: int = 25
+    trace_slow_seconds: float = 0.25
+    trace_repeat_threshold: int = 10
+
+    redis_max_connections: int = 32
+    redis_pool_timeout: float = 5.0
+    # Seconds allowed for each Redis command or pipeline, if set. This is
+    # enforced with asyncio rather than as a socket timeout, which uvloop's
+    # sockets do not support.
+    redis_socket_timeout: Optional[float] = None
+    redis_connect_timeout: float = 5.0
+    redis_health_check_interval: int = 30
+
+    web_workers: int = 1
+
+    # Bearer token that scrapers must present to read /metrics. The endpoint
+    # is disabled while this is empty.
+    metrics_token: str = ""
+
+    content_compression_threshold: int = 1024
+
+    # Inputs at least this large (roughly, in characters) are processed in a
+    # thread pool rather than on the event loop; see basil.offload.
+    offload_threshold: int = 65536
+    offload_workers: int = 2
+
+    # Snippet attachments are proxied through /media and cached on disk, up
+    # to media_cache_size bytes; see basil.media. If media_upstream is set,
+    # attachments are fetched from that origin instead of Discord's CDN.
+    media_cache_dir: Path = Path("/var/cache/basil/media")
+    media_cache_size: int = 1024 * 1024 * 1024
+    media_upstream: str = ""
+
     def __init__(self):
         self.config_file = Path(os.environ["BASIL_CONFIG"]).resolve()
         self.load()
@@ -82,7 +116,14 @@ class Config:
 
                 origin = typing.get_origin(hint)
                 type_args = typing.get_args(hint)
-                val = data[attr]
+
+                try:
+                    val = data[attr]
+                except KeyError:
+                    if hasattr(Config, attr):
+                        # fall back to the class-level default
+                        continue
+                    raise
 
                 if origin is set:
                     val = set(map(type_args[0], val))
@@ -0,0 +1,202 @@
+"""Guild member and permission data shared from the bot with web workers.
+
+When the web API runs in a separate process from the Discord client, it
+cannot look up member names or channel permissions directly. Instead, the
+bot periodically publishes a snapshot of that data to Redis, and each web
+worker keeps an in-process copy that it refreshes when the snapshot changes.
+
+Manager lists are only published for channels that hold snippets, which are
+tracked in the `directory:snippet_channels` set as snippets are saved.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import aioredis
+import discord
+
+from .config import config
+
+MEMBERS_KEY = "directory:members"
+MANAGERS_KEY = "directory:managers"
+VERSION_KEY = "directory:version"
+SNIPPET_CHANNELS_KEY = "directory:snippet_channels"
+# Set once the snippet channel set has been backfilled from existing snippets.
+SNIPPET_CHANNELS_VERSION_KEY = "directory:snippet_channels:version"
+
+# Seconds between snapshots published by the bot.
+PUBLISH_INTERVAL = 300
+
+# Seconds between checks for a new snapshot in web workers.
+REFRESH_INTERVAL = 30
+
+# Keys examined per SCAN call when rebuilding the snippet channel set.
+BACKFILL_BATCH_SIZE = 1000
+
+MemberNames = Tuple[Set[str], str, str]
+
+_members: Dict[int, MemberNames] = {}
+_managers: Dict[int, Set[int]] = {}
+_version: Optional[str] = None
+
+
+def manages_channel(channel: discord.TextChannel, member: discord.Member) -> bool:
+    """Check whether a member counts as a snippet manager in a channel."""
+    if (
+        member.guild_permissions.administrator
+        or channel.permissions_for(member).manage_messages
+    ):
+        return True
+
+    management_role_name: str = config.management_role_name.casefold()
+    if len(management_role_name) > 0:
+        for r in member.roles:
+            if r.name.strip().casefold() == management_role_name:
+                return True
+    return False
+
+
+def get_member_names(user_id: int) -> Optional[MemberNames]:
+    """Look up a user's names from the last loaded snapshot."""
+    return _members.get(user_id)
+
+
+def is_channel_manager(channel_id: int, user_id: int) -> bool:
+    """Check a user's permissions in a channel against the last loaded snapshot."""
+    return user_id in _managers.get(channel_id, ())
+
+
+async def snippet_channels(redis: aioredis.Redis) -> Set[int]:
+    """Get the IDs of channels holding snippets.
+
+    The set is backfilled from the saved snippets the first time this is
+    called; snippets saved since then have added their own channels. Channels
+    whose snippets have all been deleted may still be included.
+    """
+    if await redis.get(SNIPPET_CHANNELS_VERSION_KEY) is not None:
+        return set(int(c) for c in await redis.smembers(SNIPPET_CHANNELS_KEY))
+
+    channel_ids = set()
+    key: str
+    async for key in redis.scan_iter(
+        match="snippet:*:channel", count=BACKFILL_BATCH_SIZE
+    ):
+        channel_id = await redis.get(key)
+        if channel_id is not None:
+            channel_ids.add(int(channel_id))
+
+    async with redis.pipeline(transaction=True) as tr:
+        if len(channel_ids) > 0:
+            tr.sadd(SNIPPET_CHANNELS_KEY, *channel_ids)
+        tr.smembers(SNIPPET_CHANNELS_KEY)
+        tr.set(SNIPPET_CHANNELS_VERSION_KEY, "1")
+        results = await tr.execute()
+
+    # includes channels added by snippets saved during the scan
+    return set(int(c) for c in results[-2])
+
+
+async def publish(client: discord.Client, redis: aioredis.Redis):
+    """Publish a snapshot of member names and channel managers to Redis."""
+    members: Dict[int, dict] = {}
+    managers: Dict[int, Set[int]] = {}
+    channel_ids = await snippet_channels(redis)
+
+    guild: discord.Guild
+    for guild in client.guilds:
+        member: discord.Member
+        for member in guild.members:
+            data = members.setdefault(
+                member.id,
+                {
+                    "display_names": [],
+                    "username": member.name,
+                    "discriminator": member.discriminator,
+                },
+            )
+            if member.display_name not in data["display_names"]:
+                data["display_names"].append(member.display_name)
+
+        for channel in guild.text_channels:
+            if channel.id not in channel_ids:
+                continue
+
+            managers[channel.id] = set(
+                m.id for m in guild.members if manages_channel(channel, m)
+            )
+            # large guilds can take a while; don't block the gateway
+            await asyncio.sleep(0)
+
+    async with redis.pipeline(transaction=True) as tr:
+        tr.delete(MEMBERS_KEY, MANAGERS_KEY)
+        if len(members) > 0:
+            tr.hset(
+                MEMBERS_KEY,
+                mapping={k: json.dumps(v) for k, v in members.items()},
+            )
+        if len(managers) > 0:
+            tr.hset(
+                MANAGERS_KEY,
+                mapping={k: json.dumps(sorted(v)) for k, v in managers.items()},
+            )
+        tr.set(VERSION_KEY, str(time.time()))
+        await tr.execute()
+
+    logging.info(
+        "Published directory with {} members and {} channels".format(
+            len(members), len(managers)
+        )
+    )
+
+
+async def publish_loop(client: discord.Client, redis: aioredis.Redis):
+    while True:
+        try:
+            await publish(client, redis)
+        except Exception:
+            logging.exception("Caught exception while publishing directory")
+
+        await asyncio.sleep(PUBLISH_INTERVAL)
+
+
+async def refresh(redis: aioredis.Redis):
+    """Reload the in-process snapshot if a newer one has been published."""
+    global _members, _managers, _version
+
+    version = await redis.get(VERSION_KEY)
+    if version is None or version == _version:
+        return
+
+    async with redis.pipeline(transaction=True) as tr:
+        tr.get(VERSION_KEY)
+        tr.hgetall(MEMBERS_KEY)
+        tr.hgetall(MANAGERS_KEY)
+        version, member_data, manager_data = await tr.execute()
+
+    members: Dict[int, MemberNames] = {}
+    for user_id, data in member_data.items():
+        data = json.loads(data)
+        members[int(user_id)] = (
+            set(data["display_names"]),
+            data["username"],
+            data["discriminator"],
+        )
+
+    _members = members
+    _managers = {int(k): set(json.loads(v)) for k, v in manager_data.items()}
+    _version = version
+
+
+async def refresh_loop(redis: aioredis.Redis):
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+        try:
+            await refresh(redis)
+        except Exception:
+            logging.exception("Caught exception while refreshing directory")
@@ -0,0 +1,144 @@
+"""A stream of change events for series, used for incremental sync.
+
+Every change to a series appends a small event to a capped Redis stream, in
+the same transaction as the change itself. Clients remember the ID of the
+last event they have seen and ask for only the changes after it.
+
+Events have a "type" field and most have a "tag" field:
+
+- "save": the series' snippets, authors or other data were saved.
+- "title": the series was retitled.
+- "rename": the series tag changed from "tag" to "new_tag".
+- "delete": the series was deleted.
+- "snippet": the snippet "message_id" was saved, which may change any series
+  it belongs to.
+
+Each event is also published to the `EVENTS_CHANNEL` pub/sub channel, as a
+JSON object, for pushing live updates to open pages.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, List, Optional, Set, Tuple
+
+import aioredis
+
+EVENTS_KEY = "events:series"
+EVENTS_CHANNEL = "events:series:live"
+
+# Approximate number of events kept in the stream. Clients that fall further
+# behind than this have to resynchronize from scratch.
+MAX_EVENTS = 10000
+
+# Maximum number of events read for one request.
+MAX_CHANGES_PER_REQUEST = 1000
+
+
+def record(pipe: Any, kind: str, tag: Optional[str] = None, **fields: Any):
+    """Queue commands on a pipeline to append an event to the stream and
+    publish it.
+    """
+    data = {"type": kind}
+    if tag is not None:
+        data["tag"] = tag
+    for k, v in fields.items():
+        data[k] = str(v)
+
+    pipe.xadd(EVENTS_KEY, data, maxlen=MAX_EVENTS, approximate=True)
+    pipe.publish(EVENTS_CHANNEL, json.dumps(data))
+
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    """Parse a stream ID ("<ms>-<seq>" or "<ms>") for comparison.
+
+    Raises ValueError if the ID is malformed.
+    """
+    ms, _, seq = event_id.partition("-")
+    ret = (int(ms), int(seq or 0))
+    if ret[0] < 0 or ret[1] < 0:
+        raise ValueError(event_id)
+    return ret
+
+
+class ChangeSet(object):
+    """The series changed and deleted after a given event."""
+
+    def __init__(self, last_id: str, reset: bool = False, more: bool = False):
+        self.last_id: str = last_id
+        # Set if changes may have been missed; the client must refetch everything.
+        self.reset: bool = reset
+        # Set if there are further changes after `last_id`.
+        self.more: bool = more
+        self.changed: Set[str] = set()
+        self.deleted: Set[str] = set()
+
+    def mark_changed(self, tag: str):
+        self.changed.add(tag)
+        self.deleted.discard(tag)
+
+    def mark_deleted(self, tag: str):
+        self.deleted.add(tag)
+        self.changed.discard(tag)
+
+
+async def read_changes(
+    redis: aioredis.Redis,
+    since: Optional[str],
+    limit: int = MAX_CHANGES_PER_REQUEST,
+) -> ChangeSet:
+    """Collect the changes after the event with ID `since`.
+
+    If `since` is None, or events after it may have been trimmed from the
+    stream, the returned change set has `reset` set and no changes.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xrange(EVENTS_KEY, count=1)
+        pipe.xrevrange(EVENTS_KEY, count=1)
+        if since is not None:
+            # the range is inclusive, so read one extra event
+            pipe.xrange(EVENTS_KEY, min=since, count=limit + 1)
+        results = await pipe.execute()
+
+    first, last = results[0], results[1]
+    last_id = last[0][0] if len(last) > 0 else "0-0"
+    if since is None:
+        return ChangeSet(last_id, reset=True)
+
+    since_id = parse_event_id(since)
+    if (len(first) > 0 and since_id < parse_event_id(first[0][0])) or (
+        since_id > parse_event_id(last_id)
+    ):
+        return ChangeSet(last_id, reset=True)
+
+    entries: List[Tuple[str, dict]] = [e for e in results[2] if e[0] != since][:limit]
+    if len(entries) == 0:
+        return ChangeSet(since)
+
+    changes = ChangeSet(entries[-1][0], more=(entries[-1][0] != last_id))
+
+    snippet_ids = list(
+        dict.fromkeys(
+            data["message_id"] for _, data in entries if data["type"] == "snippet"
+        )
+    )
+    if len(snippet_ids) > 0:
+        async with redis.pipeline(transaction=False) as pipe:
+            for message_id in snippet_ids:
+                pipe.smembers("snippet:" + message_id + ":series")
+            snippet_series = dict(zip(snippet_ids, await pipe.execute()))
+
+    for _, data in entries:
+        kind = data["type"]
+        if kind == "delete":
+            changes.mark_deleted(data["tag"])
+        elif kind == "rename":
+            changes.mark_deleted(data["tag"])
+            changes.mark_changed(data["new_tag"])
+        elif kind == "snippet":
+            for tag in snippet_series[data["message_id"]]:
+                changes.mark_changed(tag)
+        else:
+            changes.mark_changed(data["tag"])
+
+    return changes
@@ -0,0 +1,274 @@
+"""Export of whole series to downloadable documents.
+
+Exports are generated incrementally: snippets are read from Redis in batches
+and each batch is encoded and sent before the next is read, so memory use does
+not grow with the length of the series.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import html
+import json
+import time
+from typing import AsyncIterator, Callable, List, Optional
+import uuid
+import zipfile
+
+import aioredis
+
+from . import author as author_mod
+from . import codec
+from . import offload
+from .series import SeriesNotFound
+
+# Number of snippets read from Redis at a time.
+EXPORT_BATCH_SIZE = 50
+
+EXPORT_FORMATS = {
+    "md": "text/markdown; charset=utf-8",
+    "txt": "text/plain; charset=utf-8",
+    "epub": "application/epub+zip",
+}
+
+
+class SeriesExportInfo(object):
+    """The series metadata needed for an export, without snippet content."""
+
+    def __init__(
+        self, tag: str, title: str, author_names: List[str], snippet_ids: List[int]
+    ):
+        self.tag: str = tag
+        self.title: str = title
+        self.author_names: List[str] = author_names
+        self.snippet_ids: List[int] = snippet_ids
+
+    @classmethod
+    async def load(cls, redis: aioredis.Redis, tag: str) -> SeriesExportInfo:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get("series:" + tag + ":snippets")
+            pipe.get("series:" + tag + ":title")
+            pipe.get("series:" + tag + ":authors")
+            snippet_ids, title, author_ids = await pipe.execute()
+
+        if snippet_ids is None:
+            raise SeriesNotFound(tag)
+
+        if title is None:
+            title = tag.replace("_", " ").replace("-", " ").strip()
+
+        author_names = [
+            author_mod.Author.get_by_id(author_id).joined_display_names
+            for author_id in json.loads(author_ids or "[]")
+        ]
+
+        return cls(tag, title, author_names, json.loads(snippet_ids))
+
+    @property
+    def byline(self) -> str:
+        return ", ".join(self.author_names)
+
+
+async def iter_snippet_batches(
+    redis: aioredis.Redis, snippet_ids: List[int]
+) -> AsyncIterator[List[Optional[str]]]:
+    """Read snippet content in batches. Missing snippets are returned as None."""
+    for i in range(0, len(snippet_ids), EXPORT_BATCH_SIZE):
+        batch = snippet_ids[i : i + EXPORT_BATCH_SIZE]
+        contents = await redis.mget(
+            ["snippet:" + str(message_id) + ":content" for message_id in batch]
+        )
+        yield [codec.decode(c) for c in contents]
+
+
+async def export_text(
+    redis: aioredis.Redis,
+    info: SeriesExportInfo,
+    write: Callable[[str], asyncio.Future],
+    markdown: bool,
+):
+    if markdown:
+        await write("# {}\n\n*by {}*\n\n".format(info.title, info.byline))
+        separator = "\n\n---\n\n"
+    else:
+        underline = "=" * len(info.title)
+        await write("{}\n{}\nby {}\n\n".format(info.title, underline, info.byline))
+        separator = "\n\n* * *\n\n"
+
+    first = True
+    async for batch in iter_snippet_batches(redis, info.snippet_ids):
+        parts = []
+        for content in batch:
+            if content is None:
+                continue
+            if not first:
+                parts.append(separator)
+            parts.append(content)
+            first = False
+        await write("".join(parts))
+
+    await write("\n")
+
+
+class _ZipSink(object):
+    """A write-only stream that buffers output until it is drained."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        ret = b"".join(self.chunks)
+        self.chunks = []
+        return ret
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{title}</title></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+class EpubWriter(object):
+    """Writes an EPUB 3 document one chapter at a time.
+
+    Every method returns the bytes of the archive produced so far, which can
+    be sent immediately. Methods may be called from a worker thread, but not
+    concurrently.
+    """
+
+    def __init__(self, info: SeriesExportInfo):
+        self.info: SeriesExportInfo = info
+        self.sink = _ZipSink()
+        self.zip = zipfile.ZipFile(self.sink, mode="w")
+        self.chapter_count: int = 0
+
+    def _chapter_name(self, n: int) -> str:
+        return "chapter-{:05d}.xhtml".format(n)
+
+    def start(self, chapter_count: int) -> bytes:
+        info = self.info
+        title = html.escape(info.title)
+
+        # The mimetype entry must come first and be stored uncompressed.
+        self.zip.writestr(
+            "mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED
+        )
+        self.zip.writestr(
+            "META-INF/container.xml", CONTAINER_XML, compress_type=zipfile.ZIP_DEFLATED
+        )
+
+        chapters = [self._chapter_name(n) for n in range(1, chapter_count + 1)]
+        manifest = "\n".join(
+            '    <item id="c{0}" href="{1}" media-type="application/xhtml+xml"/>'.format(
+                n, name
+            )
+            for n, name in enumerate(chapters, 1)
+        )
+        spine = "\n".join(
+            '    <itemref idref="c{}"/>'.format(n) for n in range(1, chapter_count + 1)
+        )
+        creators = "\n".join(
+            "    <dc:creator>{}</dc:creator>".format(html.escape(name))
+            for name in info.author_names
+        )
+        modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+        opf = """<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="uid">urn:uuid:{uid}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>en</dc:language>
+{creators}
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{manifest}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+""".format(
+            uid=uuid.uuid5(uuid.NAMESPACE_URL, "basil-series:" + info.tag),
+            title=title,
+            creators=creators,
+            modified=modified,
+            manifest=manifest,
+            spine=spine,
+        )
+        self.zip.writestr("OEBPS/content.opf", opf, compress_type=zipfile.ZIP_DEFLATED)
+
+        toc = "\n".join(
+            '<li><a href="{}">Part {}</a></li>'.format(name, n)
+            for n, name in enumerate(chapters, 1)
+        )
+        nav = XHTML_TEMPLATE.format(
+            title=title,
+            body='<nav epub:type="toc"><h1>{}</h1><ol>\n{}\n</ol></nav>'.format(
+                title, toc
+            ),
+        )
+        self.zip.writestr("OEBPS/nav.xhtml", nav, compress_type=zipfile.ZIP_DEFLATED)
+
+        return self.sink.drain()
+
+    def add_chapters(self, contents: List[Optional[str]]) -> bytes:
+        for content in contents:
+            self.chapter_count += 1
+            if content is None:
+                content = "(This part is no longer available.)"
+            paragraphs = "\n".join(
+                "<p>{}</p>".format(html.escape(p.strip()).replace("\n", "<br/>"))
+                for p in content.split("\n\n")
+                if len(p.strip()) > 0
+            )
+            body = "<h2>Part {}</h2>\n{}".format(self.chapter_count, paragraphs)
+
+            self.zip.writestr(
+                "OEBPS/" + self._chapter_name(self.chapter_count),
+                XHTML_TEMPLATE.format(title=html.escape(self.info.title), body=body),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        self.zip.close()
+        return self.sink.drain()
+
+
+async def export_epub(
+    redis: aioredis.Redis,
+    info: SeriesExportInfo,
+    write: Callable[[bytes], asyncio.Future],
+):
+    writer = EpubWriter(info)
+
+    await write(await offload.run("export_epub", writer.start, len(info.snippet_ids)))
+
+    async for batch in iter_snippet_batches(redis, info.snippet_ids):
+        await write(await offload.run("export_epub", writer.add_chapters, batch))
+
+    await write(await offload.run("export_epub", writer.finish))
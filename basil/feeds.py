@@ -0,0 +1,266 @@
+"""Atom feeds of series updates.
+
+Feeds are built from the update-time sorted sets maintained by `Series.save`
+and from per-series version counters, which are incremented whenever a
+series or one of its snippets changes. A feed's version (its ETag) is derived
+from the versions of the series it lists, so checking whether a feed has
+changed takes a single round trip, without loading any series.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import aioredis
+
+from . import author as author_mod
+from . import codec
+from .config import config
+from .series import AUTHOR_UPDATES_PREFIX, SERIES_UPDATES_KEY
+from .snowflake import snowflake_to_timestamp
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+
+# Number of entries in each feed.
+FEED_SIZE = 30
+
+
+class FeedVersion(object):
+    def __init__(self, etag: str, updated: float, entries: List[Tuple[str, float]]):
+        self.etag: str = etag
+        self.updated: float = updated
+        # (tag, update time) of each series listed, for index feeds.
+        self.entries: List[Tuple[str, float]] = entries
+
+
+def _make_etag(*parts: object) -> str:
+    digest = hashlib.sha1("\0".join(str(p) for p in parts).encode("utf-8"))
+    return '"' + digest.hexdigest() + '"'
+
+
+def _timestamp(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def _series_url(tag: str) -> str:
+    return urllib.parse.urljoin(
+        config.api_base_url, "/series/" + urllib.parse.quote(tag)
+    )
+
+
+def _feed_url(path: str) -> str:
+    return urllib.parse.urljoin(config.api_base_url, path)
+
+
+def _author_names(author_ids: List[int]) -> List[str]:
+    return [
+        author_mod.Author.get_by_id(author_id).joined_display_names
+        for author_id in sorted(author_ids)
+    ]
+
+
+def _feed_element(
+    title: str, feed_id: str, self_url: str, alternate_url: str, updated: float
+) -> ET.Element:
+    feed = ET.Element("feed", xmlns=ATOM_NS)
+    ET.SubElement(feed, "title").text = title
+    ET.SubElement(feed, "id").text = feed_id
+    ET.SubElement(feed, "updated").text = _timestamp(updated)
+    ET.SubElement(feed, "link", rel="self", href=self_url)
+    ET.SubElement(feed, "link", rel="alternate", href=alternate_url)
+    ET.SubElement(feed, "generator").text = "Basil"
+    return feed
+
+
+def _add_entry(
+    feed: ET.Element,
+    title: str,
+    entry_id: str,
+    url: str,
+    updated: float,
+    authors: List[str],
+    content: Optional[str],
+):
+    entry = ET.SubElement(feed, "entry")
+    ET.SubElement(entry, "title").text = title
+    ET.SubElement(entry, "id").text = entry_id
+    ET.SubElement(entry, "link", rel="alternate", href=url)
+    ET.SubElement(entry, "updated").text = _timestamp(updated)
+    for name in authors:
+        ET.SubElement(ET.SubElement(entry, "author"), "name").text = name
+    if content is not None:
+        ET.SubElement(entry, "content", type="text").text = content
+
+
+def _serialize(feed: ET.Element) -> str:
+    return '<?xml version="1.0" encoding="utf-8"?>\n' + ET.tostring(
+        feed, encoding="unicode"
+    )
+
+
+async def series_feed_version(redis: aioredis.Redis, tag: str) -> Optional[FeedVersion]:
+    """Get the current version of a series feed, or None if there is no series."""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.exists("series:" + tag + ":snippets")
+        pipe.get("series:" + tag + ":version")
+        pipe.get("series:" + tag + ":updated")
+        exists, version, updated = await pipe.execute()
+
+    if not exists:
+        return None
+
+    updated = float(updated or 0)
+    return FeedVersion(_make_etag("series", tag, version, updated), updated, [])
+
+
+async def index_feed_version(redis: aioredis.Redis, key: str) -> Optional[FeedVersion]:
+    """Get the current version of a feed of the most recently updated series
+    in one of the update-time sorted sets, or None if the set is empty.
+    """
+    entries: List[Tuple[str, float]] = await redis.zrevrange(
+        key, 0, FEED_SIZE - 1, withscores=True
+    )
+    if len(entries) == 0:
+        return None
+
+    versions = await redis.mget(["series:" + tag + ":version" for tag, _ in entries])
+    etag = _make_etag(
+        key, *("{}:{}:{}".format(t, v, s) for (t, s), v in zip(entries, versions))
+    )
+    return FeedVersion(etag, entries[0][1], entries)
+
+
+async def build_series_feed(redis: aioredis.Redis, tag: str) -> Optional[str]:
+    """Build a feed of the latest snippets in a series."""
+    prefix = "series:" + tag
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(prefix + ":snippets")
+        pipe.get(prefix + ":title")
+        pipe.get(prefix + ":authors")
+        pipe.get(prefix + ":updated")
+        snippet_ids, title, author_ids, updated = await pipe.execute()
+
+    if snippet_ids is None:
+        return None
+
+    if title is None:
+        title = tag.replace("_", " ").replace("-", " ").strip()
+
+    snippet_ids = json.loads(snippet_ids)
+    authors = _author_names(json.loads(author_ids or "[]"))
+    latest = list(enumerate(snippet_ids, 1))[-FEED_SIZE:]
+    contents = []
+    if len(latest) > 0:
+        contents = await redis.mget(
+            ["snippet:" + str(message_id) + ":content" for _, message_id in latest]
+        )
+
+    url = _series_url(tag)
+    feed = _feed_element(
+        title,
+        url,
+        _feed_url("/feeds/series/" + urllib.parse.quote(tag) + ".atom"),
+        url,
+        float(updated or 0),
+    )
+
+    for (n, message_id), content in reversed(list(zip(latest, contents))):
+        if content is None:
+            continue
+
+        _add_entry(
+            feed,
+            "{} (part {})".format(title, n),
+            "urn:basil:snippet:" + str(message_id),
+            url,
+            snowflake_to_timestamp(int(message_id)),
+            authors,
+            codec.decode(content),
+        )
+
+    return _serialize(feed)
+
+
+async def build_index_feed(
+    redis: aioredis.Redis,
+    version: FeedVersion,
+    title: str,
+    path: str,
+) -> str:
+    """Build a feed of the series listed in a feed version.
+
+    Each entry shows the latest snippet in the series.
+    """
+    tags = [tag for tag, _ in version.entries]
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            pipe.get("series:" + tag + ":title")
+            pipe.get("series:" + tag + ":authors")
+            pipe.get("series:" + tag + ":snippets")
+        results = await pipe.execute()
+
+    series_data: Dict[str, Tuple[str, List[int], Optional[int]]] = {}
+    for i, tag in enumerate(tags):
+        series_title, author_ids, snippet_ids = results[3 * i : 3 * i + 3]
+        if snippet_ids is None:
+            continue
+
+        if series_title is None:
+            series_title = tag.replace("_", " ").replace("-", " ").strip()
+        snippet_ids = json.loads(snippet_ids)
+        latest = snippet_ids[-1] if len(snippet_ids) > 0 else None
+        series_data[tag] = (series_title, json.loads(author_ids or "[]"), latest)
+
+    latest_ids = [latest for _, _, latest in series_data.values() if latest is not None]
+    contents: Dict[int, Optional[str]] = {}
+    if len(latest_ids) > 0:
+        contents = dict(
+            zip(
+                latest_ids,
+                await redis.mget(
+                    [
+                        "snippet:" + str(message_id) + ":content"
+                        for message_id in latest_ids
+                    ]
+                ),
+            )
+        )
+
+    feed = _feed_element(
+        title, _feed_url(path), _feed_url(path), _feed_url("/"), version.updated
+    )
+
+    for tag, updated in version.entries:
+        try:
+            series_title, author_ids, latest = series_data[tag]
+        except KeyError:
+            continue
+
+        url = _series_url(tag)
+        _add_entry(
+            feed,
+            series_title,
+            url,
+            url,
+            updated,
+            _author_names(author_ids),
+            codec.decode(contents.get(latest)),
+        )
+
+    return _serialize(feed)
+
+
+async def recent_feed_version(redis: aioredis.Redis) -> Optional[FeedVersion]:
+    return await index_feed_version(redis, SERIES_UPDATES_KEY)
+
+
+async def author_feed_version(
+    redis: aioredis.Redis, author_id: int
+) -> Optional[FeedVersion]:
+    return await index_feed_version(redis, AUTHOR_UPDATES_PREFIX + str(author_id))
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import aioredis
 import discord
-from typing import Union
+from typing import List, Optional, Sequence, Union
 
 from . import main
 from .commands import CommandContext
@@ -10,6 +10,9 @@ from .commands import CommandContext
 ContainsRedis = Union[CommandContext, aioredis.Redis]
 ContainsClient = Union[CommandContext, discord.Client]
 
+# Longest message Discord accepts, in characters.
+MAX_MESSAGE_LENGTH = 2000
+
 
 def ensure_redis(redis_or_ctx: Union[CommandContext, aioredis.Redis]) -> aioredis.Redis:
     try:
@@ -20,3 +23,43 @@ def ensure_redis(redis_or_ctx: Union[CommandContext, aioredis.Redis]) -> aioredi
 
 def get_client() -> "main.BasilClient":
     return main.BasilClient.get()
+
+
+def has_client() -> bool:
+    """Check whether the Discord client runs in this process."""
+    return main.BasilClient._inst is not None
+
+
+def fit_message(
+    header: Sequence[str],
+    items: Sequence[str],
+    footer: Sequence[str] = (),
+    limit: int = MAX_MESSAGE_LENGTH,
+    total: Optional[int] = None,
+) -> str:
+    """Join lines into one message no longer than `limit`.
+
+    As many of `items` are kept as fit between the header and footer lines;
+    the rest are summarized as "...and N more." If `items` are only the first
+    of `total` items, the ones not passed in are counted as well.
+    """
+    if total is None:
+        total = len(items)
+
+    fixed = len("\n".join(list(header) + list(footer)))
+    overflow_reserve = len("\n...and {} more.".format(total))
+
+    kept: List[str] = []
+    used = fixed
+    for i, item in enumerate(items):
+        # the last item does not need room for the overflow line
+        reserve = overflow_reserve if i < total - 1 else 0
+        if used + 1 + len(item) + reserve > limit:
+            break
+        kept.append(item)
+        used += 1 + len(item)
+
+    lines = list(header) + kept
+    if len(kept) < total:
+        lines.append("...and {} more.".format(total - len(kept)))
+    return "\n".join(lines + list(footer))
@@ -1,16 +1,31 @@
 from __future__ import annotations
 
 import asyncio
-import aioredis
 import discord
 import logging
+import math
+import time
 from typing import Optional
 
 from .config import config
+from . import codec
 from . import commands
+from . import directory
+from . import notify
+from . import offload
 from . import web
+from .metrics import Counter, Gauge, Histogram
+from . import redis_pool
+from .rest_gateway import RESTGateway
+from . import snippet_gc
 from .snippet import Snippet, SnippetNotFound, scan_message_channels
-from .series import check_series_schema, get_author_count, get_series_count
+from .series import (
+    check_search_index,
+    check_series_schema,
+    check_subscription_schema,
+    get_author_count,
+    get_series_count,
+)
 
 logging.basicConfig(level=logging.INFO)
 bot_root_logger = logging.getLogger("bot")
@@ -23,10 +38,34 @@ INTENTS.members = True
 INTENTS.typing = False
 INTENTS.voice_states = False
 
+DISCORD_REST_CALLS = Counter(
+    "basil_discord_rest_calls_total",
+    "Discord REST API calls made by the bot.",
+    ("method", "route", "status"),
+)
+
+DISCORD_REST_LATENCY = Histogram(
+    "basil_discord_rest_duration_seconds",
+    "Latency of Discord REST API calls, including time spent rate-limited.",
+    ("method", "route"),
+)
+
+GATEWAY_LATENCY = Gauge(
+    "basil_discord_gateway_latency_seconds",
+    "Latency between a gateway heartbeat and its acknowledgement.",
+)
+
 
 class BasilClient(discord.Client):
     perms_integer = 85056
     ready = False
+    presence_task: Optional[asyncio.Task] = None
+    directory_task: Optional[asyncio.Task] = None
+    search_index_task: Optional[asyncio.Task] = None
+    recompress_task: Optional[asyncio.Task] = None
+    gc_task: Optional[asyncio.Task] = None
+    digest_task: Optional[asyncio.Task] = None
+    loop_monitor_task: Optional[asyncio.Task] = None
 
     _inst: Optional[BasilClient] = None
 
@@ -36,6 +75,12 @@ class BasilClient(discord.Client):
         BasilClient._inst = self
         super().__init__(*args, **kwargs)
 
+        self.rest = RESTGateway(self)
+        self._instrument_http()
+        GATEWAY_LATENCY.set_function(
+            lambda: self.latency if math.isfinite(self.latency) else 0
+        )
+
     @classmethod
     def get(cls) -> BasilClient:
         """Get the global BasilClient instance."""
@@ -44,6 +89,28 @@ class BasilClient(discord.Client):
         else:
             return cls._inst
 
+    def _instrument_http(self):
+        """Record counts and latencies for all Discord REST API calls."""
+        request = self.http.request
+
+        async def instrumented_request(route, **kwargs):
+            status = "error"
+            start = time.perf_counter()
+            try:
+                ret = await request(route, **kwargs)
+                status = "ok"
+                return ret
+            except discord.HTTPException as e:
+                status = str(e.status)
+                raise
+            finally:
+                DISCORD_REST_CALLS.labels(route.method, route.path, status).inc()
+                DISCORD_REST_LATENCY.labels(route.method, route.path).observe(
+                    time.perf_counter() - start
+                )
+
+        self.http.request = instrumented_request
+
     async def update_presence_loop(self):
         ctr = 0
         while True:
@@ -81,13 +148,30 @@ class BasilClient(discord.Client):
             )
         )
 
-        self.redis = aioredis.from_url(
-            config.primary_redis_url, encoding="utf-8", decode_responses=True
-        )
+        # on_ready is called again after every reconnect
+        self.redis = redis_pool.get_redis()
 
         await check_series_schema(self.redis)
+        await check_subscription_schema(self.redis)
         await scan_message_channels(self, self.redis)
-        asyncio.create_task(self.update_presence_loop())
+        if self.search_index_task is None:
+            self.search_index_task = asyncio.create_task(check_search_index(self.redis))
+        if self.recompress_task is None:
+            self.recompress_task = asyncio.create_task(
+                codec.check_content_encoding(self.redis)
+            )
+        if self.gc_task is None:
+            self.gc_task = asyncio.create_task(snippet_gc.collect_loop(self.redis))
+        if self.loop_monitor_task is None:
+            self.loop_monitor_task = asyncio.create_task(offload.monitor_loop())
+        if self.digest_task is None:
+            self.digest_task = asyncio.create_task(notify.digest_loop(self, self.redis))
+        if self.presence_task is None:
+            self.presence_task = asyncio.create_task(self.update_presence_loop())
+        if self.directory_task is None:
+            self.directory_task = asyncio.create_task(
+                directory.publish_loop(self, self.redis)
+            )
 
         self.ready = True
 
@@ -112,18 +196,17 @@ class BasilClient(discord.Client):
         except SnippetNotFound:
             return
 
-        channel: discord.abc.Messageable = self.get_channel(channel_id)
-        message: discord.Message = await channel.fetch_message(msg_id)
+        self.rest.invalidate(msg_id)
+        try:
+            message = await self.rest.fetch_message(channel_id, msg_id)
+        except (discord.NotFound, discord.Forbidden):
+            return
 
         snippet.content = message.content
         await snippet.save()
 
 
-@web.app.before_server_start
-async def start_bot(app, loop):
-    client = BasilClient(activity=discord.Game("Starting..."), intents=INTENTS)
-
-    # Initialize logging handlers:
+def setup_logging():
     handler = logging.FileHandler(
         filename=config.discord_log, encoding="utf-8", mode="w"
     )
@@ -138,9 +221,43 @@ async def start_bot(app, loop):
     )
     bot_root_logger.addHandler(handler)
 
+
+async def start_bot(app, loop):
+    client = BasilClient(activity=discord.Game("Starting..."), intents=INTENTS)
+    setup_logging()
+
     app.ctx.client = client
     app.add_task(client.start(config.token))
 
 
-def app_main():
-    return web.app.run(host="0.0.0.0", port=8080)
+def app_main(mode: str = "all"):
+    """Run Basil.
+
+    In "all" mode, the bot and a single web worker share one process. In
+    "bot" and "web" modes, each runs on its own, with the web API served by
+    `config.web_workers` worker processes that get Discord data from the bot
+    through Redis (see `basil.directory`).
+    """
+    if mode == "all":
+        web.app.register_listener(start_bot, "before_server_start")
+        return web.app.run(host="0.0.0.0", port=8080)
+    elif mode == "bot":
+        return bot_main()
+    elif mode == "web":
+        return web.app.run(host="0.0.0.0", port=8080, workers=config.web_workers)
+    else:
+        raise ValueError("Unknown run mode " + repr(mode))
+
+
+def bot_main():
+    setup_logging()
+
+    async def run_bot():
+        client = BasilClient(activity=discord.Game("Starting..."), intents=INTENTS)
+        try:
+            await client.start(config.token)
+        finally:
+            await client.close()
+            await redis_pool.close()
+
+    asyncio.run(run_bot())
@@ -0,0 +1,344 @@
+"""Proxying and caching of snippet image attachments.
+
+Snippets store the Discord CDN URLs of their image attachments. Rather than
+have every reader fetch these from the CDN, the web server serves them from
+`/media/<message ID>/<n>`, backed by a size-bounded cache on disk.
+
+Each cached attachment is one file, named by the SHA-256 hash of its upstream
+URL, holding its content type on the first line and its content after that.
+Attachment URLs on the CDN are immutable, so entries never need revalidating.
+Reading an entry bumps its modification time, which the cache uses as its LRU
+clock; since that is shared through the filesystem, every web worker can
+evict from the same directory. When a worker's count of the bytes it has
+seen on disk exceeds the limit, it rescans the directory and deletes the
+least recently used files until it is back under the low-water mark.
+
+Fetching from upstream goes through a `Fetcher`, so that tests and
+benchmarks can substitute their own. `b!register` queues the snippets it
+saves in the `media:prefetch` set, and web workers fetch their attachments
+in the background so the first reader does not have to wait for them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Iterable, List, Optional, Tuple
+import urllib.parse
+
+import aiohttp
+import aioredis
+
+from . import offload
+from .metrics import Counter, Gauge
+from .singleflight import SingleFlight
+from .snippet import IMAGE_ATTACHMENT_TYPES, Snippet
+
+PREFETCH_KEY = "media:prefetch"
+
+# Snippets taken from the prefetch queue at once, and seconds to wait when
+# the queue is empty.
+PREFETCH_BATCH = 20
+PREFETCH_INTERVAL = 5
+
+# Largest attachment the proxy will serve, in bytes.
+MAX_MEDIA_SIZE = 25 * 1024 * 1024
+
+# Seconds to wait for an upstream fetch.
+FETCH_TIMEOUT = 30
+
+# Reads only bump an entry's modification time if it is at least this many
+# seconds old, so that popular entries are not rewritten on every request.
+TOUCH_INTERVAL = 60 * 60
+
+# Eviction deletes entries until the cache is at most this fraction of its
+# maximum size, so that it does not need to rescan on every write.
+EVICTION_LOW_WATER = 0.9
+
+# Longest content type accepted in a cache file's header line.
+MAX_HEADER_LENGTH = 128
+
+MEDIA_REQUESTS = Counter(
+    "basil_media_cache_requests_total",
+    "Attachment cache lookups, by whether the attachment was on disk.",
+    ("result",),
+)
+
+MEDIA_FETCH_ERRORS = Counter(
+    "basil_media_fetch_errors_total",
+    "Attachment fetches from upstream that failed.",
+)
+
+MEDIA_EVICTIONS = Counter(
+    "basil_media_cache_evictions_total",
+    "Attachments deleted from the disk cache to stay within its size limit.",
+)
+
+MEDIA_CACHE_BYTES = Gauge(
+    "basil_media_cache_bytes",
+    "Size of the attachment disk cache as of its last scan, plus writes since.",
+)
+
+
+class MediaNotFound(Exception):
+    pass
+
+
+class MediaUnavailable(Exception):
+    """Upstream could not be reached, or returned something unusable."""
+
+    pass
+
+
+async def load_attachment_urls(
+    redis: aioredis.Redis, message_id: int
+) -> Optional[List[str]]:
+    attachment_list = await redis.get("snippet:" + str(message_id) + ":attachments")
+    if attachment_list is None:
+        return None
+    return json.loads(attachment_list)
+
+
+class Fetcher(object):
+    """Fetches attachment content from upstream."""
+
+    async def fetch(self, url: str) -> Tuple[str, bytes]:
+        """Get the content type and content at a URL.
+
+        Raises MediaNotFound if upstream does not have it, and
+        MediaUnavailable for any other failure.
+        """
+        raise NotImplementedError()
+
+
+class HTTPFetcher(Fetcher):
+    """Fetches attachments over HTTP.
+
+    If `origin` is given, the scheme and host of each URL are replaced with
+    it, so that a local server can stand in for the CDN.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, origin: Optional[str] = None):
+        self.session: aiohttp.ClientSession = session
+        self.origin: Optional[str] = origin
+
+    def upstream_url(self, url: str) -> str:
+        if not self.origin:
+            return url
+
+        parts = urllib.parse.urlsplit(url)
+        origin = urllib.parse.urlsplit(self.origin)
+        return urllib.parse.urlunsplit(
+            (origin.scheme, origin.netloc, parts.path, parts.query, "")
+        )
+
+    async def fetch(self, url: str) -> Tuple[str, bytes]:
+        try:
+            async with self.session.get(
+                self.upstream_url(url),
+                timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+            ) as resp:
+                if resp.status in (403, 404):
+                    raise MediaNotFound(url)
+                elif resp.status != 200:
+                    raise MediaUnavailable(
+                        "Upstream returned status {} for {}".format(resp.status, url)
+                    )
+
+                if resp.content_type not in IMAGE_ATTACHMENT_TYPES:
+                    raise MediaUnavailable(
+                        "Upstream returned {} for {}".format(resp.content_type, url)
+                    )
+
+                if (resp.content_length or 0) > MAX_MEDIA_SIZE:
+                    raise MediaUnavailable("Attachment is too large: " + url)
+
+                data = bytearray()
+                async for chunk in resp.content.iter_chunked(65536):
+                    data.extend(chunk)
+                    if len(data) > MAX_MEDIA_SIZE:
+                        raise MediaUnavailable("Attachment is too large: " + url)
+
+                return resp.content_type, bytes(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise MediaUnavailable("Could not fetch " + url) from e
+
+
+def media_etag(key: str) -> str:
+    # cache keys are derived from immutable upstream URLs
+    return '"' + key[:32] + '"'
+
+
+class MediaEntry(object):
+    def __init__(self, key: str, content_type: str, data: bytes):
+        self.content_type: str = content_type
+        self.data: bytes = data
+        self.etag: str = media_etag(key)
+
+
+class MediaCache(object):
+    """A size-bounded LRU cache of attachments on disk."""
+
+    def __init__(self, directory: Path, max_bytes: int, fetcher: Fetcher):
+        self.directory: Path = Path(directory)
+        self.max_bytes: int = max_bytes
+        self.fetcher: Fetcher = fetcher
+        # None until the directory is first scanned
+        self.size: Optional[int] = None
+
+        self._fetches: SingleFlight[MediaEntry] = SingleFlight()
+        self._evict_lock = asyncio.Lock()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory.joinpath(key[:2], key)
+
+    def _read(self, key: str) -> Optional[MediaEntry]:
+        path = self.path(key)
+        try:
+            with path.open("rb") as f:
+                content_type = f.readline(MAX_HEADER_LENGTH).decode("utf-8").strip()
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+
+            if time.time() - mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            # never cached, or evicted by another worker
+            return None
+
+        return MediaEntry(key, content_type, data)
+
+    def _write(self, key: str, content_type: str, data: bytes) -> int:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_name("{}.{}.tmp".format(key, os.getpid()))
+        with tmp_path.open("wb") as f:
+            f.write(content_type.encode("utf-8") + b"\n")
+            f.write(data)
+            size = f.tell()
+        os.replace(tmp_path, path)
+
+        return size
+
+    def _evict(self) -> Tuple[int, int]:
+        """Rescan the cache directory and delete least recently used files
+        until it is under the low-water mark. Returns the size left on disk
+        and the number of files deleted.
+        """
+        entries: List[Tuple[float, int, str]] = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".tmp"):
+                    # still being written
+                    continue
+
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_LOW_WATER
+        evicted = 0
+        if total <= self.max_bytes:
+            return total, evicted
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+
+            try:
+                os.unlink(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return total, evicted
+
+    async def _account(self, written: int):
+        if self.size is not None and self.size + written <= self.max_bytes:
+            self.size += written
+            MEDIA_CACHE_BYTES.set(self.size)
+            return
+
+        async with self._evict_lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # metrics are not thread-safe, so they are updated here
+            self.size, evicted = await offload.run("media_evict", self._evict)
+            MEDIA_EVICTIONS.inc(evicted)
+            MEDIA_CACHE_BYTES.set(self.size)
+
+    async def _fetch(self, url: str, key: str) -> MediaEntry:
+        try:
+            content_type, data = await self.fetcher.fetch(url)
+        except MediaUnavailable:
+            MEDIA_FETCH_ERRORS.inc()
+            raise
+
+        written = await offload.run("media_write", self._write, key, content_type, data)
+        await self._account(written)
+        return MediaEntry(key, content_type, data)
+
+    async def get(self, url: str) -> MediaEntry:
+        """Get an attachment, fetching it from upstream if it is not cached.
+
+        Raises MediaNotFound or MediaUnavailable if it must be fetched and
+        that fails.
+        """
+        key = self.key(url)
+        entry = await offload.run("media_read", self._read, key)
+        if entry is not None:
+            MEDIA_REQUESTS.labels("hit").inc()
+            return entry
+
+        MEDIA_REQUESTS.labels("miss").inc()
+        return await self._fetches.run(key, lambda: self._fetch(url, key))
+
+    async def prefetch(self, url: str):
+        """Make sure an attachment is cached, without reading it."""
+        key = self.key(url)
+        if self._fetches.in_flight(key) or self.path(key).exists():
+            return
+
+        try:
+            await self._fetches.run(key, lambda: self._fetch(url, key))
+        except (MediaNotFound, MediaUnavailable) as e:
+            logging.warning("Could not prefetch attachment {}: {!r}".format(url, e))
+
+
+async def queue_prefetch(redis: aioredis.Redis, snippets: Iterable[Snippet]):
+    """Queue the attachments of snippets to be cached in the background."""
+    message_ids = [s.message_id for s in snippets if len(s.attachment_urls) > 0]
+    if len(message_ids) > 0:
+        await redis.sadd(PREFETCH_KEY, *message_ids)
+
+
+async def prefetch_loop(redis: aioredis.Redis, cache: MediaCache):
+    while True:
+        try:
+            message_ids = await redis.spop(PREFETCH_KEY, PREFETCH_BATCH)
+            if not message_ids:
+                await asyncio.sleep(PREFETCH_INTERVAL)
+                continue
+
+            for message_id in message_ids:
+                for url in (await load_attachment_urls(redis, int(message_id))) or []:
+                    await cache.prefetch(url)
+        except Exception:
+            logging.exception("Caught exception while prefetching attachments")
+            await asyncio.sleep(PREFETCH_INTERVAL)
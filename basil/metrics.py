@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], **extra: str) -> str:
+    pairs = [
+        '{}="{}"'.format(name, _escape_label(value))
+        for name, value in zip(names, values)
+    ]
+    pairs.extend('{}="{}"'.format(name, _escape_label(v)) for name, v in extra.items())
+
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    """Base class for all metric types.
+
+    Metrics are keyed by a tuple of label values; children for each label
+    combination are created lazily on first use. Updating a metric is a dict
+    lookup plus an addition, so it is cheap enough to leave on in hot paths.
+    """
+
+    metric_type: str = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = tuple(),
+        registry: Optional[Registry] = None,
+    ):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+        if registry is None:
+            registry = REGISTRY
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        try:
+            return self._children[key]
+        except KeyError:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    "Incorrect label count for metric {} (expected {}, got {})".format(
+                        self.name, len(self.labelnames), len(key)
+                    )
+                )
+
+            child = self._new_child()
+            self._children[key] = child
+            return child
+
+    def _default_child(self):
+        return self.labels()
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation.replace("\n", " ")),
+            "# TYPE {} {}".format(self.name, self.metric_type),
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _CounterChild(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default_child().inc(amount)
+
+    def samples(self) -> Iterable[str]:
+        for key, child in self._children.items():
+            yield "{}{} {}".format(
+                self.name,
+                _format_labels(self.labelnames, key),
+                _format_value(child.value),
+            )
+
+
+class _GaugeChild(object):
+    __slots__ = ("value", "func")
+
+    def __init__(self):
+        self.value: float = 0
+        self.func: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, func: Callable[[], float]):
+        """Compute this gauge's value by calling `func` at collection time."""
+        self.func = func
+
+    def get(self) -> float:
+        if self.func is not None:
+            return self.func()
+        return self.value
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default_child().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default_child().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default_child().dec(amount)
+
+    def set_function(self, func: Callable[[], float]):
+        self._default_child().set_function(func)
+
+    def samples(self) -> Iterable[str]:
+        for key, child in self._children.items():
+            yield "{}{} {}".format(
+                self.name,
+                _format_labels(self.labelnames, key),
+                _format_value(child.get()),
+            )
+
+
+class _Timer(object):
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+        self.start: float = 0
+
+    def __enter__(self) -> _Timer:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class _HistogramChild(object):
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds: Tuple[float, ...] = upper_bounds
+        self.counts: List[int] = [0] * (len(upper_bounds) + 1)
+        self.sum: float = 0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        """Observe the wall-clock duration of a `with` block."""
+        return _Timer(self)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = tuple(),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        registry: Optional[Registry] = None,
+    ):
+        self.upper_bounds: Tuple[float, ...] = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._default_child().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default_child().time()
+
+    def samples(self) -> Iterable[str]:
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(self.labelnames, key, le=_format_value(bound)),
+                    cumulative,
+                )
+
+            labels = _format_labels(self.labelnames, key)
+            yield "{}_sum{} {}".format(self.name, labels, _format_value(child.sum))
+            yield "{}_count{} {}".format(self.name, labels, child.count)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise KeyError("metric already registered: " + metric.name)
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render all registered metrics in the Prometheus text exposition format."""
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
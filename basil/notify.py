@@ -0,0 +1,235 @@
+"""Series update notifications for subscribers.
+
+Each subscriber chooses a digest mode. In "immediate" mode, they are sent a DM
+as soon as a series they follow is updated. In "hourly" and "daily" mode,
+updates accumulate in a `notify:pending:<user ID>` sorted set, mapping each
+updated series tag to the number of new snippets, and a periodic sender
+emits one consolidated DM per user when their window ends.
+
+`notify:due` is a sorted set of the users with pending updates, scored by
+the time their digest should be sent.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+import urllib.parse
+
+import aioredis
+import discord
+
+from . import subscriptions
+from .config import config
+from .helper import fit_message
+from .metrics import Counter
+
+MODES_KEY = "notify:modes"
+DUE_KEY = "notify:due"
+PENDING_PREFIX = "notify:pending:"
+
+# Digest modes, and the length in seconds of each mode's window.
+DIGEST_WINDOWS: Dict[str, int] = {
+    "immediate": 0,
+    "hourly": 60 * 60,
+    "daily": 24 * 60 * 60,
+}
+DEFAULT_MODE = "immediate"
+
+# Seconds between checks for due digests.
+DIGEST_INTERVAL = 60
+
+# Seconds to wait between digest DMs, to stay clear of Discord rate limits.
+DIGEST_SEND_DELAY = 0.5
+
+# Seconds to wait before retrying a digest that could not be sent.
+DIGEST_RETRY_DELAY = 15 * 60
+
+NOTIFICATIONS_SENT = Counter(
+    "basil_notifications_sent_total",
+    "Series update DMs sent to subscribers.",
+    ("mode",),
+)
+
+NOTIFICATIONS_QUEUED = Counter(
+    "basil_notifications_queued_total",
+    "Series updates queued for subscriber digests.",
+)
+
+
+async def get_mode(redis: aioredis.Redis, user_id: int) -> str:
+    return (await redis.hget(MODES_KEY, str(user_id))) or DEFAULT_MODE
+
+
+async def set_mode(redis: aioredis.Redis, user_id: int, mode: str):
+    if mode not in DIGEST_WINDOWS:
+        raise ValueError("Unknown digest mode " + repr(mode))
+
+    async with redis.pipeline(transaction=True) as tr:
+        if mode == DEFAULT_MODE:
+            tr.hdel(MODES_KEY, str(user_id))
+            # send anything still pending at the next check
+            tr.zadd(DUE_KEY, {str(user_id): 0}, xx=True)
+        else:
+            tr.hset(MODES_KEY, str(user_id), mode)
+        await tr.execute()
+
+
+def window_end(mode: str, now: float) -> float:
+    """Get the end of the digest window containing a time (in UTC)."""
+    window = DIGEST_WINDOWS[mode]
+    return (math.floor(now / window) + 1) * window
+
+
+def series_url(tag: str) -> str:
+    return urllib.parse.urljoin(
+        config.api_base_url, "/series/" + urllib.parse.quote(tag)
+    )
+
+
+async def send_dm(client: discord.Client, user_id: int, message: str) -> bool:
+    user: Optional[discord.User] = client.get_user(user_id)
+    if user is None:
+        return False
+
+    try:
+        await user.send(message)
+        return True
+    except Exception:
+        logging.error("Caught error when sending update notifications", exc_info=True)
+        return False
+
+
+async def notify_subscribers(
+    client: discord.Client,
+    redis: aioredis.Redis,
+    tag: str,
+    title: str,
+    subscriber_ids: List[int],
+    n_snippets: int,
+):
+    """Notify the subscribers of a series that snippets were added to it."""
+    if len(subscriber_ids) == 0:
+        return
+
+    subscriber_ids = sorted(subscriber_ids)
+    modes = await redis.hmget(MODES_KEY, [str(i) for i in subscriber_ids])
+    now = time.time()
+
+    immediate = []
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id, mode in zip(subscriber_ids, modes):
+            mode = mode or DEFAULT_MODE
+            if DIGEST_WINDOWS.get(mode, 0) == 0:
+                immediate.append(user_id)
+                continue
+
+            pipe.zincrby(PENDING_PREFIX + str(user_id), n_snippets, tag)
+            # only the first pending update sets when the digest is due
+            pipe.zadd(DUE_KEY, {str(user_id): window_end(mode, now)}, nx=True)
+        await pipe.execute()
+
+    NOTIFICATIONS_QUEUED.inc(len(subscriber_ids) - len(immediate))
+
+    message = "ℹ️  Snippet series **{}** has updated!\n**Link to series:** {}".format(
+        title, series_url(tag)
+    )
+    for user_id in immediate:
+        if await send_dm(client, user_id, message):
+            NOTIFICATIONS_SENT.labels("immediate").inc()
+
+
+async def take_pending(redis: aioredis.Redis, user_id: int) -> List[Tuple[str, int]]:
+    """Atomically remove and return a user's pending updates."""
+    pending_key = PENDING_PREFIX + str(user_id)
+    async with redis.pipeline(transaction=True) as tr:
+        tr.zrange(pending_key, 0, -1, withscores=True)
+        tr.delete(pending_key)
+        tr.zrem(DUE_KEY, str(user_id))
+        pending, _, _ = await tr.execute()
+    return [(tag, int(count)) for tag, count in pending]
+
+
+async def restore_pending(
+    redis: aioredis.Redis, user_id: int, pending: List[Tuple[str, int]]
+):
+    """Put back updates taken by `take_pending`, to retry them later."""
+    pending_key = PENDING_PREFIX + str(user_id)
+    async with redis.pipeline(transaction=True) as tr:
+        for tag, count in pending:
+            # add to any updates queued since they were taken
+            tr.zincrby(pending_key, count, tag)
+        tr.zadd(DUE_KEY, {str(user_id): time.time() + DIGEST_RETRY_DELAY})
+        await tr.execute()
+
+
+def format_digest(updates: List[Tuple[str, str, int]]) -> str:
+    return fit_message(
+        ["ℹ️  **Series you follow have updated:**"],
+        [
+            "-    **{}**: {} new snippet{} ({})".format(
+                discord.utils.escape_markdown(title),
+                count,
+                "s" if count != 1 else "",
+                series_url(tag),
+            )
+            for tag, title, count in updates
+        ],
+    )
+
+
+async def send_digest(client: discord.Client, redis: aioredis.Redis, user_id: int):
+    pending = await take_pending(redis, user_id)
+    if len(pending) == 0:
+        return
+
+    # drop series unsubscribed from, renamed or deleted since they updated
+    subscribed = await subscriptions.get_subscriptions(redis, user_id)
+    pending = [(tag, count) for tag, count in pending if tag in subscribed]
+    if len(pending) == 0:
+        return
+
+    titles = await redis.mget(["series:" + tag + ":title" for tag, _ in pending])
+    updates = sorted(
+        (
+            (tag, title or tag.replace("_", " ").replace("-", " ").strip(), count)
+            for (tag, count), title in zip(pending, titles)
+        ),
+        key=lambda u: u[1].lower(),
+    )
+
+    user: Optional[discord.User] = client.get_user(user_id)
+    if user is None:
+        return
+
+    try:
+        await user.send(format_digest(updates))
+        NOTIFICATIONS_SENT.labels("digest").inc()
+    except discord.Forbidden:
+        # DMs are closed; retrying will not help
+        logging.info("Could not send digest to user {}".format(user_id))
+    except Exception:
+        logging.error("Caught error when sending digest", exc_info=True)
+        await restore_pending(redis, user_id, pending)
+
+
+async def send_due_digests(client: discord.Client, redis: aioredis.Redis) -> int:
+    """Send every digest whose window has ended. Returns the number of users."""
+    user_ids = await redis.zrangebyscore(DUE_KEY, "-inf", time.time())
+    for user_id in user_ids:
+        await send_digest(client, redis, int(user_id))
+        await asyncio.sleep(DIGEST_SEND_DELAY)
+    return len(user_ids)
+
+
+async def digest_loop(client: discord.Client, redis: aioredis.Redis):
+    while True:
+        try:
+            await send_due_digests(client, redis)
+        except Exception:
+            logging.exception("Caught exception while sending digests")
+
+        await asyncio.sleep(DIGEST_INTERVAL)
@@ -0,0 +1,114 @@
+"""Running CPU-heavy work off the event loop.
+
+The Discord gateway, the web server and all commands share one event loop, so
+a long computation on it delays gateway heartbeats and every other request.
+`run` moves such work to a small thread pool when its input is large enough
+for that to be worthwhile; small inputs are handled inline, since handing
+them to a thread costs more than it saves.
+
+Offloaded functions still hold the GIL while running Python code, but the
+interpreter switches threads every few milliseconds, so the loop keeps
+running instead of stalling until the work is done. A process pool would
+avoid the GIL entirely, but the inputs here (series and snippet objects
+holding Redis clients) cannot be pickled.
+
+`monitor_loop` measures how long the loop is blocked, by timing how late a
+periodic sleep wakes up.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+from .config import config
+from .metrics import Counter, Gauge, Histogram
+
+T = TypeVar("T")
+
+# Seconds between loop lag measurements.
+LAG_SAMPLE_INTERVAL = 0.5
+
+OFFLOADED_CALLS = Histogram(
+    "basil_offloaded_call_duration_seconds",
+    "Duration of work run in the offload thread pool, including queueing.",
+    ("task",),
+)
+
+INLINE_CALLS = Counter(
+    "basil_offload_inline_calls_total",
+    "Calls run on the event loop because their input was below the threshold.",
+    ("task",),
+)
+
+LOOP_LAG = Gauge(
+    "basil_event_loop_lag_seconds",
+    "How late the most recent event loop lag sample woke up.",
+)
+
+LOOP_BLOCKED = Counter(
+    "basil_event_loop_blocked_seconds_total",
+    "Time the event loop was blocked, estimated from late wakeups.",
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.offload_workers, thread_name_prefix="basil-offload"
+        )
+    return _executor
+
+
+def should_offload(size: Optional[int]) -> bool:
+    return size is None or size >= config.offload_threshold
+
+
+async def run(
+    task: str, func: Callable[..., T], *args: Any, size: Optional[int] = None
+) -> T:
+    """Run `func(*args)`, in the offload pool if `size` is at least the
+    configured threshold or is None, and on the event loop otherwise.
+
+    `size` should be roughly proportional to the work involved, such as the
+    number of characters to process. `task` labels the call in metrics.
+    `func` may run in another thread, so it must not update metrics, which
+    are not thread-safe.
+    """
+    if not should_offload(size):
+        INLINE_CALLS.labels(task).inc()
+        return func(*args)
+
+    # timed here rather than in the pool thread, since metrics are not
+    # thread-safe; this includes any time spent waiting for a free thread
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        OFFLOADED_CALLS.labels(task).observe(time.perf_counter() - start)
+
+
+async def monitor_loop():
+    """Sample event loop lag forever."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+
+        lag = max(0.0, time.perf_counter() - start - LAG_SAMPLE_INTERVAL)
+        LOOP_LAG.set(lag)
+        LOOP_BLOCKED.inc(lag)
+
+
+def shutdown():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Optional
+
+import aioredis
+from aioredis.client import Pipeline
+from aioredis.exceptions import TimeoutError
+
+from . import tracing
+from .metrics import Counter, Histogram
+
+REDIS_COMMANDS = Counter(
+    "basil_redis_commands_total",
+    "Redis commands sent, including commands sent as part of a pipeline.",
+    ("command",),
+)
+
+REDIS_LATENCY = Histogram(
+    "basil_redis_roundtrip_seconds",
+    "Latency of Redis round trips. Pipelines are recorded as a single round trip.",
+    ("command",),
+)
+
+REDIS_ERRORS = Counter(
+    "basil_redis_errors_total",
+    "Redis round trips that raised an exception.",
+    ("command",),
+)
+
+
+def _command_name(args) -> str:
+    name = args[0]
+    if isinstance(name, bytes):
+        name = name.decode("utf-8", "replace")
+    return name.upper()
+
+
+async def _with_deadline(aw, timeout: Optional[float]):
+    """Await a command, raising aioredis' TimeoutError if it takes too long.
+
+    A cancelled command disconnects its connection, so the connection is not
+    reused with a reply still pending.
+    """
+    if timeout is None:
+        return await aw
+
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError("Redis command timed out") from None
+
+
+class InstrumentedPipeline(Pipeline):
+    command_timeout: Optional[float] = None
+
+    async def execute(self, raise_on_error: bool = True):
+        label = (
+            "MULTI" if (self.transaction or self.explicit_transaction) else "PIPELINE"
+        )
+        for args, _ in self.command_stack:
+            REDIS_COMMANDS.labels(_command_name(args)).inc()
+
+        if len(self.command_stack) > 0:
+            args = self.command_stack[0][0]
+            shape = label + " [" + tracing.command_shape(_command_name(args), args)
+            if len(self.command_stack) > 1:
+                shape += ", ..."
+            shape += "]"
+        else:
+            shape = label
+
+        start = time.perf_counter()
+        try:
+            return await _with_deadline(
+                super().execute(raise_on_error), self.command_timeout
+            )
+        except Exception:
+            REDIS_ERRORS.labels(label).inc()
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            REDIS_LATENCY.labels(label).observe(duration)
+
+            trace = tracing.current_trace()
+            if trace is not None:
+                trace.record(shape, duration)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """A Redis client that records per-command counts and latencies.
+
+    Each round trip is also attributed to the command or HTTP request being
+    handled in the current context (see `basil.tracing`).
+
+    If `command_timeout` is set, each command or pipeline that takes longer
+    raises `aioredis.exceptions.TimeoutError`.
+    """
+
+    def __init__(self, *args, command_timeout: Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.command_timeout: Optional[float] = command_timeout
+
+    async def execute_command(self, *args, **options):
+        command = _command_name(args)
+        REDIS_COMMANDS.labels(command).inc()
+
+        start = time.perf_counter()
+        try:
+            return await _with_deadline(
+                super().execute_command(*args, **options), self.command_timeout
+            )
+        except Exception:
+            REDIS_ERRORS.labels(command).inc()
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            REDIS_LATENCY.labels(command).observe(duration)
+            tracing.record_roundtrip(command, args, duration)
+
+    def pipeline(
+        self, transaction: bool = True, shard_hint: str = None
+    ) -> InstrumentedPipeline:
+        pipe = InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+        pipe.command_timeout = self.command_timeout
+        return pipe
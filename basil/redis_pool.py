@@ -0,0 +1,161 @@
+"""The process-wide Redis connection pool.
+
+The bot and the web app share one client (and one bounded pool of
+connections) per process, obtained through `get_redis`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aioredis import BlockingConnectionPool
+from aioredis.exceptions import ConnectionError, RedisError
+
+from .config import config
+from .metrics import Counter, Gauge, Histogram
+from .redis_client import InstrumentedRedis
+
+POOL_WAIT = Histogram(
+    "basil_redis_pool_wait_seconds",
+    "Time spent acquiring a connection from the Redis pool, including connecting.",
+)
+
+POOL_TIMEOUTS = Counter(
+    "basil_redis_pool_timeouts_total",
+    "Connection acquisitions that timed out because the Redis pool was exhausted.",
+)
+
+POOL_CONNECTIONS = Gauge(
+    "basil_redis_pool_connections",
+    "Connections in the Redis pool, by state.",
+    ("state",),
+)
+
+REDIS_UP = Gauge(
+    "basil_redis_up",
+    "Whether the most recent Redis health check succeeded.",
+)
+
+_redis: Optional[InstrumentedRedis] = None
+_health_task: Optional[asyncio.Task] = None
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """A bounded connection pool that records how long callers wait on it."""
+
+    def reset(self):
+        super().reset()
+        # BlockingConnectionPool.disconnect() expects this, but reset() does
+        # not create it.
+        self._lock = asyncio.Lock()
+
+    @property
+    def in_use(self) -> int:
+        return self.max_connections - self.pool.qsize()
+
+    @property
+    def open(self) -> int:
+        return len(self._connections)
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except ConnectionError:
+            if self.timeout is not None and time.perf_counter() - start >= self.timeout:
+                POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def pool_options() -> Dict[str, Any]:
+    """Connection pool settings from the config file."""
+    return {
+        "max_connections": config.redis_max_connections,
+        "timeout": config.redis_pool_timeout,
+        "socket_connect_timeout": config.redis_connect_timeout,
+        "health_check_interval": config.redis_health_check_interval,
+    }
+
+
+def create_redis(
+    url: str, command_timeout: Optional[float] = None, **options
+) -> InstrumentedRedis:
+    """Create a client with its own connection pool.
+
+    Most code should use `get_redis` instead; this is for tools that connect
+    to a Redis server other than the configured one.
+    """
+    pool = InstrumentedConnectionPool.from_url(
+        url, encoding="utf-8", decode_responses=True, **options
+    )
+    return InstrumentedRedis(connection_pool=pool, command_timeout=command_timeout)
+
+
+def get_redis() -> InstrumentedRedis:
+    """Get the shared Redis client for this process, creating it if needed.
+
+    This must first be called from within a running event loop.
+    """
+    global _redis, _health_task
+
+    if _redis is None:
+        _redis = create_redis(
+            config.primary_redis_url,
+            command_timeout=config.redis_socket_timeout,
+            **pool_options(),
+        )
+
+        if config.redis_health_check_interval > 0:
+            _health_task = asyncio.ensure_future(
+                _health_check_loop(_redis, config.redis_health_check_interval)
+            )
+
+    return _redis
+
+
+async def close():
+    """Stop health checks and disconnect all pooled connections."""
+    global _redis, _health_task
+
+    if _health_task is not None:
+        _health_task.cancel()
+        _health_task = None
+
+    if _redis is not None:
+        redis, _redis = _redis, None
+        await redis.connection_pool.disconnect()
+
+
+async def _health_check_loop(redis: InstrumentedRedis, interval: float):
+    # the client may not time out commands itself
+    timeout = config.redis_socket_timeout or config.redis_connect_timeout
+
+    healthy = True
+    while True:
+        try:
+            await asyncio.wait_for(redis.ping(), timeout)
+            if not healthy:
+                logging.info("Redis health check succeeded")
+            healthy = True
+        except (RedisError, asyncio.TimeoutError, OSError):
+            if healthy:
+                logging.warning("Redis health check failed", exc_info=True)
+            healthy = False
+
+        REDIS_UP.set(1 if healthy else 0)
+        await asyncio.sleep(interval)
+
+
+def _pool_stat(name: str) -> float:
+    if _redis is None:
+        return 0
+    return getattr(_redis.connection_pool, name)
+
+
+POOL_CONNECTIONS.labels("in_use").set_function(lambda: _pool_stat("in_use"))
+POOL_CONNECTIONS.labels("open").set_function(lambda: _pool_stat("open"))
@@ -0,0 +1,238 @@
+"""A shared gateway for fetching channels and messages from Discord's REST API.
+
+Every channel and message fetch goes through the client's `RESTGateway`
+(`client.rest`), which avoids REST calls where it can:
+
+- Channels are taken from the client's gateway cache when it has them.
+- Fetched messages are kept for a short time, along with any complete
+  message they reply to, so that walking a reply chain or registering the
+  same snippets again does not fetch them again. Edits invalidate them.
+- Concurrent fetches of the same message share one call.
+- When several messages are wanted from one channel, they are read with
+  `channel.history` over the range of their IDs, up to 100 per call.
+
+Discord rate limits message reads per channel, so calls for one channel are
+limited to a few at a time; any more would only queue inside discord.py's
+bucket lock. Calls avoided are counted in
+`basil_discord_rest_calls_saved_total`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+from typing import Dict, Iterable, List, Tuple
+import weakref
+
+import discord
+
+from .cache import TTLCache
+from .metrics import Counter
+from .singleflight import SingleFlight
+
+# Recently fetched messages, keyed by ID. Kept briefly, since messages
+# edited while the bot is disconnected are not invalidated.
+MESSAGE_CACHE_SIZE = 2000
+MESSAGE_CACHE_TTL = 60
+
+# REST calls allowed in flight for one channel at once.
+CHANNEL_CONCURRENCY = 2
+
+# Messages returned by one call to Discord's channel history endpoint.
+HISTORY_PAGE_SIZE = 100
+
+# Batches of at least this many uncached messages are read from channel
+# history. A batch may read up to half as many pages as it has messages,
+# so reading the history never takes more calls than fetching each message.
+HISTORY_MIN_MESSAGES = 3
+
+MESSAGE_FETCHES = Counter(
+    "basil_discord_message_fetches_total",
+    "Messages requested through the REST gateway, by how they were served.",
+    ("source",),
+)
+
+CALLS_SAVED = Counter(
+    "basil_discord_rest_calls_saved_total",
+    "Discord REST calls avoided by the REST gateway, by reason.",
+    ("reason",),
+)
+
+
+def is_complete(message: discord.Message) -> bool:
+    """Check whether a message has its reply reference.
+
+    Messages nested in another message's reply reference may not, and so
+    cannot stand in for the message itself when walking reply chains.
+    """
+    # replies have their own message type, which discord.py 1.7 does not name
+    return message.type == discord.MessageType.default or message.reference is not None
+
+
+class RESTGateway(object):
+    def __init__(self, client: discord.Client):
+        self.client: discord.Client = client
+        self.messages: TTLCache[discord.Message] = TTLCache(
+            MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL
+        )
+        self.saved_calls: int = 0
+
+        self._message_fetches: SingleFlight[discord.Message] = SingleFlight()
+        self._channel_fetches: SingleFlight[discord.abc.GuildChannel] = SingleFlight()
+        self._channel_limits: weakref.WeakValueDictionary[
+            int, asyncio.Semaphore
+        ] = weakref.WeakValueDictionary()
+
+    def _saved(self, reason: str, calls: int = 1):
+        if calls > 0:
+            CALLS_SAVED.labels(reason).inc(calls)
+            self.saved_calls += calls
+
+    def _channel_limit(self, channel_id: int) -> asyncio.Semaphore:
+        limit = self._channel_limits.get(channel_id)
+        if limit is None:
+            limit = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+            self._channel_limits[channel_id] = limit
+        return limit
+
+    def remember(self, message: discord.Message):
+        """Cache a message, and the message it replies to if that is complete."""
+        self.messages.set(message.id, message)
+
+        ref = message.reference
+        if ref is not None and isinstance(ref.resolved, discord.Message):
+            if is_complete(ref.resolved):
+                self.messages.set(ref.resolved.id, ref.resolved)
+
+    def invalidate(self, message_id: int):
+        self.messages.pop(message_id)
+
+    async def fetch_channel(self, channel_id: int) -> discord.abc.GuildChannel:
+        """Get a channel, fetching it if the client has not cached it.
+
+        Raises the same exceptions as `discord.Client.fetch_channel`.
+        """
+        channel = self.client.get_channel(channel_id)
+        if channel is not None:
+            self._saved("channel_cache")
+            return channel
+
+        if self._channel_fetches.in_flight(channel_id):
+            self._saved("shared")
+        return await self._channel_fetches.run(
+            channel_id, lambda: self.client.fetch_channel(channel_id)
+        )
+
+    async def _fetch_message(self, channel_id: int, message_id: int) -> discord.Message:
+        channel = await self.fetch_channel(channel_id)
+        async with self._channel_limit(channel_id):
+            message = await channel.fetch_message(message_id)
+
+        self.remember(message)
+        return message
+
+    async def fetch_message(self, channel_id: int, message_id: int) -> discord.Message:
+        """Get a message.
+
+        Raises the same exceptions as `discord.TextChannel.fetch_message`.
+        """
+        message = self.messages.get(message_id)
+        if message is not None:
+            MESSAGE_FETCHES.labels("cache").inc()
+            self._saved("cache")
+            return message
+
+        if self._message_fetches.in_flight(message_id):
+            MESSAGE_FETCHES.labels("shared").inc()
+            self._saved("shared")
+        else:
+            MESSAGE_FETCHES.labels("rest").inc()
+
+        return await self._message_fetches.run(
+            message_id, lambda: self._fetch_message(channel_id, message_id)
+        )
+
+    async def _read_history(
+        self, channel_id: int, message_ids: List[int]
+    ) -> Tuple[Dict[int, discord.Message], List[int]]:
+        """Read the channel history spanning some messages, sorted by ID.
+
+        Returns the messages found, and the IDs that may still be in the
+        channel because the history was not read as far as them.
+        """
+        channel = await self.fetch_channel(channel_id)
+        max_pages = len(message_ids) // 2
+        wanted = set(message_ids)
+        found = {}
+        scanned = 0
+        last_scanned = 0
+        exhausted = True
+        limit = max_pages * HISTORY_PAGE_SIZE
+
+        async with self._channel_limit(channel_id):
+            history = channel.history(
+                limit=limit,
+                after=discord.Object(message_ids[0] - 1),
+                oldest_first=True,
+            )
+
+            async for message in history:
+                scanned += 1
+                last_scanned = message.id
+                if message.id > message_ids[-1]:
+                    break
+
+                self.remember(message)
+                if message.id in wanted:
+                    found[message.id] = message
+                    wanted.discard(message.id)
+                    if len(wanted) == 0:
+                        break
+            else:
+                # out of messages: the end of the channel, or of the page limit
+                exhausted = scanned < limit
+
+        calls = max(1, math.ceil(scanned / HISTORY_PAGE_SIZE))
+        MESSAGE_FETCHES.labels("history").inc(len(found))
+
+        if exhausted:
+            # messages not in the range are not in this channel either
+            self._saved("history", len(message_ids) - calls)
+            return found, []
+
+        # messages before the last one read are not in this channel
+        remaining = sorted(i for i in wanted if i > last_scanned)
+        self._saved("history", len(message_ids) - len(remaining) - calls)
+        return found, remaining
+
+    async def fetch_messages(
+        self, channel_id: int, message_ids: Iterable[int]
+    ) -> Dict[int, discord.Message]:
+        """Get several messages from one channel, by ID.
+
+        Messages that are not in the channel are left out of the result.
+        Raises discord.Forbidden if the channel cannot be read.
+        """
+        ret: Dict[int, discord.Message] = {}
+        missing: List[int] = []
+
+        for message_id in sorted(set(message_ids)):
+            message = self.messages.get(message_id)
+            if message is not None:
+                MESSAGE_FETCHES.labels("cache").inc()
+                self._saved("cache")
+                ret[message_id] = message
+            else:
+                missing.append(message_id)
+
+        if len(missing) >= HISTORY_MIN_MESSAGES:
+            found, missing = await self._read_history(channel_id, missing)
+            ret.update(found)
+
+        for message_id in missing:
+            try:
+                ret[message_id] = await self.fetch_message(channel_id, message_id)
+            except discord.NotFound:
+                continue
+
+        return ret
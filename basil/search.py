@@ -0,0 +1,306 @@
+"""Full-text search over snippet content.
+
+Snippets are indexed in Redis whenever they are saved:
+
+- `search:postings:<term>` is a sorted set of snippet message IDs containing
+  the term, scored by the number of times it appears in each snippet.
+- `search:terms:<message ID>` is a hash of the term frequencies last indexed
+  for a snippet, used to update only the postings that change on edits.
+- `search:lengths` is a hash of snippet message IDs to token counts.
+- `search:stats` is a hash holding the number of indexed snippets ("docs")
+  and the sum of their lengths ("length").
+
+Queries are ranked with BM25. Each query takes a fixed number of round trips,
+independent of the number of terms or hits.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+import math
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aioredis
+
+from . import codec
+
+POSTINGS_PREFIX = "search:postings:"
+TERMS_PREFIX = "search:terms:"
+LENGTHS_KEY = "search:lengths"
+STATS_KEY = "search:stats"
+INDEX_VERSION_KEY = "search:version"
+
+# BM25 parameters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Only this many query terms are used.
+MAX_QUERY_TERMS = 8
+
+# Postings are read in descending order of term frequency, up to this many per
+# term. This bounds query cost for very common terms.
+MAX_POSTINGS_PER_TERM = 2000
+
+# Excerpts show this many characters before the first match, and this many
+# characters in total.
+EXCERPT_CONTEXT = 80
+EXCERPT_LENGTH = 240
+
+MENTION_REGEX = r"\<(?:\@[\!\&]?|\#|a?\:\w+\:)\d+\>"
+
+# Very common words are not indexed; their postings would be huge while
+# contributing almost nothing to rankings.
+STOPWORDS = frozenset(
+    """
+    a an and are as at be but by for from had has have he her his i if in into
+    is it its me my no not of on or our she so that the their them then there
+    they this to was we were what when which who will with you your
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized search terms."""
+    text = re.sub(MENTION_REGEX, " ", text).casefold()
+    return [
+        t
+        for t in re.findall(r"\w+", text)
+        if len(t) > 1 and t not in STOPWORDS and not t.startswith("_")
+    ]
+
+
+def term_frequencies(text: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(text)))
+
+
+async def index_snippet(redis: aioredis.Redis, message_id: int, content: str):
+    """Add or update a snippet in the search index."""
+    message_id = str(message_id)
+    terms_key = TERMS_PREFIX + message_id
+
+    new_tf = term_frequencies(content)
+    old_tf = {t: int(n) for t, n in (await redis.hgetall(terms_key)).items()}
+    if new_tf == old_tf:
+        return
+
+    new_length = sum(new_tf.values())
+    old_length = sum(old_tf.values())
+    doc_delta = int(len(new_tf) > 0) - int(len(old_tf) > 0)
+
+    async with redis.pipeline(transaction=True) as tr:
+        for term in old_tf.keys() - new_tf.keys():
+            tr.zrem(POSTINGS_PREFIX + term, message_id)
+
+        for term, count in new_tf.items():
+            if old_tf.get(term) != count:
+                tr.zadd(POSTINGS_PREFIX + term, {message_id: count})
+
+        tr.delete(terms_key)
+        if len(new_tf) > 0:
+            tr.hset(terms_key, mapping=new_tf)
+            tr.hset(LENGTHS_KEY, message_id, new_length)
+        else:
+            tr.hdel(LENGTHS_KEY, message_id)
+
+        if doc_delta != 0:
+            tr.hincrby(STATS_KEY, "docs", doc_delta)
+        if new_length != old_length:
+            tr.hincrby(STATS_KEY, "length", new_length - old_length)
+
+        await tr.execute()
+
+
+async def remove_snippet(redis: aioredis.Redis, message_id: int):
+    """Remove a snippet from the search index."""
+    await index_snippet(redis, message_id, "")
+
+
+class SearchHit(object):
+    def __init__(
+        self,
+        message_id: int,
+        score: float,
+        author_id: int,
+        channel_id: int,
+        series: List[Dict[str, str]],
+        excerpt: str,
+        highlights: List[Tuple[int, int]],
+    ):
+        self.message_id: int = message_id
+        self.score: float = score
+        self.author_id: int = author_id
+        self.channel_id: int = channel_id
+        self.series: List[Dict[str, str]] = series
+        self.excerpt: str = excerpt
+        self.highlights: List[Tuple[int, int]] = highlights
+
+    @property
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "message_id": self.message_id,
+            "score": self.score,
+            "author_id": self.author_id,
+            "channel_id": self.channel_id,
+            "series": self.series,
+            "excerpt": self.excerpt,
+            "highlights": [list(h) for h in self.highlights],
+        }
+
+    def highlighted(
+        self, start: str, end: str, escape: Optional[Callable[[str], str]] = None
+    ) -> str:
+        """Get the excerpt with highlighted spans wrapped in markers.
+
+        If given, `escape` is applied to the excerpt text, but not the markers.
+        """
+        if escape is None:
+            escape = lambda text: text
+
+        parts = []
+        prev = 0
+        for h_start, h_end in self.highlights:
+            parts.append(escape(self.excerpt[prev:h_start]))
+            parts.append(start + escape(self.excerpt[h_start:h_end]) + end)
+            prev = h_end
+        parts.append(escape(self.excerpt[prev:]))
+        return "".join(parts)
+
+
+def make_excerpt(
+    content: str, terms: Iterable[str]
+) -> Tuple[str, List[Tuple[int, int]]]:
+    """Cut an excerpt around the first match of any term.
+
+    Returns the excerpt and the (start, end) offsets of matches within it.
+    """
+    pattern = re.compile(
+        r"(?<!\w)(?:" + "|".join(re.escape(t) for t in terms) + r")(?!\w)",
+        re.IGNORECASE,
+    )
+
+    m = pattern.search(content)
+    start = 0 if m is None else max(0, m.start() - EXCERPT_CONTEXT)
+    if start > 0:
+        # don't start in the middle of a word
+        space = content.find(" ", start, m.start())
+        if space >= 0:
+            start = space + 1
+
+    end = min(len(content), start + EXCERPT_LENGTH)
+    if end < len(content):
+        space = content.rfind(" ", start, end)
+        if space > start:
+            end = space
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    excerpt = prefix + content[start:end] + suffix
+
+    highlights = [
+        (hit.start(), hit.end())
+        for hit in pattern.finditer(excerpt, len(prefix), len(prefix) + end - start)
+    ]
+    return excerpt, highlights
+
+
+def bm25(tf: float, df: int, doc_length: int, n_docs: int, avg_length: float) -> float:
+    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    norm = 1 - BM25_B + BM25_B * (doc_length / avg_length)
+    return idf * (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * norm)
+
+
+async def search(redis: aioredis.Redis, query: str, limit: int = 10) -> List[SearchHit]:
+    """Find the snippets that best match a query."""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if len(terms) == 0:
+        return []
+
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hmget(STATS_KEY, ["docs", "length"])
+        for term in terms:
+            pipe.zcard(POSTINGS_PREFIX + term)
+        for term in terms:
+            pipe.zrevrange(
+                POSTINGS_PREFIX + term, 0, MAX_POSTINGS_PER_TERM - 1, withscores=True
+            )
+        results = await pipe.execute()
+
+    n_docs, total_length = (int(v or 0) for v in results[0])
+    if n_docs == 0:
+        return []
+    avg_length = max(total_length / n_docs, 1)
+
+    dfs: List[int] = results[1 : len(terms) + 1]
+    postings: List[List[Tuple[str, float]]] = results[len(terms) + 1 :]
+
+    candidates: Set[str] = set()
+    for term_postings in postings:
+        candidates.update(message_id for message_id, _ in term_postings)
+    if len(candidates) == 0:
+        return []
+
+    candidates = list(candidates)
+    lengths = dict(zip(candidates, await redis.hmget(LENGTHS_KEY, candidates)))
+
+    scores: Dict[str, float] = {}
+    for df, term_postings in zip(dfs, postings):
+        for message_id, tf in term_postings:
+            doc_length = int(lengths[message_id] or avg_length)
+            scores[message_id] = scores.get(message_id, 0) + bm25(
+                tf, df, doc_length, n_docs, avg_length
+            )
+
+    # Fetch a few extra in case some snippets no longer belong to a series.
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    ranked = ranked[: limit * 2]
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for message_id, _ in ranked:
+            prefix = "snippet:" + message_id
+            pipe.get(prefix + ":content")
+            pipe.get(prefix + ":author")
+            pipe.get(prefix + ":channel")
+            pipe.smembers(prefix + ":series")
+        details = await pipe.execute()
+
+    hits = []
+    all_tags: Set[str] = set()
+    for i, (message_id, score) in enumerate(ranked):
+        content, author_id, channel_id, tags = details[4 * i : 4 * i + 4]
+        if content is None or len(tags) == 0:
+            continue
+        content = codec.decode(content)
+
+        excerpt, highlights = make_excerpt(content, terms)
+        hits.append(
+            SearchHit(
+                int(message_id),
+                score,
+                int(author_id or 0),
+                int(channel_id or 0),
+                sorted(tags),
+                excerpt,
+                highlights,
+            )
+        )
+        all_tags.update(tags)
+
+        if len(hits) >= limit:
+            break
+
+    all_tags = sorted(all_tags)
+    titles: Dict[str, Optional[str]] = {}
+    if len(all_tags) > 0:
+        titles = dict(
+            zip(
+                all_tags,
+                await redis.mget(["series:" + tag + ":title" for tag in all_tags]),
+            )
+        )
+
+    for hit in hits:
+        hit.series = [
+            {"tag": tag, "title": titles.get(tag) or tag} for tag in hit.series
+        ]
+    return hits
@@ -6,15 +6,33 @@ import difflib
 import discord
 import json
 import re
-from typing import Any, List, Optional, Union, Set, Dict, AsyncIterator, Iterator
+from typing import (
+    Any,
+    List,
+    Optional,
+    Union,
+    Set,
+    Dict,
+    AsyncIterator,
+    Iterator,
+    Iterable,
+    FrozenSet,
+)
 import time
 import urllib.parse
 
 from . import author as author_mod
+from . import codec
+from . import directory
+from . import events
+from . import offload
+from . import search
+from . import subscriptions
+from .subscriptions import SERIES_SUBSCRIBERS_PREFIX, USER_SUBSCRIPTIONS_PREFIX
 from .config import config
 from .commands import CommandContext
 from .snippet import Snippet
-from .helper import ContainsRedis, get_client, ensure_redis
+from .helper import ContainsRedis, get_client, has_client, ensure_redis
 
 SERIES_INDEX_KEY = "series_index"
 
@@ -24,6 +42,42 @@ TITLE_SUBINDEX_PREFIX = "series_title_index:sub:"
 NORMALIZED_INDEX_KEY = "series_index_norm:main"
 NORMALIZED_SUBINDEX_PREFIX = "series_index_norm:sub:"
 
+# Sorted sets of series tags, scored by update time, for all series and for
+# the series by each author.
+SERIES_UPDATES_KEY = "series_updates:main"
+AUTHOR_UPDATES_PREFIX = "series_updates:author:"
+
+# Optional parts of a series that can be loaded. A series' tag, authors and
+# snippet IDs are always loaded, since saving, renaming and deleting a series
+# need them to keep the indexes consistent. "snippets" loads each snippet in
+# full, while "channels" only loads the channels they were posted in, for
+# permission checks.
+SERIES_FIELDS: FrozenSet[str] = frozenset(
+    ["title", "updated", "subscribers", "snippets", "channels"]
+)
+
+# Suffix of the hash summarizing each series for listings. Snippet edits
+# delete the summaries of the series containing them, and summaries that are
+# missing are rebuilt when next read.
+SUMMARY_SUFFIX = ":summary"
+
+# Stores a rebuilt series summary, unless the series has changed since it was
+# loaded. Returns 1 if the summary was stored.
+#
+# KEYS[1] is the series version key.
+# KEYS[2] is the series summary key.
+#
+# ARGV[1] is the series version the summary was built from, or "" if unset.
+# ARGV[2...] are the summary's fields and values.
+SAVE_SUMMARY_SCRIPT = r"""
+if (redis.call("get", KEYS[1]) or "") ~= ARGV[1] then
+    return 0
+end
+
+redis.call("hset", KEYS[2], unpack(ARGV, 2))
+return 1
+"""
+
 # KEYS[1] is the series title key.
 # KEYS[2] is the main index key.
 # KEYS[3] is the title subindex key.
@@ -111,10 +165,128 @@ end
 """
 
 
+# Resolves an inexact series query for an author. Returns {"found", tag} if a
+# series matches, or {"ambiguous", tags...} listing every candidate of the
+# tag and title matches that had more than one candidate. Returns an empty
+# table if there are no matches at all.
+#
+# Tag matches are tried before title matches, and an exact tag match is
+# returned regardless of author.
+#
+# KEYS[1] is the snippets key of the series whose tag is the query.
+# KEYS[2] is the tag subindex key for the normalized query.
+# KEYS[3] is the title subindex key for the normalized query.
+# KEYS[4] is the author's update-time sorted set, listing all of their series.
+#
+# ARGV[1] is the query.
+RESOLVE_SCRIPT = r"""
+if redis.call("exists", KEYS[1]) == 1 then
+    return {"found", ARGV[1]}
+end
+
+local ambiguous = {}
+local seen = {}
+for i = 2, 3 do
+    local matches = {}
+    for _, tag in ipairs(redis.call("smembers", KEYS[i])) do
+        if redis.call("zscore", KEYS[4], tag) then
+            table.insert(matches, tag)
+        end
+    end
+
+    if #matches == 1 then
+        return {"found", matches[1]}
+    end
+
+    for _, tag in ipairs(matches) do
+        if not seen[tag] then
+            seen[tag] = true
+            table.insert(ambiguous, tag)
+        end
+    end
+end
+
+if #ambiguous == 0 then
+    return {}
+end
+
+table.sort(ambiguous)
+table.insert(ambiguous, 1, "ambiguous")
+return ambiguous
+"""
+
+
 class SeriesNotFound(Exception):
     pass
 
 
+class SeriesAmbiguous(SeriesNotFound):
+    """Raised when an inexact query matches more than one series."""
+
+    def __init__(self, query: str, candidates: List[str]):
+        super().__init__(query)
+        self.candidates: List[str] = candidates
+
+
+class SeriesSummary(object):
+    """The parts of a series shown in listings, without its snippets."""
+
+    def __init__(
+        self,
+        tag: str,
+        title: str,
+        author_ids: List[int],
+        wordcount: int,
+        snippet_count: int,
+        update_time: Optional[float],
+    ):
+        self.tag: str = tag
+        self.title: str = title
+        self.author_ids: List[int] = author_ids
+        self.wordcount: int = wordcount
+        self.snippet_count: int = snippet_count
+        self.update_time: Optional[float] = update_time
+
+    @classmethod
+    def from_hash(cls, tag: str, data: Dict[str, str]) -> Optional[SeriesSummary]:
+        """Parse a stored summary, or return None if it is missing or partial."""
+        try:
+            update_time = data["updated"]
+            return cls(
+                tag,
+                data["title"],
+                json.loads(data["authors"]),
+                int(data["wordcount"]),
+                int(data["snippets"]),
+                float(update_time) if len(update_time) > 0 else None,
+            )
+        except KeyError:
+            return None
+
+    @property
+    def view_url(self) -> str:
+        return urllib.parse.urljoin(
+            config.api_base_url, "/series/" + urllib.parse.quote(self.tag)
+        )
+
+    @property
+    def authors(self) -> Iterator[author_mod.Author]:
+        for id in sorted(self.author_ids):
+            yield author_mod.Author.get_by_id(id)
+
+    @property
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "tag": self.tag,
+            "title": self.title,
+            "authors": [a.as_dict for a in self.authors],
+            "updated": self.update_time,
+            "url": self.view_url,
+            "wordcount": self.wordcount,
+            "snippets": self.snippet_count,
+        }
+
+
 class Series:
     @staticmethod
     def normalize_name(title: str) -> str:
@@ -131,6 +303,9 @@ class Series:
         title: Optional[str] = None,
         update_time: Optional[float] = None,
         subscriber_ids: Optional[Set[int]] = None,
+        fields: FrozenSet[str] = SERIES_FIELDS,
+        snippet_ids: Optional[List[int]] = None,
+        channel_ids: Optional[Set[int]] = None,
     ):
         tag = tag.strip()
 
@@ -148,6 +323,35 @@ class Series:
         self.update_time: Optional[float] = update_time
         self.subscriber_ids: Set[int] = subscriber_ids
 
+        # the optional fields that were loaded, for series loaded in part
+        self.fields: FrozenSet[str] = fields
+        self._channel_ids: Optional[Set[int]] = channel_ids
+
+        # snippets and authors listed in Redis under this series, for
+        # membership tracking
+        if snippet_ids is None:
+            snippet_ids = [s.message_id for s in snippets]
+        self._saved_snippet_ids: Set[int] = set(snippet_ids)
+        self._saved_author_ids: Set[int] = set(author_ids)
+
+    def _require(self, *fields: str):
+        missing = set(fields).difference(self.fields)
+        if len(missing) > 0:
+            raise ValueError(
+                "Series {} was loaded without {}".format(
+                    self.tag, ", ".join(sorted(missing))
+                )
+            )
+
+    @property
+    def channel_ids(self) -> Set[int]:
+        """The IDs of the channels this series' snippets were posted in."""
+        if "snippets" in self.fields:
+            return set(s.channel_id for s in self.snippets)
+
+        self._require("channels")
+        return self._channel_ids
+
     @property
     def redis_prefix(self) -> str:
         return "series:" + self.tag
@@ -181,34 +385,72 @@ class Series:
             yield author_mod.Author.get_by_id(id)
 
     def _base_dict(self) -> Dict[str, Any]:
-        return {
-            "tag": self.tag,
-            "title": self.title,
-            "authors": [a.as_dict for a in self.authors],
-            "subscribers": [a.as_dict for a in self.subscribers],
-            "updated": self.update_time,
-            "url": self.view_url,
-            "warnings": list(self.content_warnings),
-            "wordcount": self.wordcount(),
-        }
+        ret = {"tag": self.tag}
+        if "title" in self.fields:
+            ret["title"] = self.title
+        ret["authors"] = [a.as_dict for a in self.authors]
+        if "subscribers" in self.fields:
+            ret["subscribers"] = [a.as_dict for a in self.subscribers]
+        if "updated" in self.fields:
+            ret["updated"] = self.update_time
+        ret["url"] = self.view_url
+        if "snippets" in self.fields:
+            ret["warnings"] = list(self.content_warnings)
+            ret["wordcount"] = self.wordcount()
+        return ret
 
     @property
     def as_dict_trimmed(self) -> Dict[str, Any]:
-        return dict(
-            self._base_dict(), snippets=[s.as_dict_trimmed for s in self.snippets]
-        )
+        ret = self._base_dict()
+        if "snippets" in self.fields:
+            ret["snippets"] = [s.as_dict_trimmed for s in self.snippets]
+        return ret
 
     @property
     def as_dict(self) -> Dict[str, Any]:
-        return dict(self._base_dict(), snippets=[s.as_dict for s in self.snippets])
+        ret = self._base_dict()
+        if "snippets" in self.fields:
+            ret["snippets"] = [s.as_dict for s in self.snippets]
+        return ret
+
+    def _prepare_snippets(self, trimmed: bool):
+        for snippet in self.snippets:
+            snippet.prepare_json(trimmed)
+
+    async def prepare_json(self, trimmed: bool = False):
+        """Encode this series' snippets ahead of `to_json`, off the event loop
+        if they are large.
+        """
+        if "snippets" not in self.fields:
+            return
+
+        size = sum(len(snippet.content) for snippet in self.snippets)
+        await offload.run("series_json", self._prepare_snippets, trimmed, size=size)
+
+    def to_json(self, trimmed: bool = False, **extra: Any) -> str:
+        """Encode this series as JSON, with any extra top-level keys.
+
+        Snippets are spliced in from their cached encodings rather than
+        encoded again, so this matches `json.dumps(self.as_dict)`, apart from
+        key order.
+        """
+        encoded = json.dumps(dict(self._base_dict(), **extra))
+        if "snippets" not in self.fields:
+            return encoded
+
+        if trimmed:
+            fragments = [s.as_json_trimmed for s in self.snippets]
+        else:
+            fragments = [s.as_json for s in self.snippets]
+        return encoded[:-1] + ', "snippets": [' + ", ".join(fragments) + "]}"
 
     @property
     def as_json(self) -> str:
-        return json.dumps(self.as_dict)
+        return self.to_json()
 
     @property
     def as_json_trimmed(self) -> str:
-        return json.dumps(self.as_dict_trimmed)
+        return self.to_json(trimmed=True)
 
     def __eq__(self, o: object) -> bool:
         try:
@@ -223,10 +465,15 @@ class Series:
         if author.is_administrator:
             return True
 
-        management_role_name: str = config.management_role_name.casefold()
+        if not has_client():
+            # running separately from the bot; use its published snapshot
+            return any(
+                directory.is_channel_manager(channel_id, author.id)
+                for channel_id in self.channel_ids
+            )
 
-        for snippet in self.snippets:
-            channel: discord.TextChannel = get_client().get_channel(snippet.channel_id)
+        for channel_id in self.channel_ids:
+            channel: discord.TextChannel = get_client().get_channel(channel_id)
             if channel is None:
                 continue
 
@@ -236,16 +483,8 @@ class Series:
             if member is None:
                 continue
 
-            if (
-                member.guild_permissions.administrator
-                or channel.permissions_for(member).manage_messages
-            ):
+            if directory.manages_channel(channel, member):
                 return True
-
-            if len(management_role_name) > 0:
-                for r in member.roles:
-                    if r.name.strip().casefold() == management_role_name:
-                        return True
         return False
 
     def can_edit(self, author: author_mod.Author) -> bool:
@@ -257,40 +496,125 @@ class Series:
     def wordcount(self) -> int:
         return sum(snippet.wordcount() for snippet in self.snippets)
 
+    @property
+    def summary(self) -> SeriesSummary:
+        self._require("title", "updated", "snippets")
+        return SeriesSummary(
+            self.tag,
+            self.title,
+            sorted(self.author_ids),
+            self.wordcount(),
+            len(self.snippets),
+            self.update_time,
+        )
+
+    def _summary_fields(self) -> Dict[str, Any]:
+        summary = self.summary
+        return {
+            "title": summary.title,
+            "authors": json.dumps(summary.author_ids),
+            "wordcount": summary.wordcount,
+            "snippets": summary.snippet_count,
+            "updated": (
+                str(summary.update_time) if summary.update_time is not None else ""
+            ),
+        }
+
+    def _save_summary(self, tr: Any, tag: str):
+        """Queue commands on a pipeline to store this series' summary."""
+        tr.hset("series:" + tag + SUMMARY_SUFFIX, mapping=self._summary_fields())
+
+    async def save_summary(self, version: Optional[str]) -> SeriesSummary:
+        """Store this series' summary, rebuilt from a load of the series.
+
+        `version` is the series version read before it was loaded. If the
+        series has been saved since, the summary is not stored, since it may
+        be stale; it will be rebuilt when next read.
+        """
+        args = [version or ""]
+        for field, value in self._summary_fields().items():
+            args += [field, value]
+
+        script = self.redis.register_script(SAVE_SUMMARY_SCRIPT)
+        await script(
+            [self.redis_prefix + ":version", self.redis_prefix + SUMMARY_SUFFIX],
+            args,
+        )
+        return self.summary
+
     @classmethod
     async def load(
         cls,
         redis_or_ctx: ContainsRedis,
         name: str,
+        fields: Optional[Iterable[str]] = None,
     ) -> Series:
+        """Load a series.
+
+        `fields` limits which of `SERIES_FIELDS` are loaded; by default, all of
+        them are. Pass an empty collection to only check that a series exists.
+        """
         redis = ensure_redis(redis_or_ctx)
         redis_prefix = "series:" + name
 
-        snippet_ids = await redis.get(redis_prefix + ":snippets")
-
+        fields = SERIES_FIELDS if fields is None else frozenset(fields)
+        unknown = fields.difference(SERIES_FIELDS)
+        if len(unknown) > 0:
+            raise ValueError("Unknown series fields " + ", ".join(sorted(unknown)))
+
+        key_fields = [f for f in ("title", "updated") if f in fields]
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(redis_prefix + ":snippets")
+            pipe.get(redis_prefix + ":authors")
+            for field in key_fields:
+                pipe.get(redis_prefix + ":" + field)
+            if "subscribers" in fields:
+                pipe.smembers(SERIES_SUBSCRIBERS_PREFIX + name)
+            results = await pipe.execute()
+
+        snippet_ids, author_ids = results[:2]
         if snippet_ids is None:
             raise SeriesNotFound(name)
 
-        author_ids = set(json.loads(await redis.get(redis_prefix + ":authors")))
-        title = await redis.get(redis_prefix + ":title")
-        update_time = await redis.get(redis_prefix + ":updated")
-        subscribers = await redis.get(redis_prefix + ":subscribers")
+        author_ids = set(json.loads(author_ids))
+        values = dict(zip(key_fields, results[2:]))
+        title = values.get("title")
+        update_time = values.get("updated")
+
+        subscribers = None
+        if "subscribers" in fields:
+            subscribers = set(int(i) for i in results[-1])
 
         try:
             update_time = float(update_time)
         except TypeError:
             pass
 
-        if subscribers is not None:
-            subscribers = set(json.loads(subscribers))
-
         snippet_ids = json.loads(snippet_ids)
         snippets = []
-        for msg_id in snippet_ids:
-            snippet = await Snippet.load(redis, msg_id)
-            snippets.append(snippet)
-
-        return cls(redis, name, author_ids, snippets, title, update_time, subscribers)
+        channel_ids = None
+        if "snippets" in fields:
+            for msg_id in snippet_ids:
+                snippet = await Snippet.load(redis, msg_id)
+                snippets.append(snippet)
+        elif "channels" in fields and len(snippet_ids) > 0:
+            channels = await redis.mget(
+                ["snippet:" + str(msg_id) + ":channel" for msg_id in snippet_ids]
+            )
+            channel_ids = set(int(c) for c in channels if c is not None)
+
+        return cls(
+            redis,
+            name,
+            author_ids,
+            snippets,
+            title,
+            update_time,
+            subscribers,
+            fields=fields,
+            snippet_ids=snippet_ids,
+            channel_ids=channel_ids,
+        )
 
     @classmethod
     async def get_title_subindex(
@@ -299,6 +623,7 @@ class Series:
         title: str,
         *,
         normalize: bool = True,
+        fields: Optional[Iterable[str]] = None,
     ) -> AsyncIterator[Series]:
         redis = ensure_redis(redis_or_ctx)
 
@@ -308,7 +633,7 @@ class Series:
             normalized = title
 
         async for tag in redis.sscan_iter(TITLE_SUBINDEX_PREFIX + normalized):
-            series = await cls.load(redis, tag)
+            series = await cls.load(redis, tag, fields)
             yield series
 
     @classmethod
@@ -334,14 +659,17 @@ class Series:
 
     @classmethod
     async def find_by_normalized_tag(
-        cls, redis_or_ctx: Union[aioredis.Redis, CommandContext], query: str
+        cls,
+        redis_or_ctx: Union[aioredis.Redis, CommandContext],
+        query: str,
+        fields: Optional[Iterable[str]] = None,
     ) -> AsyncIterator[Series]:
         redis = ensure_redis(redis_or_ctx)
         normalized = cls.normalize_name(query)
 
         idx_tag: str
         async for idx_tag in redis.sscan_iter(NORMALIZED_SUBINDEX_PREFIX + normalized):
-            series = await cls.load(redis, idx_tag)
+            series = await cls.load(redis, idx_tag, fields)
             yield series
 
     @classmethod
@@ -352,9 +680,9 @@ class Series:
         normalized = cls.normalize_name(query)
         candidates = {}
 
-        idx_tag: str
+        main_idx_tag: str
         async for main_idx_tag in redis.sscan_iter(NORMALIZED_INDEX_KEY):
-            if normalized not in idx_tag:
+            if normalized not in main_idx_tag:
                 continue
 
             async for subidx_tag in redis.sscan_iter(
@@ -363,7 +691,12 @@ class Series:
                 series = await cls.load(redis, subidx_tag)
                 candidates[series.tag] = series
 
-        close_matches = difflib.get_close_matches(query, candidates.keys(), **kwargs)
+        keys = list(candidates.keys())
+        close_matches = await offload.run(
+            "search_by_tag",
+            lambda: difflib.get_close_matches(query, keys, **kwargs),
+            size=sum(len(k) for k in keys) * len(query),
+        )
         return [candidates[k] for k in close_matches]
 
     @classmethod
@@ -372,36 +705,35 @@ class Series:
         redis_or_ctx: Union[aioredis.Redis, CommandContext],
         query: str,
         author_id: int,
+        fields: Optional[Iterable[str]] = None,
     ) -> Series:
-        """Try to find a Series with inexact matching."""
+        """Try to find a Series with inexact matching.
 
-        try:
-            # Try and return an exact tag match first.
-            return await cls.load(redis_or_ctx, query)
-        except SeriesNotFound:
-            pass
-
-        # Next, try an inexact tag match for the given author:
-        candidates: Set[Series] = set()
-        async for series in cls.find_by_normalized_tag(redis_or_ctx, query):
-            if author_id in series.author_ids:
-                candidates.add(series)
-
-        if len(candidates) == 1:
-            return candidates.pop()
+        Raises SeriesAmbiguous if more than one of the author's series matches.
+        """
+        redis = ensure_redis(redis_or_ctx)
+        normalized = cls.normalize_name(query)
 
-        # Finally, try an inexact title match for the given author:
-        candidates = set()
-        async for series in cls.get_title_subindex(redis_or_ctx, query):
-            if author_id in series.author_ids:
-                candidates.add(series)
+        script = redis.register_script(RESOLVE_SCRIPT)
+        result = await script(
+            [
+                "series:" + query + ":snippets",
+                NORMALIZED_SUBINDEX_PREFIX + normalized,
+                TITLE_SUBINDEX_PREFIX + normalized,
+                AUTHOR_UPDATES_PREFIX + str(author_id),
+            ],
+            [query],
+        )
 
-        if len(candidates) == 1:
-            return candidates.pop()
+        if len(result) == 0:
+            raise SeriesNotFound("Could not resolve series query")
+        elif result[0] == "ambiguous":
+            raise SeriesAmbiguous(query, list(result[1:]))
 
-        raise SeriesNotFound("Could not resolve series query")
+        return await cls.load(redis, result[1], fields)
 
     async def save(self, update_time=True):
+        self._require("title", "updated", "snippets")
         normalized_title = self.normalize_name(self.title)
         normalized_tag = self.normalize_name(self.tag)
 
@@ -413,6 +745,11 @@ class Series:
         async with self.redis.pipeline(transaction=True) as tr:
             tr.sadd(SERIES_INDEX_KEY, self.tag)
 
+            for snippet_id in self._saved_snippet_ids.difference(snippet_ids):
+                tr.srem("snippet:" + str(snippet_id) + ":series", self.tag)
+            for snippet_id in snippet_ids:
+                tr.sadd("snippet:" + str(snippet_id) + ":series", self.tag)
+
             tr.set(
                 self.redis_prefix + ":snippets",
                 json.dumps(snippet_ids),
@@ -424,23 +761,35 @@ class Series:
             )
 
             tr.set(self.redis_prefix + ":authors", json.dumps(list(self.author_ids)))
-            tr.set(
-                self.redis_prefix + ":subscribers",
-                json.dumps(list(self.subscriber_ids)),
-            )
 
             if update_time:
                 tr.set(self.redis_prefix + ":updated", str(self.update_time))
 
+            tr.zadd(SERIES_UPDATES_KEY, {self.tag: self.update_time or 0})
+            for author_id in self._saved_author_ids.difference(self.author_ids):
+                tr.zrem(AUTHOR_UPDATES_PREFIX + str(author_id), self.tag)
+            for author_id in self.author_ids:
+                tr.zadd(
+                    AUTHOR_UPDATES_PREFIX + str(author_id),
+                    {self.tag: self.update_time or 0},
+                )
+            tr.incr(self.redis_prefix + ":version")
+            self._save_summary(tr, self.tag)
+
             tr.sadd(TITLE_SUBINDEX_PREFIX + normalized_title, self.tag)
             tr.sadd(MAIN_TITLE_INDEX_KEY, normalized_title)
 
             tr.sadd(NORMALIZED_SUBINDEX_PREFIX + normalized_tag, self.tag)
             tr.sadd(NORMALIZED_INDEX_KEY, normalized_tag)
 
+            events.record(tr, "save", self.tag)
             await tr.execute()
 
+        self._saved_snippet_ids = set(snippet_ids)
+        self._saved_author_ids = set(self.author_ids)
+
     async def delete(self):
+        self._require("title", "subscribers")
         normalized_tag = self.normalize_name(self.tag)
         normalized_title = self.normalize_name(self.title)
 
@@ -448,9 +797,20 @@ class Series:
             tr.delete(self.redis_prefix + ":snippets")
             tr.delete(self.redis_prefix + ":authors")
             tr.delete(self.redis_prefix + ":updated")
-            tr.delete(self.redis_prefix + ":subscribers")
+            tr.delete(SERIES_SUBSCRIBERS_PREFIX + self.tag)
+            for user_id in self.subscriber_ids:
+                tr.srem(USER_SUBSCRIPTIONS_PREFIX + str(user_id), self.tag)
+            tr.delete(self.redis_prefix + ":version")
+            tr.delete(self.redis_prefix + SUMMARY_SUFFIX)
             tr.srem(SERIES_INDEX_KEY, self.tag)
 
+            tr.zrem(SERIES_UPDATES_KEY, self.tag)
+            for author_id in self._saved_author_ids:
+                tr.zrem(AUTHOR_UPDATES_PREFIX + str(author_id), self.tag)
+
+            for snippet_id in self._saved_snippet_ids:
+                tr.srem("snippet:" + str(snippet_id) + ":series", self.tag)
+
             title_remove = tr.register_script(TITLE_INDEX_REMOVE_SCRIPT)
             await title_remove(
                 [
@@ -470,25 +830,36 @@ class Series:
                 [self.tag, normalized_title],
             )
 
+            events.record(tr, "delete", self.tag)
             await tr.execute()
 
-    def change_title(self, new_title: str):
+    async def change_title(self, new_title: str):
+        self._require("title")
         old_norm_title = self.normalize_name(self.title)
         new_norm_title = self.normalize_name(new_title)
-        script = self.redis.register_script(TITLE_INDEX_RENAME_SCRIPT)
+
+        async with self.redis.pipeline(transaction=True) as tr:
+            script = tr.register_script(TITLE_INDEX_RENAME_SCRIPT)
+            await script(
+                [
+                    self.redis_prefix + ":title",
+                    MAIN_TITLE_INDEX_KEY,
+                    TITLE_SUBINDEX_PREFIX + old_norm_title,
+                    TITLE_SUBINDEX_PREFIX + new_norm_title,
+                ],
+                [self.tag, new_title, old_norm_title, new_norm_title],
+            )
+
+            tr.incr(self.redis_prefix + ":version")
+            # a partial summary is rebuilt when next read
+            tr.hset(self.redis_prefix + SUMMARY_SUFFIX, "title", new_title)
+            events.record(tr, "title", self.tag)
+            await tr.execute()
 
         self.title = new_title
-        return script(
-            [
-                self.redis_prefix + ":title",
-                MAIN_TITLE_INDEX_KEY,
-                TITLE_SUBINDEX_PREFIX + old_norm_title,
-                TITLE_SUBINDEX_PREFIX + new_norm_title,
-            ],
-            [self.tag, new_title, old_norm_title, new_norm_title],
-        )
 
     async def change_tag(self, new_tag: str):
+        self._require("title", "updated", "subscribers")
         old_norm_tag = self.normalize_name(self.tag)
         new_norm_tag = self.normalize_name(new_tag)
         norm_title = self.normalize_name(self.title)
@@ -515,14 +886,40 @@ class Series:
                 new_prefix + ":updated",
             )
 
-            tr.rename(
-                self.redis_prefix + ":subscribers",
-                new_prefix + ":subscribers",
+            # unlike RENAME, this works when there are no subscribers
+            tr.sunionstore(
+                SERIES_SUBSCRIBERS_PREFIX + new_tag,
+                SERIES_SUBSCRIBERS_PREFIX + self.tag,
             )
+            tr.delete(SERIES_SUBSCRIBERS_PREFIX + self.tag)
+            for user_id in self.subscriber_ids:
+                tr.srem(USER_SUBSCRIPTIONS_PREFIX + str(user_id), self.tag)
+                tr.sadd(USER_SUBSCRIPTIONS_PREFIX + str(user_id), new_tag)
 
             tr.srem(SERIES_INDEX_KEY, self.tag)
             tr.sadd(SERIES_INDEX_KEY, new_tag)
 
+            # versions are per tag, so this cannot be a rename
+            tr.delete(self.redis_prefix + ":version")
+            tr.incr(new_prefix + ":version")
+
+            tr.delete(self.redis_prefix + SUMMARY_SUFFIX)
+            if "snippets" in self.fields:
+                self._save_summary(tr, new_tag)
+
+            tr.zrem(SERIES_UPDATES_KEY, self.tag)
+            tr.zadd(SERIES_UPDATES_KEY, {new_tag: self.update_time or 0})
+            for author_id in self._saved_author_ids:
+                tr.zrem(AUTHOR_UPDATES_PREFIX + str(author_id), self.tag)
+                tr.zadd(
+                    AUTHOR_UPDATES_PREFIX + str(author_id),
+                    {new_tag: self.update_time or 0},
+                )
+
+            for snippet_id in self._saved_snippet_ids:
+                tr.srem("snippet:" + str(snippet_id) + ":series", self.tag)
+                tr.sadd("snippet:" + str(snippet_id) + ":series", new_tag)
+
             tr.srem(TITLE_SUBINDEX_PREFIX + norm_title, self.tag)
             tr.sadd(TITLE_SUBINDEX_PREFIX + norm_title, new_tag)
 
@@ -536,6 +933,7 @@ class Series:
                 [self.tag, new_tag, old_norm_tag, new_norm_tag],
             )
 
+            events.record(tr, "rename", self.tag, new_tag=new_tag)
             await tr.execute()
 
         self.tag = new_tag
@@ -545,9 +943,15 @@ async def check_series_schema(redis: aioredis.Redis):
     index_exists = bool(int(await redis.exists(SERIES_INDEX_KEY)))
     norm_index_exists = bool(int(await redis.exists(NORMALIZED_INDEX_KEY)))
     title_index_exists = bool(int(await redis.exists(MAIN_TITLE_INDEX_KEY)))
+    updates_index_exists = bool(int(await redis.exists(SERIES_UPDATES_KEY)))
 
     async with redis.pipeline(transaction=True) as tr:
-        do_exec = not (index_exists and norm_index_exists and title_index_exists)
+        do_exec = not (
+            index_exists
+            and norm_index_exists
+            and title_index_exists
+            and updates_index_exists
+        )
 
         key: str
         async for key in redis.scan_iter(match="series:*:snippets"):
@@ -571,6 +975,21 @@ async def check_series_schema(redis: aioredis.Redis):
                 tr.sadd(MAIN_TITLE_INDEX_KEY, normalized_title)
                 tr.sadd(TITLE_SUBINDEX_PREFIX + normalized_title, tag)
 
+            if not updates_index_exists:
+                update_time = float(await redis.get(redis_prefix + ":updated") or 0)
+                tr.zadd(SERIES_UPDATES_KEY, {tag: update_time})
+
+                authors = await redis.get(redis_prefix + ":authors")
+                if authors is not None:
+                    author_ids = json.loads(authors)
+                else:
+                    # not migrated yet; see below
+                    old_author = await redis.get(redis_prefix + ":author")
+                    author_ids = [old_author] if old_author is not None else []
+
+                for author_id in author_ids:
+                    tr.zadd(AUTHOR_UPDATES_PREFIX + str(author_id), {tag: update_time})
+
             old_author_key = bool(int(await redis.exists(redis_prefix + ":author")))
             if old_author_key:
                 author_id = int(await redis.get(redis_prefix + ":author"))
@@ -582,6 +1001,94 @@ async def check_series_schema(redis: aioredis.Redis):
             await tr.execute()
 
 
+async def check_subscription_schema(redis: aioredis.Redis):
+    """Move subscribers out of the JSON lists once stored with each series."""
+    if await redis.exists(subscriptions.SCHEMA_VERSION_KEY):
+        return
+
+    count = 0
+    tag: str
+    async for tag in redis.sscan_iter(SERIES_INDEX_KEY):
+        old_key = "series:" + tag + ":subscribers"
+        data = await redis.get(old_key)
+        if data is None:
+            continue
+
+        async with redis.pipeline(transaction=True) as tr:
+            for user_id in json.loads(data):
+                tr.sadd(SERIES_SUBSCRIBERS_PREFIX + tag, user_id)
+                tr.sadd(USER_SUBSCRIPTIONS_PREFIX + str(user_id), tag)
+                count += 1
+            tr.delete(old_key)
+            await tr.execute()
+
+    await redis.set(subscriptions.SCHEMA_VERSION_KEY, "1")
+    logging.info("Migrated {} series subscriptions".format(count))
+
+
+async def check_search_index(redis: aioredis.Redis):
+    """Index existing snippets for search, if not already done.
+
+    This also records which series each snippet belongs to, for snippets saved
+    before that was tracked.
+    """
+    if await redis.exists(search.INDEX_VERSION_KEY):
+        return
+
+    logging.info("Building search index")
+    count = 0
+
+    tag: str
+    async for tag in redis.sscan_iter(SERIES_INDEX_KEY):
+        snippet_ids = await redis.get("series:" + tag + ":snippets")
+        if snippet_ids is None:
+            continue
+
+        for message_id in json.loads(snippet_ids):
+            content = codec.decode(
+                await redis.get("snippet:" + str(message_id) + ":content")
+            )
+            if content is None:
+                continue
+
+            await redis.sadd("snippet:" + str(message_id) + ":series", tag)
+            await search.index_snippet(redis, message_id, content)
+            count += 1
+
+    await redis.set(search.INDEX_VERSION_KEY, "1")
+    logging.info("Indexed {} snippets for search".format(count))
+
+
+async def load_summaries(redis: aioredis.Redis, tags: List[str]) -> List[SeriesSummary]:
+    """Load the summaries of some series, skipping any that do not exist."""
+    async with redis.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            pipe.hgetall("series:" + tag + SUMMARY_SUFFIX)
+            pipe.get("series:" + tag + ":version")
+        results = await pipe.execute()
+
+    summaries = []
+    for tag, data, version in zip(tags, results[::2], results[1::2]):
+        summary = SeriesSummary.from_hash(tag, data)
+        if summary is None:
+            try:
+                series = await Series.load(redis, tag)
+            except SeriesNotFound:
+                continue
+            summary = await series.save_summary(version)
+        summaries.append(summary)
+
+    return summaries
+
+
+async def get_author_summaries(
+    redis: aioredis.Redis, author_id: int
+) -> List[SeriesSummary]:
+    """Summarize the series by an author, most recently updated first."""
+    tags = await redis.zrevrange(AUTHOR_UPDATES_PREFIX + str(author_id), 0, -1)
+    return await load_summaries(redis, tags)
+
+
 async def get_series_count(redis: aioredis.Redis) -> int:
     return await redis.scard(SERIES_INDEX_KEY)
 
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key starts the call; callers arriving while it is
+    still running wait on the same result instead of starting their own.
+    Cancelling one waiter does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        try:
+            fut = self._inflight[key]
+        except KeyError:
+            fut = asyncio.ensure_future(func())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return await asyncio.shield(fut)
@@ -5,17 +5,30 @@ import discord
 import logging
 import json
 import re
-from typing import Any, Dict, Optional, Union, List, Iterator
+from typing import Any, Callable, Dict, Union, List, Iterator, Set, Tuple
 import urllib
 
 from discord.errors import Forbidden, NotFound
 
 from .commands import CommandContext
+from .cache import TTLCache
 from .helper import ensure_redis
+from . import codec, directory, events, search
 
 IMAGE_ATTACHMENT_TYPES = set(["image/jpeg", "image/png", "image/gif", "image/webp"])
 CW_REGEX = r"^[\(\[\<\|\s]*[CcTt][Ww]\W+(\w.*?)[\)\]\|\>\s]*$"
 
+# Values derived from recently serialized snippets, keyed by message ID and
+# kind: their JSON encodings ("json" and "json_trimmed") and their wordcount
+# and content warnings ("stats"). Each entry holds the fields it was derived
+# from, so edited snippets are processed again; comparing them is much cheaper
+# than encoding or scanning the content again.
+FRAGMENT_CACHE_SIZE = 30000
+FRAGMENT_CACHE_TTL = 60 * 60
+fragment_cache: TTLCache[Tuple[tuple, Any]] = TTLCache(
+    FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL
+)
+
 
 class SnippetNotFound(Exception):
     pass
@@ -50,10 +63,40 @@ class Snippet:
     def json_attachment_urls(self) -> str:
         return json.dumps(self.attachment_urls)
 
+    @property
+    def media_urls(self) -> List[str]:
+        """Paths to this snippet's attachments on our media proxy."""
+        return [
+            "/media/{}/{}".format(self.message_id, n)
+            for n in range(len(self.attachment_urls))
+        ]
+
+    def _cached(self, kind: str, fields: tuple, compute: Callable[[], Any]) -> Any:
+        key = (self.message_id, kind)
+        cached = fragment_cache.get(key)
+        if cached is not None and cached[0] == fields:
+            return cached[1]
+
+        value = compute()
+        fragment_cache.set(key, (fields, value))
+        return value
+
+    def _compute_stats(self) -> Tuple[int, Tuple[str, ...]]:
+        stripped = re.sub(
+            r"\<(?:\@[\!\&]?|\#|a?\:\w+\:)\d+\>", "", self.content
+        ).strip()
+        warnings = tuple(
+            match[1].strip()
+            for match in re.finditer(CW_REGEX, self.content, re.MULTILINE)
+        )
+        return len(stripped.split()), warnings
+
+    def _stats(self) -> Tuple[int, Tuple[str, ...]]:
+        return self._cached("stats", (self.content,), self._compute_stats)
+
     @property
     def content_warnings(self) -> Iterator[str]:
-        for match in re.finditer(CW_REGEX, self.content, re.MULTILINE):
-            yield match[1].strip()
+        yield from self._stats()[1]
 
     @property
     def as_dict_trimmed(self) -> Dict[str, Any]:
@@ -69,22 +112,39 @@ class Snippet:
             self.as_dict_trimmed,
             content=self.content,
             attachment_urls=self.attachment_urls,
+            media_urls=self.media_urls,
         )
 
     @property
     def as_json(self) -> str:
-        return json.dumps(self.as_dict)
+        fields = (
+            self.author_id,
+            self.channel_id,
+            self.content,
+            tuple(self.attachment_urls),
+        )
+        return self._cached("json", fields, lambda: json.dumps(self.as_dict))
 
     @property
     def as_json_trimmed(self) -> str:
-        return json.dumps(self.as_dict_trimmed)
+        return self._cached(
+            "json_trimmed",
+            (self.author_id, self.channel_id),
+            lambda: json.dumps(self.as_dict_trimmed),
+        )
 
     def wordcount(self) -> int:
-        stripped = re.sub(
-            r"\<(?:\@[\!\&]?|\#|a?\:\w+\:)\d+\>", "", self.content
-        ).strip()
-
-        return len(stripped.split())
+        return self._stats()[0]
+
+    def prepare_json(self, trimmed: bool = False):
+        """Compute and cache this snippet's JSON encoding and stats, so that
+        encoding it later is cheap. This may be called from another thread.
+        """
+        self._stats()
+        if trimmed:
+            self.as_json_trimmed
+        else:
+            self.as_json
 
     @classmethod
     def from_message(
@@ -122,14 +182,8 @@ class Snippet:
         channel_id = int(path_parts[2])
         msg_id = int(path_parts[3])
 
-        channel: Optional[discord.abc.Messageable] = await ctx.client.fetch_channel(
-            channel_id
-        )
-        if channel is None:
-            raise SnippetNotFound(msg_id)
-
         try:
-            message: discord.Message = await channel.fetch_message(msg_id)
+            message = await ctx.client.rest.fetch_message(channel_id, msg_id)
         except discord.NotFound:
             raise SnippetNotFound(msg_id) from None
 
@@ -141,7 +195,9 @@ class Snippet:
     ) -> Snippet:
         redis = ensure_redis(redis_or_ctx)
 
-        content = await redis.get("snippet:" + str(message_id) + ":content")
+        content = codec.decode(
+            await redis.get("snippet:" + str(message_id) + ":content")
+        )
         author_id = await redis.get("snippet:" + str(message_id) + ":author")
         channel_id = await redis.get("snippet:" + str(message_id) + ":channel")
         attachment_list = await redis.get("snippet:" + str(message_id) + ":attachments")
@@ -155,20 +211,35 @@ class Snippet:
             attachment_list = []
 
         return cls(
-            redis, content, message_id, int(author_id), int(channel_id), attachment_list
+            redis, content, message_id, int(channel_id), int(author_id), attachment_list
         )
 
     async def save(self):
+        # cached feeds and summaries for series containing this snippet need
+        # regenerating
+        tags = await self.redis.smembers("snippet:" + str(self.message_id) + ":series")
+
         async with self.redis.pipeline(transaction=True) as tr:
-            tr.set("snippet:" + str(self.message_id) + ":content", self.content)
+            tr.set(
+                "snippet:" + str(self.message_id) + ":content",
+                codec.encode(self.content),
+            )
             tr.set("snippet:" + str(self.message_id) + ":author", str(self.author_id))
             tr.set("snippet:" + str(self.message_id) + ":channel", str(self.channel_id))
+            tr.sadd(directory.SNIPPET_CHANNELS_KEY, self.channel_id)
             tr.set(
                 "snippet:" + str(self.message_id) + ":attachments",
                 json.dumps(self.attachment_urls),
             )
+            for tag in tags:
+                tr.incr("series:" + tag + ":version")
+                # wordcounts may have changed; rebuilt when next read
+                tr.delete("series:" + tag + ":summary")
+            events.record(tr, "snippet", message_id=self.message_id)
             await tr.execute()
 
+        await search.index_snippet(self.redis, self.message_id, self.content)
+
 
 async def scan_message_channels(client: discord.Client, redis: aioredis.Redis):
     ver = await redis.get("snippet_schema:version")
@@ -180,43 +251,56 @@ async def scan_message_channels(client: discord.Client, redis: aioredis.Redis):
     if ver >= 1:
         return
 
+    remaining: Set[int] = set()
     key: str
     async for key in redis.scan_iter(match="snippet:*:content"):
-        message_id = int(key.split(":", 2)[1])
+        remaining.add(int(key.split(":", 2)[1]))
 
-        channel: discord.TextChannel
-        for channel in filter(
-            lambda c: isinstance(c, discord.TextChannel),
-            client.get_all_channels(),
-        ):
-            try:
-                message: discord.Message = await channel.fetch_message(message_id)
-                async with redis.pipeline(transaction=True) as tr:
-                    tr.set("snippet:" + str(message_id) + ":channel", str(channel.id))
-
-                    attachments = []
-                    for attachment in message.attachments:
-                        if attachment.content_type in IMAGE_ATTACHMENT_TYPES:
-                            attachments.append(attachment.url)
-
-                    tr.set(
-                        "snippet:" + str(message_id) + ":attachments",
-                        json.dumps(attachments),
-                    )
-
-                    tr.set(
-                        "snippet:" + str(message_id) + ":content",
-                        message.content,
-                    )
-
-                    await tr.execute()
-
-                logging.info(
-                    "Added message channel and attachment data for snippet "
-                    + str(message_id)
+    saved_before = client.rest.saved_calls
+    channel: discord.TextChannel
+    for channel in filter(
+        lambda c: isinstance(c, discord.TextChannel),
+        client.get_all_channels(),
+    ):
+        if len(remaining) == 0:
+            break
+
+        try:
+            messages = await client.rest.fetch_messages(channel.id, remaining)
+        except (NotFound, Forbidden) as e:
+            continue
+
+        for message_id, message in messages.items():
+            async with redis.pipeline(transaction=True) as tr:
+                tr.set("snippet:" + str(message_id) + ":channel", str(channel.id))
+                tr.sadd(directory.SNIPPET_CHANNELS_KEY, channel.id)
+
+                attachments = []
+                for attachment in message.attachments:
+                    if attachment.content_type in IMAGE_ATTACHMENT_TYPES:
+                        attachments.append(attachment.url)
+
+                tr.set(
+                    "snippet:" + str(message_id) + ":attachments",
+                    json.dumps(attachments),
+                )
+
+                tr.set(
+                    "snippet:" + str(message_id) + ":content",
+                    codec.encode(message.content),
                 )
-                break
-            except (NotFound, Forbidden) as e:
-                continue
 
+                await tr.execute()
+
+            logging.info(
+                "Added message channel and attachment data for snippet "
+                + str(message_id)
+            )
+            remaining.discard(message_id)
+
+    logging.info(
+        "Scanned snippet channels, saving {} Discord API calls".format(
+            client.rest.saved_calls - saved_before
+        )
+    )
     await redis.set("snippet_schema:version", 1)
@@ -0,0 +1,234 @@
+"""Garbage collection of snippets that no longer belong to any series.
+
+Each snippet has a `snippet:<message ID>:series` set of the series tags that
+reference it, maintained by `Series.save`, `Series.delete` and
+`Series.change_tag`. A snippet without that set is unreferenced.
+
+Snippets are saved just before the series that references them, so an
+unreferenced snippet is not deleted straight away. The first sweep that finds
+it records it as a candidate, and it is only deleted by a later sweep if it is
+still unreferenced after `GC_GRACE_PERIOD` seconds.
+
+Sweeps use SCAN in small batches with a pause between batches, so they never
+block Redis for long.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+import aioredis
+
+from . import search
+from .metrics import Counter
+
+CANDIDATES_KEY = "snippet_gc:candidates"
+REPORT_KEY = "snippet_gc:report"
+
+# Suffixes of the keys holding a snippet's data.
+SNIPPET_KEY_SUFFIXES = (":content", ":author", ":channel", ":attachments")
+
+# Seconds between sweeps.
+GC_INTERVAL = 6 * 60 * 60
+
+# Seconds a snippet must stay unreferenced before it is deleted.
+GC_GRACE_PERIOD = 24 * 60 * 60
+
+# Number of keys examined per batch, and seconds to wait between batches.
+GC_BATCH_SIZE = 100
+GC_BATCH_DELAY = 0.25
+
+SNIPPETS_DELETED = Counter(
+    "basil_snippet_gc_deleted_total",
+    "Unreferenced snippets deleted by garbage collection.",
+)
+
+BYTES_RECLAIMED = Counter(
+    "basil_snippet_gc_reclaimed_bytes_total",
+    "Redis memory reclaimed by deleting unreferenced snippets.",
+)
+
+# Marks or deletes one unreferenced snippet. Returns 1 if it was deleted.
+#
+# KEYS[1] is the snippet's series membership set.
+# KEYS[2] is the candidates sorted set.
+# KEYS[3...] are the snippet's data keys.
+#
+# ARGV[1] is the snippet message ID.
+# ARGV[2] is the current time.
+# ARGV[3] is the grace period.
+COLLECT_SCRIPT = r"""
+if redis.call("exists", KEYS[1]) == 1 then
+    redis.call("zrem", KEYS[2], ARGV[1])
+    return 0
+end
+
+local marked = redis.call("zscore", KEYS[2], ARGV[1])
+if not marked then
+    redis.call("zadd", KEYS[2], ARGV[2], ARGV[1])
+    return 0
+end
+
+if tonumber(ARGV[2]) - tonumber(marked) < tonumber(ARGV[3]) then
+    return 0
+end
+
+redis.call("del", unpack(KEYS, 3))
+redis.call("zrem", KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class GCReport(object):
+    def __init__(self):
+        self.snippets_scanned: int = 0
+        self.snippets_unreferenced: int = 0
+        self.snippets_deleted: int = 0
+        self.bytes_reclaimed: int = 0
+
+    @property
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "snippets_scanned": self.snippets_scanned,
+            "snippets_unreferenced": self.snippets_unreferenced,
+            "snippets_deleted": self.snippets_deleted,
+            "bytes_reclaimed": self.bytes_reclaimed,
+        }
+
+    def __str__(self) -> str:
+        return "{} of {} snippets unreferenced; deleted {}, reclaiming {} bytes".format(
+            self.snippets_unreferenced,
+            self.snippets_scanned,
+            self.snippets_deleted,
+            self.bytes_reclaimed,
+        )
+
+
+def snippet_keys(message_id: str) -> List[str]:
+    return ["snippet:" + message_id + suffix for suffix in SNIPPET_KEY_SUFFIXES]
+
+
+async def _collect_batch(
+    redis: aioredis.Redis,
+    script,
+    message_ids: List[str],
+    now: float,
+    grace_period: float,
+    report: GCReport,
+):
+    async with redis.pipeline(transaction=False) as pipe:
+        for message_id in message_ids:
+            pipe.exists("snippet:" + message_id + ":series")
+            pipe.zscore(CANDIDATES_KEY, message_id)
+        results = await pipe.execute()
+
+    unreferenced = []
+    due = []
+    stale_marks = []
+    for i, message_id in enumerate(message_ids):
+        referenced, marked = results[2 * i : 2 * i + 2]
+        if referenced:
+            if marked is not None:
+                stale_marks.append(message_id)
+            continue
+
+        unreferenced.append(message_id)
+        if marked is not None and now - float(marked) >= grace_period:
+            due.append(message_id)
+
+    report.snippets_scanned += len(message_ids)
+    report.snippets_unreferenced += len(unreferenced)
+    if len(unreferenced) == 0 and len(stale_marks) == 0:
+        return
+
+    # Measure snippets before deleting them; the script re-checks each one,
+    # so only those it actually deletes are counted.
+    async with redis.pipeline(transaction=False) as pipe:
+        for message_id in due:
+            for key in snippet_keys(message_id):
+                pipe.memory_usage(key)
+            pipe.memory_usage(search.TERMS_PREFIX + message_id)
+
+        for message_id in unreferenced:
+            await script(
+                ["snippet:" + message_id + ":series", CANDIDATES_KEY]
+                + snippet_keys(message_id),
+                [message_id, now, grace_period],
+                client=pipe,
+            )
+
+        if len(stale_marks) > 0:
+            pipe.zrem(CANDIDATES_KEY, *stale_marks)
+
+        results = await pipe.execute()
+
+    n_sizes = len(SNIPPET_KEY_SUFFIXES) + 1
+    sizes = {
+        message_id: sum(
+            int(size or 0) for size in results[n_sizes * i : n_sizes * (i + 1)]
+        )
+        for i, message_id in enumerate(due)
+    }
+    deleted = [
+        message_id
+        for message_id, ret in zip(
+            unreferenced,
+            results[n_sizes * len(due) : n_sizes * len(due) + len(unreferenced)],
+        )
+        if ret == 1
+    ]
+
+    for message_id in deleted:
+        await search.remove_snippet(redis, message_id)
+        report.bytes_reclaimed += sizes.get(message_id, 0)
+
+    report.snippets_deleted += len(deleted)
+    SNIPPETS_DELETED.inc(len(deleted))
+    BYTES_RECLAIMED.inc(sum(sizes.get(message_id, 0) for message_id in deleted))
+
+
+async def collect(
+    redis: aioredis.Redis,
+    grace_period: float = GC_GRACE_PERIOD,
+    batch_size: int = GC_BATCH_SIZE,
+    batch_delay: float = GC_BATCH_DELAY,
+) -> GCReport:
+    """Sweep all snippets once, deleting those unreferenced for long enough."""
+    report = GCReport()
+
+    # Without the membership sets, every snippet would look unreferenced.
+    if not await redis.exists(search.INDEX_VERSION_KEY):
+        logging.info("Skipping snippet garbage collection: index not built yet")
+        return report
+
+    script = redis.register_script(COLLECT_SCRIPT)
+    now = time.time()
+    batch: List[str] = []
+
+    key: str
+    async for key in redis.scan_iter(match="snippet:*:content", count=batch_size):
+        batch.append(key.split(":", 2)[1])
+        if len(batch) >= batch_size:
+            await _collect_batch(redis, script, batch, now, grace_period, report)
+            batch = []
+            await asyncio.sleep(batch_delay)
+
+    if len(batch) > 0:
+        await _collect_batch(redis, script, batch, now, grace_period, report)
+
+    await redis.hset(REPORT_KEY, mapping=dict(report.as_dict, finished=time.time()))
+    logging.info("Snippet garbage collection finished: " + str(report))
+    return report
+
+
+async def collect_loop(redis: aioredis.Redis):
+    while True:
+        try:
+            await collect(redis)
+        except Exception:
+            logging.exception("Caught exception while collecting snippets")
+
+        await asyncio.sleep(GC_INTERVAL)
@@ -0,0 +1,61 @@
+"""Series update subscriptions.
+
+Subscriptions are stored as Redis sets in both directions, so that adding or
+removing one is a constant number of operations and a user's subscriptions
+can be listed without scanning every series:
+
+- `subscriptions:series:<tag>` is the set of user IDs subscribed to a series.
+- `subscriptions:user:<user ID>` is the set of series tags a user follows.
+"""
+
+from __future__ import annotations
+
+from typing import List, Set
+
+import aioredis
+
+SERIES_SUBSCRIBERS_PREFIX = "subscriptions:series:"
+USER_SUBSCRIPTIONS_PREFIX = "subscriptions:user:"
+SCHEMA_VERSION_KEY = "subscriptions:version"
+
+
+async def subscribe(redis: aioredis.Redis, tag: str, user_id: int) -> bool:
+    """Subscribe a user to a series. Returns False if already subscribed."""
+    async with redis.pipeline(transaction=True) as tr:
+        tr.sadd(SERIES_SUBSCRIBERS_PREFIX + tag, user_id)
+        tr.sadd(USER_SUBSCRIPTIONS_PREFIX + str(user_id), tag)
+        added, _ = await tr.execute()
+    return added > 0
+
+
+async def unsubscribe(redis: aioredis.Redis, tag: str, user_id: int) -> bool:
+    """Unsubscribe a user from a series. Returns False if not subscribed."""
+    async with redis.pipeline(transaction=True) as tr:
+        tr.srem(SERIES_SUBSCRIBERS_PREFIX + tag, user_id)
+        tr.srem(USER_SUBSCRIPTIONS_PREFIX + str(user_id), tag)
+        removed, _ = await tr.execute()
+    return removed > 0
+
+
+async def unsubscribe_all(redis: aioredis.Redis, user_id: int) -> List[str]:
+    """Unsubscribe a user from every series. Returns the tags removed."""
+    user_key = USER_SUBSCRIPTIONS_PREFIX + str(user_id)
+    tags = sorted(await redis.smembers(user_key))
+    if len(tags) == 0:
+        return tags
+
+    async with redis.pipeline(transaction=True) as tr:
+        for tag in tags:
+            tr.srem(SERIES_SUBSCRIBERS_PREFIX + tag, user_id)
+        # only remove what was read, in case of a concurrent subscribe
+        tr.srem(user_key, *tags)
+        await tr.execute()
+    return tags
+
+
+async def get_subscriptions(redis: aioredis.Redis, user_id: int) -> Set[str]:
+    return await redis.smembers(USER_SUBSCRIPTIONS_PREFIX + str(user_id))
+
+
+async def get_subscribers(redis: aioredis.Redis, tag: str) -> Set[int]:
+    return set(int(i) for i in await redis.smembers(SERIES_SUBSCRIBERS_PREFIX + tag))
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import config
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# Key segments that name a field or index rather than identify an object.
+# Any other segment after the first is treated as variable when computing key
+# shapes, so that e.g. `snippet:1234:content` and `snippet:5678:content` are
+# recognized as the same access pattern.
+STRUCTURAL_KEY_SEGMENTS = frozenset(
+    [
+        "snippets",
+        "title",
+        "authors",
+        "author",
+        "updated",
+        "subscribers",
+        "content",
+        "channel",
+        "attachments",
+        "main",
+        "sub",
+        "users",
+        "auth",
+        "discord",
+        "version",
+        "series",
+        "search",
+        "postings",
+        "terms",
+        "lengths",
+        "stats",
+        "candidates",
+        "report",
+        "settings",
+        "user",
+        "modes",
+        "due",
+        "pending",
+        "summary",
+        "prefetch",
+    ]
+)
+
+ROUNDTRIPS_PER_TRACE = Histogram(
+    "basil_redis_roundtrips_per_trace",
+    "Number of Redis round trips made while handling one command or request.",
+    ("kind",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "basil_trace", default=None
+)
+
+
+def key_shape(key: str) -> str:
+    """Reduce a Redis key to its access pattern by masking variable segments."""
+    parts = key.split(":")
+    return ":".join(
+        [parts[0]] + [p if p in STRUCTURAL_KEY_SEGMENTS else "*" for p in parts[1:]]
+    )
+
+
+def _first_key(command: str, args: Sequence) -> Optional[str]:
+    if command in ("EVAL", "EVALSHA"):
+        if len(args) > 3 and int(args[2]) > 0:
+            return args[3]
+        return None
+    elif command in ("SCAN", "PING", "MULTI", "EXEC", "SCRIPT"):
+        return None
+    elif len(args) > 1 and isinstance(args[1], str):
+        return args[1]
+    return None
+
+
+def command_shape(command: str, args: Sequence) -> str:
+    key = _first_key(command, args)
+    if key is None:
+        return command
+    return command + " " + key_shape(key)
+
+
+class Trace(object):
+    """Aggregated Redis round trips made on behalf of one command or request."""
+
+    def __init__(self, kind: str, name: str):
+        self.kind: str = kind
+        self.name: str = name
+        self.start: float = time.perf_counter()
+        self.roundtrips: int = 0
+        self.redis_time: float = 0
+
+        # maps a command shape to [call count, total time]
+        self.shapes: Dict[str, List[float]] = {}
+
+    def record(self, shape: str, duration: float):
+        self.roundtrips += 1
+        self.redis_time += duration
+
+        try:
+            entry = self.shapes[shape]
+            entry[0] += 1
+            entry[1] += duration
+        except KeyError:
+            self.shapes[shape] = [1, duration]
+
+    def suspected_repeats(self) -> List[Tuple[str, int]]:
+        """Get command shapes issued often enough to suggest an N+1 pattern."""
+        return [
+            (shape, int(entry[0]))
+            for shape, entry in self.shapes.items()
+            if entry[0] >= config.trace_repeat_threshold
+        ]
+
+    def is_slow(self, elapsed: float) -> bool:
+        return (
+            self.roundtrips >= config.trace_slow_roundtrips
+            or elapsed >= config.trace_slow_seconds
+        )
+
+    def report(self, elapsed: float) -> str:
+        lines = [
+            "Slow {} {}: {} Redis round trips ({:.1f} ms in Redis, {:.1f} ms total)".format(
+                self.kind,
+                self.name,
+                self.roundtrips,
+                self.redis_time * 1000,
+                elapsed * 1000,
+            )
+        ]
+
+        by_time = sorted(self.shapes.items(), key=lambda kv: kv[1][1], reverse=True)
+        for shape, (count, total) in by_time:
+            lines.append(
+                "    {} x{} ({:.1f} ms)".format(shape, int(count), total * 1000)
+            )
+
+        for shape, count in self.suspected_repeats():
+            lines.append("    Suspected N+1: {} issued {} times".format(shape, count))
+
+        return "\n".join(lines)
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        ROUNDTRIPS_PER_TRACE.labels(self.kind).observe(self.roundtrips)
+
+        if self.is_slow(elapsed):
+            log.warning(self.report(elapsed))
+
+
+def start_trace(kind: str, name: str) -> Trace:
+    """Begin attributing Redis round trips in the current context to a new trace."""
+    trace = Trace(kind, name)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def end_trace():
+    trace = _current_trace.get()
+    if trace is not None:
+        _current_trace.set(None)
+        trace.finish()
+
+
+def record_roundtrip(command: str, args: Sequence, duration: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(command_shape(command, args), duration)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
 import aiohttp
-import aioredis
+import asyncio
+import logging
 from sanic import Sanic
 
+from .. import directory, offload, redis_pool
 from ..config import config
+from ..helper import has_client
+from ..media import HTTPFetcher, MediaCache, prefetch_loop
+from .live import LiveHub
 
 app = Sanic("basil")
 
@@ -12,13 +17,68 @@ app = Sanic("basil")
 @app.before_server_start
 async def setup_redis(app, loop):
     app.ctx.http_session = aiohttp.ClientSession()
-    app.ctx.redis = aioredis.from_url(
-        config.primary_redis_url, encoding="utf-8", decode_responses=True
+    app.ctx.redis = redis_pool.get_redis()
+    app.ctx.live_hub = LiveHub(app.ctx.redis)
+    app.ctx.media = MediaCache(
+        config.media_cache_dir,
+        config.media_cache_size,
+        HTTPFetcher(app.ctx.http_session, config.media_upstream or None),
     )
 
 
+@app.after_server_start
+async def start_loop_monitor(app, loop):
+    if has_client():
+        # the bot monitors the loop it shares with the web server
+        return
+    app.add_task(offload.monitor_loop())
+
+
+@app.after_server_start
+async def start_prefetch(app, loop):
+    app.ctx.prefetch_task = asyncio.create_task(
+        prefetch_loop(app.ctx.redis, app.ctx.media)
+    )
+
+
+@app.after_server_start
+async def load_directory(app, loop):
+    if has_client():
+        return
+
+    # The bot runs in another process; use the data it publishes instead.
+    try:
+        await directory.refresh(app.ctx.redis)
+    except Exception:
+        logging.exception("Could not load directory")
+    app.add_task(directory.refresh_loop(app.ctx.redis))
+
+
+@app.after_server_stop
+async def close_connections(app, loop):
+    # stop fetching before the connections it uses are closed
+    app.ctx.prefetch_task.cancel()
+    try:
+        await app.ctx.prefetch_task
+    except asyncio.CancelledError:
+        pass
+
+    await app.ctx.live_hub.close()
+    await app.ctx.http_session.close()
+    await redis_pool.close()
+    offload.shutdown()
+
+
+from . import session
 from .api import api
-from .view import view
+from .view import view, author_view
+from .metrics import metrics_view
+from .feeds import feeds_view
+from .media import media_view
 
 app.blueprint(api)
 app.blueprint(view)
+app.blueprint(author_view)
+app.blueprint(metrics_view)
+app.blueprint(feeds_view)
+app.blueprint(media_view)
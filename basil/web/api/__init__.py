@@ -1,7 +1,18 @@
 from __future__ import annotations
 
 from sanic import Blueprint
-from .series import series_api
+from .series import series_api, changes_api
 from .auth import auth_api
+from .search import search_api
+from .subscriptions import subscriptions_api
+from .authors import authors_api
 
-api = Blueprint.group(series_api, auth_api, url_prefix="/api")
+api = Blueprint.group(
+    series_api,
+    changes_api,
+    auth_api,
+    search_api,
+    subscriptions_api,
+    authors_api,
+    url_prefix="/api",
+)
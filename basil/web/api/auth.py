@@ -1,31 +1,33 @@
 from __future__ import annotations
 
-import hashlib
+import asyncio
 import json
 import logging
 from typing import Optional
-import secrets
 
 import aiohttp
 from aioredis import Redis
 import discord
-from itsdangerous import Signer, BadSignature
 from sanic import Sanic, Blueprint, response, exceptions
 from sanic.request import Request
-from sanic.response import HTTPResponse
 
+from ...cache import TTLCache
 from ...config import config
-from ..oauth2 import OAuth2API, OAuth2Context
+from ...metrics import Counter
+from ...singleflight import SingleFlight
+from ..oauth2 import OAuth2API, OAuth2Context, OAuth2RefreshScheduler
 from ... import author
 
-SESSION_COOKIE_ID = "session"
 REDIS_KEY_PREFIX = "auth:sessions:"
+USER_KEY_PREFIX = "sessions:users:"
 DISCORD_API_URL = "https://discordapp.com/api/v9"
 REQUIRED_SCOPES = "identify"
 
-cookie_signer = Signer(
-    bytes.fromhex(config.cookie_signer_key), digest_method=hashlib.sha256
-)
+# Cached session-to-user mappings are kept in-process for at most this long, so
+# a logout handled by another worker takes effect within this many seconds.
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 10000
+
 auth_api = Blueprint("auth_api", url_prefix="/auth")
 app = Sanic.get_app("basil")
 
@@ -39,15 +41,39 @@ oauth2_api = OAuth2API(
     "discord",
 )
 
+user_cache: TTLCache[int] = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_lookups: SingleFlight[Optional[DiscordUserInfo]] = SingleFlight()
+
+USER_LOOKUPS = Counter(
+    "basil_user_lookups_total",
+    "Session user lookups, by where the user ID was found.",
+    ("source",),
+)
+
+
+@app.after_server_start
+async def start_token_refresh(app, loop):
+    scheduler = OAuth2RefreshScheduler(oauth2_api, app.ctx.http_session, app.ctx.redis)
+    app.ctx.token_refresh_task = asyncio.create_task(scheduler.run())
+
+
+@app.after_server_stop
+async def stop_token_refresh(app, loop):
+    task = getattr(app.ctx, "token_refresh_task", None)
+    if task is not None:
+        task.cancel()
+
 
 class DiscordUserInfo(object):
     def __init__(
         self,
         user_id: int,
-        ctx: OAuth2Context,
+        session_id: str,
+        expire_time: Optional[float] = None,
     ):
         self.id: int = int(user_id)
-        self.ctx: OAuth2Context = ctx
+        self.session_id: str = session_id
+        self.expire_time: Optional[float] = expire_time
 
     @property
     def as_author(self) -> author.Author:
@@ -57,111 +83,84 @@ class DiscordUserInfo(object):
         redis: Redis = app.ctx.redis
 
         async with redis.pipeline(transaction=True) as tr:
-            tr.set("sessions:users:" + self.ctx.session_id, self.id)
-            tr.expireat(
-                "sessions:users:" + self.ctx.session_id, int(self.ctx.expire_time)
-            )
+            tr.set(USER_KEY_PREFIX + self.session_id, self.id)
+            tr.expireat(USER_KEY_PREFIX + self.session_id, int(self.expire_time))
             await tr.execute()
 
+    @classmethod
+    async def forget(cls, session_id: str):
+        """Drop the user mapping for a session, e.g. on logout or a new login."""
+        user_cache.pop(session_id)
+        await app.ctx.redis.delete(USER_KEY_PREFIX + session_id)
+
     @classmethod
     async def load(cls, req: Request) -> Optional[DiscordUserInfo]:
-        discord_ctx: OAuth2Context = await oauth2_api.load_request_context(req)
+        session_id: Optional[str] = req.ctx.session
+        if session_id is None:
+            # visitors without a session cookie have never logged in
+            USER_LOOKUPS.labels("anonymous").inc()
+            return None
+
+        user_id = user_cache.get(session_id)
+        if user_id is not None:
+            USER_LOOKUPS.labels("cached").inc()
+            return cls(user_id, session_id)
+
+        # Coalesce concurrent lookups for the same session (the index page
+        # requests /api/auth/me and /api/series at the same time).
+        return await user_lookups.run(
+            session_id, lambda: cls._load_uncached(session_id)
+        )
+
+    @classmethod
+    async def _load_uncached(cls, session_id: str) -> Optional[DiscordUserInfo]:
         redis: Redis = app.ctx.redis
         http_sess: aiohttp.ClientSession = app.ctx.http_session
 
+        # Read the OAuth2 state and the user mapping in a single round trip.
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(oauth2_api.auth_data_key(session_id))
+            pipe.get(USER_KEY_PREFIX + session_id)
+            auth_data, cached_user_id = await pipe.execute()
+
+        discord_ctx = OAuth2Context(
+            session_id, http_sess, redis, oauth2_api, **(auth_data or {})
+        )
+
         auth = await discord_ctx.auth_header()
         if auth is None:
-            # not logged in
-            await redis.delete("sessions:users:" + discord_ctx.session_id)
+            # Not logged in. Any stale user mapping is removed on logout and
+            # login, and otherwise expires along with the access token.
+            USER_LOOKUPS.labels("anonymous").inc()
             return None
 
-        cached_user_id = await redis.get("sessions:users:" + discord_ctx.session_id)
         if cached_user_id is not None:
-            return cls(cached_user_id, discord_ctx)
-
-        async with http_sess.get(DISCORD_API_URL + "/users/@me", headers=auth) as resp:
-            if resp.status >= 400:
-                resp_text = await resp.text()
-                logging.error(
-                    "Could not get user info for session {}: {}".format(
-                        discord_ctx.session_id, resp_text
+            USER_LOOKUPS.labels("redis").inc()
+            ret = cls(cached_user_id, session_id, discord_ctx.expire_time)
+        else:
+            USER_LOOKUPS.labels("discord").inc()
+            async with http_sess.get(
+                DISCORD_API_URL + "/users/@me", headers=auth
+            ) as resp:
+                if resp.status >= 400:
+                    resp_text = await resp.text()
+                    logging.error(
+                        "Could not get user info for session {}: {}".format(
+                            session_id, resp_text
+                        )
                     )
-                )
 
-                raise exceptions.ServerError("Could not get Discord user info")
+                    raise exceptions.ServerError("Could not get Discord user info")
 
-            user_data = await resp.json()
+                user_data = await resp.json()
 
-        ret = cls(user_data["id"], discord_ctx)
-        await ret.save()
+            ret = cls(user_data["id"], session_id, discord_ctx.expire_time)
+            await ret.save()
 
+        user_cache.set(session_id, ret.id, ttl=discord_ctx.expire_in)
         return ret
 
 
-@app.middleware("request")
-async def load_session_id(request: Request):
-    origin_ip = request.remote_addr
-    if origin_ip is None or len(origin_ip) == 0:
-        origin_ip = request.ip
-
-    sess_id = None
-    try:
-        cookie_data = request.cookies["session"]
-        sess_id = cookie_signer.unsign(cookie_data).decode("utf-8")
-    except (BadSignature, UnicodeDecodeError):
-        logging.warning("IP {} presented invalid session cookie".format(origin_ip))
-    except KeyError:
-        pass
-
-    if sess_id is None:
-        sess_id = secrets.token_urlsafe(16)
-        request.ctx.add_sess_cookie = True
-    else:
-        request.ctx.add_sess_cookie = False
-    request.ctx.session = sess_id
-
-
-@app.middleware("response")
-async def save_session_id(request: Request, response: HTTPResponse):
-    if request.ctx.session is not None and request.ctx.add_sess_cookie:
-        signed = cookie_signer.sign(request.ctx.session).decode("utf-8")
-        response.cookies["session"] = signed
-        response.cookies["session"]["secure"] = True
-        response.cookies["session"]["max-age"] = 86400 * 7
-
-
-@app.middleware("request")
-async def load_session_id(request: Request):
-    origin_ip = request.remote_addr
-    if origin_ip is None or len(origin_ip) == 0:
-        origin_ip = request.ip
-
-    sess_id = None
-    try:
-        cookie_data = request.cookies["session"]
-        sess_id = cookie_signer.unsign(cookie_data).decode("utf-8")
-    except (BadSignature, UnicodeDecodeError):
-        logging.warning("IP {} presented invalid session cookie".format(origin_ip))
-    except KeyError:
-        pass
-
-    if sess_id is None:
-        sess_id = secrets.token_urlsafe(16)
-        request.ctx.add_sess_cookie = True
-    else:
-        request.ctx.add_sess_cookie = False
-    request.ctx.session = sess_id
-
-
-@app.middleware("response")
-async def save_session_id(request: Request, response: HTTPResponse):
-    if request.ctx.session is not None and request.ctx.add_sess_cookie:
-        signed = cookie_signer.sign(request.ctx.session).decode("utf-8")
-        response.cookies["session"] = signed
-        response.cookies["session"]["secure"] = True
-        response.cookies["session"]["max-age"] = 86400 * 7
-
-
 @auth_api.get("/me")
 async def get_login_data(request: Request):
     discord_user = await DiscordUserInfo.load(request)
@@ -181,15 +180,18 @@ async def get_login_data(request: Request):
 
 @auth_api.get("/logout")
 async def logout(request: Request):
-    discord_ctx: OAuth2Context = await oauth2_api.load_request_context(request)
+    if request.ctx.session is not None:
+        discord_ctx: OAuth2Context = await oauth2_api.load_request_context(request)
 
-    await discord_ctx.reset()
+        await discord_ctx.reset()
+        await DiscordUserInfo.forget(discord_ctx.session_id)
     return response.redirect(config.login_redirect_target, status=303)
 
 
 @auth_api.get("/login")
 async def start_oauth2(request: Request):
     discord_ctx: OAuth2Context = await oauth2_api.load_request_context(request)
+    await DiscordUserInfo.forget(discord_ctx.session_id)
     return await discord_ctx.start(
         REQUIRED_SCOPES, config.login_redirect_target, prompt="none"
     )
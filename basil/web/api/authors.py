@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import aioredis
+from sanic import Sanic, Blueprint, Request, response, exceptions
+
+from ...author import Author
+from ...series import get_author_summaries
+
+authors_api = Blueprint("authors_api", url_prefix="/authors")
+app = Sanic.get_app("basil")
+
+
+@authors_api.exception(exceptions.NotFound)
+async def api_exception_handler(_req: Request, exception: exceptions.SanicException):
+    return response.text(exception.args[0], status=exception.status_code)
+
+
+@authors_api.get("/<author_id:int>")
+async def get_author(req: Request, author_id: int):
+    redis: aioredis.Redis = app.ctx.redis
+    summaries = await get_author_summaries(redis, author_id)
+    if len(summaries) == 0:
+        raise exceptions.NotFound("Could not find author " + str(author_id))
+
+    return response.json(
+        {
+            "author": Author.get_by_id(author_id).as_dict,
+            "series": [summary.as_dict for summary in summaries],
+            "wordcount": sum(summary.wordcount for summary in summaries),
+        }
+    )
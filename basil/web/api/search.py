@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from sanic import Sanic, Blueprint, Request, response, exceptions
+
+from ... import search
+
+search_api = Blueprint("search_api", url_prefix="/search")
+app = Sanic.get_app("basil")
+
+MAX_LIMIT = 50
+
+
+@search_api.exception(exceptions.InvalidUsage)
+async def api_exception_handler(_req: Request, exception: exceptions.SanicException):
+    return response.text(exception.args[0], status=exception.status_code)
+
+
+@search_api.get("/")
+async def search_snippets(req: Request):
+    query = req.args.get("q", "").strip()
+    if len(query) == 0:
+        raise exceptions.InvalidUsage("Missing required parameter 'q'")
+
+    try:
+        limit = int(req.args.get("limit", 10))
+    except ValueError:
+        raise exceptions.InvalidUsage("Parameter 'limit' must be an integer")
+
+    if limit < 1 or limit > MAX_LIMIT:
+        raise exceptions.InvalidUsage(
+            "Parameter 'limit' must be between 1 and {}".format(MAX_LIMIT)
+        )
+
+    hits = await search.search(app.ctx.redis, query, limit)
+    return response.json({"query": query, "hits": [hit.as_dict for hit in hits]})
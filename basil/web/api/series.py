@@ -1,50 +1,180 @@
 from __future__ import annotations
 from basil.snippet import Snippet
-from typing import Dict, List
+from typing import Dict, FrozenSet, List, Tuple, Union
 
 import aioredis
 import discord
+import json
 from sanic import Sanic, Blueprint, Request, response, exceptions
 from sanic.views import HTTPMethodView
 from schema import Schema, And, Optional, SchemaError
 import urllib.parse
 
+from ... import events, export
 from ...series import Series, SeriesNotFound, SERIES_INDEX_KEY
 from .auth import DiscordUserInfo
+from .. import live
 
 series_api = Blueprint("series_api", url_prefix="/series")
+# kept out of /series, where its routes would hide series with the same tags
+changes_api = Blueprint("changes_api", url_prefix="/changes")
 app = Sanic.get_app("basil")
 
 
 @series_api.exception(
     exceptions.NotFound, exceptions.Forbidden, exceptions.InvalidUsage
 )
+@changes_api.exception(exceptions.InvalidUsage)
 async def api_exception_handler(_req: Request, exception: exceptions.SanicException):
     return response.text(exception.args[0], status=exception.status_code)
 
 
+# Fields that can be requested with `?fields=`, and the series fields that
+# must be loaded for each. The tag is always included.
+API_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "tag": (),
+    "title": ("title",),
+    "authors": (),
+    "subscribers": ("subscribers",),
+    "updated": ("updated",),
+    "url": (),
+    "warnings": ("snippets",),
+    "wordcount": ("snippets",),
+    "snippets": ("snippets",),
+    "can_edit": ("channels",),
+}
+
+
+def parse_fields(
+    req: Request,
+) -> Tuple[Union[FrozenSet[str], None], Union[FrozenSet[str], None]]:
+    """Parse the `fields` query parameter.
+
+    Returns the series fields to load and the fields to respond with, or
+    (None, None) if all fields were requested.
+    """
+    param = req.args.get("fields")
+    if param is None:
+        return None, None
+
+    keys = frozenset(f.strip() for f in param.split(",") if len(f.strip()) > 0)
+    unknown = keys.difference(API_FIELDS)
+    if len(unknown) > 0:
+        raise exceptions.InvalidUsage("Unknown fields: " + ", ".join(sorted(unknown)))
+
+    keys = keys.union(["tag"])
+    load_fields = frozenset(f for key in keys for f in API_FIELDS[key])
+    return load_fields, keys
+
+
+def series_json(
+    series: Series,
+    discord_user: Union[DiscordUserInfo, None],
+    keys: Union[FrozenSet[str], None] = None,
+    trimmed: bool = False,
+) -> str:
+    """Encode a series for a response, with the requested keys."""
+    can_edit = None
+    if keys is None or "can_edit" in keys:
+        if discord_user is not None:
+            can_edit = series.can_edit(discord_user.as_author)
+        else:
+            can_edit = False
+
+    if keys is None:
+        return series.to_json(trimmed, can_edit=can_edit)
+
+    d = series.as_dict_trimmed if trimmed else series.as_dict
+    d["can_edit"] = can_edit
+    return json.dumps({k: v for k, v in d.items() if k in keys})
+
+
+def json_response(body: str) -> response.HTTPResponse:
+    """Respond with JSON that is already encoded."""
+    return response.text(body, content_type="application/json")
+
+
 @series_api.get("/")
 async def get_all_series(req: Request):
     redis: aioredis.Redis = app.ctx.redis
     discord_user = await DiscordUserInfo.load(req)
+    load_fields, keys = parse_fields(req)
     ret = []
 
     tag: str
     async for tag in redis.sscan_iter(SERIES_INDEX_KEY):
         try:
-            series = await Series.load(redis, tag)
+            series = await Series.load(redis, tag, load_fields)
         except SeriesNotFound:
             continue
 
-        d = series.as_dict_trimmed
-        if discord_user is not None:
-            d["can_edit"] = series.can_edit(discord_user.as_author)
-        else:
-            d["can_edit"] = False
+        await series.prepare_json(trimmed=True)
+        ret.append(series_json(series, discord_user, keys, trimmed=True))
+
+    return json_response("[" + ", ".join(ret) + "]")
+
 
-        ret.append(d)
+@changes_api.get("/")
+async def get_series_changes(req: Request):
+    """Get the series changed or deleted since the event ID `since`.
+
+    Without `since`, or if `reset` is set in the response, the client should
+    refetch all series and then continue from `last_id`.
+    """
+    redis: aioredis.Redis = app.ctx.redis
+    discord_user = await DiscordUserInfo.load(req)
+    load_fields, keys = parse_fields(req)
+
+    since = req.args.get("since")
+    if since is not None:
+        try:
+            events.parse_event_id(since)
+        except ValueError:
+            raise exceptions.InvalidUsage("Invalid event ID") from None
+
+    changes = await events.read_changes(redis, since)
+
+    changed = []
+    for tag in sorted(changes.changed):
+        try:
+            series = await Series.load(redis, tag, load_fields)
+        except SeriesNotFound:
+            changes.deleted.add(tag)
+            continue
+
+        await series.prepare_json(trimmed=True)
+        changed.append(series_json(series, discord_user, keys, trimmed=True))
+
+    encoded = json.dumps(
+        {
+            "last_id": changes.last_id,
+            "reset": changes.reset,
+            "more": changes.more,
+            "deleted": sorted(changes.deleted),
+        }
+    )
+    return json_response(encoded[:-1] + ', "changed": [' + ", ".join(changed) + "]}")
 
-    return response.json(ret)
+
+LIVE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def live_response(tag: Union[str, None]) -> response.StreamingHTTPResponse:
+    hub: live.LiveHub = app.ctx.live_hub
+    client = hub.connect(tag)
+
+    async def stream_live(resp: response.StreamingHTTPResponse):
+        await live.stream_events(hub, client, resp.write)
+
+    return response.stream(
+        stream_live, headers=LIVE_HEADERS, content_type="text/event-stream"
+    )
+
+
+@changes_api.get("/live")
+async def get_live_updates(req: Request):
+    """Stream change events for all series."""
+    return live_response(None)
 
 
 class SeriesView(HTTPMethodView):
@@ -61,27 +191,22 @@ class SeriesView(HTTPMethodView):
 
     @staticmethod
     async def respond_with_series(
-        req: Request, series: Series
+        req: Request, series: Series, keys: Union[FrozenSet[str], None] = None
     ) -> response.HTTPResponse:
-        ret = series.as_dict
         discord_user = await DiscordUserInfo.load(req)
-
-        if discord_user is not None:
-            ret["can_edit"] = series.can_edit(discord_user.as_author)
-        else:
-            ret["can_edit"] = False
-
-        return response.json(ret)
+        await series.prepare_json()
+        return json_response(series_json(series, discord_user, keys))
 
     async def get(self, req: Request, tag: str):
         tag = urllib.parse.unquote(tag)
+        load_fields, keys = parse_fields(req)
 
         try:
-            series = await Series.load(app.ctx.redis, tag)
+            series = await Series.load(app.ctx.redis, tag, load_fields)
         except SeriesNotFound:
             raise exceptions.NotFound("Could not find series " + tag)
 
-        return SeriesView.respond_with_series(req, series)
+        return await SeriesView.respond_with_series(req, series, keys)
 
     async def patch(self, req: Request, tag: str):
         tag = urllib.parse.unquote(tag)
@@ -112,7 +237,7 @@ class SeriesView(HTTPMethodView):
             new_tag = data["tag"].strip()
 
             try:
-                await Series.load(redis, new_tag)
+                await Series.load(redis, new_tag, fields=())
                 raise exceptions.InvalidUsage(
                     'A series with tag "{}" already exists.'.format(new_tag)
                 )
@@ -145,7 +270,7 @@ class SeriesView(HTTPMethodView):
             series.snippets = new_snippet_seq
             await series.save()
 
-        return SeriesView.respond_with_series(req, series)
+        return await SeriesView.respond_with_series(req, series)
 
     async def delete(self, req: Request, tag: str):
         tag = urllib.parse.unquote(tag)
@@ -156,13 +281,14 @@ class SeriesView(HTTPMethodView):
             raise exceptions.Forbidden("Not logged in")
 
         try:
-            series = await Series.load(redis, tag)
+            series = await Series.load(
+                redis, tag, fields=("title", "subscribers", "channels")
+            )
         except SeriesNotFound:
             raise exceptions.NotFound("Could not find series " + tag)
 
-        if (
-            discord_user.id not in series.author_ids
-            and not discord_user.is_snippet_manager()
+        if discord_user.id not in series.author_ids and not series.is_snippet_manager(
+            discord_user.as_author
         ):
             raise exceptions.Forbidden("User is not series author")
 
@@ -171,3 +297,45 @@ class SeriesView(HTTPMethodView):
 
 
 series_api.add_route(SeriesView.as_view(), "/<tag>")
+
+
+@series_api.get("/<tag>/live")
+async def get_live_series_updates(req: Request, tag: str):
+    """Stream change events for one series."""
+    return live_response(urllib.parse.unquote(tag))
+
+
+@series_api.get("/<tag>/export")
+async def export_series(req: Request, tag: str):
+    tag = urllib.parse.unquote(tag)
+    redis: aioredis.Redis = app.ctx.redis
+
+    fmt = req.args.get("format", "md")
+    try:
+        content_type = export.EXPORT_FORMATS[fmt]
+    except KeyError:
+        raise exceptions.InvalidUsage(
+            "Export format must be one of: " + ", ".join(export.EXPORT_FORMATS)
+        ) from None
+
+    try:
+        info = await export.SeriesExportInfo.load(redis, tag)
+    except SeriesNotFound:
+        raise exceptions.NotFound("Could not find series " + tag)
+
+    # plain ASCII fallback for clients that don't understand filename*
+    ascii_name = "".join(
+        c if c.isascii() and (c.isalnum() or c in "-_") else "_" for c in tag
+    )
+    disposition = "attachment; filename=\"{0}.{2}\"; filename*=UTF-8''{1}.{2}".format(
+        ascii_name, urllib.parse.quote(tag), fmt
+    )
+    headers = {"Content-Disposition": disposition}
+
+    async def stream_export(resp: response.StreamingHTTPResponse):
+        if fmt == "epub":
+            await export.export_epub(redis, info, resp.write)
+        else:
+            await export.export_text(redis, info, resp.write, markdown=(fmt == "md"))
+
+    return response.stream(stream_export, headers=headers, content_type=content_type)
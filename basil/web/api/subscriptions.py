@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import urllib.parse
+
+import aioredis
+from sanic import Sanic, Blueprint, Request, response, exceptions
+
+from ... import subscriptions
+from .auth import DiscordUserInfo
+
+subscriptions_api = Blueprint("subscriptions_api", url_prefix="/subscriptions")
+app = Sanic.get_app("basil")
+
+
+@subscriptions_api.exception(exceptions.NotFound, exceptions.Forbidden)
+async def api_exception_handler(_req: Request, exception: exceptions.SanicException):
+    return response.text(exception.args[0], status=exception.status_code)
+
+
+async def require_user(req: Request) -> DiscordUserInfo:
+    discord_user = await DiscordUserInfo.load(req)
+    if discord_user is None:
+        raise exceptions.Forbidden("Not logged in")
+    return discord_user
+
+
+@subscriptions_api.get("/")
+async def get_subscriptions(req: Request):
+    redis: aioredis.Redis = app.ctx.redis
+    discord_user = await require_user(req)
+
+    tags = sorted(await subscriptions.get_subscriptions(redis, discord_user.id))
+    titles = []
+    if len(tags) > 0:
+        titles = await redis.mget(["series:" + tag + ":title" for tag in tags])
+
+    return response.json(
+        [
+            {
+                "tag": tag,
+                "title": title or tag.replace("_", " ").replace("-", " ").strip(),
+            }
+            for tag, title in zip(tags, titles)
+        ]
+    )
+
+
+@subscriptions_api.delete("/")
+async def unsubscribe_all(req: Request):
+    discord_user = await require_user(req)
+    removed = await subscriptions.unsubscribe_all(app.ctx.redis, discord_user.id)
+    return response.json({"removed": removed})
+
+
+@subscriptions_api.put("/<tag>")
+async def subscribe(req: Request, tag: str):
+    tag = urllib.parse.unquote(tag)
+    redis: aioredis.Redis = app.ctx.redis
+    discord_user = await require_user(req)
+
+    if not await redis.exists("series:" + tag + ":snippets"):
+        raise exceptions.NotFound("Could not find series " + tag)
+
+    await subscriptions.subscribe(redis, tag, discord_user.id)
+    return response.empty()
+
+
+@subscriptions_api.delete("/<tag>")
+async def unsubscribe(req: Request, tag: str):
+    tag = urllib.parse.unquote(tag)
+    discord_user = await require_user(req)
+
+    if not await subscriptions.unsubscribe(app.ctx.redis, tag, discord_user.id):
+        raise exceptions.NotFound("Not subscribed to series " + tag)
+    return response.empty()
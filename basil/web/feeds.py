@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Awaitable, Callable, Hashable, Optional, Tuple
+import urllib.parse
+
+from sanic import Sanic, Blueprint, Request, response, exceptions
+
+from .. import author as author_mod
+from .. import feeds
+from ..cache import TTLCache
+
+feeds_view = Blueprint("feeds", url_prefix="/feeds")
+app = Sanic.get_app("basil")
+
+FEED_CONTENT_TYPE = "application/atom+xml; charset=utf-8"
+
+# Generated feed documents, keyed by feed, with the ETag they were built for.
+FEED_CACHE_SIZE = 1000
+FEED_CACHE_TTL = 60 * 60
+feed_cache: TTLCache[Tuple[str, str]] = TTLCache(FEED_CACHE_SIZE, FEED_CACHE_TTL)
+
+
+def is_not_modified(req: Request, version: feeds.FeedVersion) -> bool:
+    if_none_match = req.headers.get("If-None-Match")
+    if if_none_match is not None:
+        etags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in etags or version.etag in etags or ("W/" + version.etag) in etags
+
+    if_modified_since = req.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(version.updated) <= since
+
+    return False
+
+
+async def feed_response(
+    req: Request,
+    key: Hashable,
+    version: Optional[feeds.FeedVersion],
+    build: Callable[[], Awaitable[Optional[str]]],
+) -> response.HTTPResponse:
+    if version is None:
+        raise exceptions.NotFound("Could not find feed")
+
+    headers = {
+        "ETag": version.etag,
+        "Last-Modified": formatdate(version.updated, usegmt=True),
+        "Cache-Control": "public, max-age=300",
+    }
+    if is_not_modified(req, version):
+        return response.empty(status=304, headers=headers)
+
+    cached = feed_cache.get(key)
+    if cached is not None and cached[0] == version.etag:
+        body = cached[1]
+    else:
+        body = await build()
+        if body is None:
+            raise exceptions.NotFound("Could not find feed")
+        feed_cache.set(key, (version.etag, body))
+
+    return response.text(body, headers=headers, content_type=FEED_CONTENT_TYPE)
+
+
+def strip_extension(filename: str) -> str:
+    if not filename.endswith(".atom"):
+        raise exceptions.NotFound("Could not find feed")
+    return urllib.parse.unquote(filename[: -len(".atom")])
+
+
+@feeds_view.get("/recent.atom")
+async def recent_feed(req: Request):
+    redis = app.ctx.redis
+    version = await feeds.recent_feed_version(redis)
+
+    return await feed_response(
+        req,
+        ("recent",),
+        version,
+        lambda: feeds.build_index_feed(
+            redis, version, "Recently updated series", "/feeds/recent.atom"
+        ),
+    )
+
+
+@feeds_view.get("/series/<filename>")
+async def series_feed(req: Request, filename: str):
+    redis = app.ctx.redis
+    tag = strip_extension(filename)
+    version = await feeds.series_feed_version(redis, tag)
+
+    return await feed_response(
+        req, ("series", tag), version, lambda: feeds.build_series_feed(redis, tag)
+    )
+
+
+@feeds_view.get("/author/<filename>")
+async def author_feed(req: Request, filename: str):
+    redis = app.ctx.redis
+    try:
+        author_id = int(strip_extension(filename))
+    except ValueError:
+        raise exceptions.NotFound("Could not find feed") from None
+
+    version = await feeds.author_feed_version(redis, author_id)
+
+    def build():
+        name = author_mod.Author.get_by_id(author_id).joined_display_names
+        return feeds.build_index_feed(
+            redis,
+            version,
+            "Series by " + name,
+            "/feeds/author/{}.atom".format(author_id),
+        )
+
+    return await feed_response(req, ("author", author_id), version, build)
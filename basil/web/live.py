@@ -0,0 +1,187 @@
+"""Live series updates pushed to open pages with Server-Sent Events.
+
+Each web worker holds a single Redis pub/sub subscription to the series
+change events, and fans each event out to the queues of its connected
+clients. Client queues are bounded: a client that falls too far behind is
+sent a "reset" event and disconnected, and is expected to reload what it
+shows before reconnecting.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Set
+
+import aioredis
+from aioredis.exceptions import RedisError
+
+from .. import events, redis_pool
+from ..config import config
+from ..metrics import Counter, Gauge
+
+# Events buffered per client before it is disconnected.
+CLIENT_QUEUE_SIZE = 32
+
+# Seconds between keepalive comments on idle connections. This must be less
+# than Sanic's response timeout, which is reset whenever data is written.
+KEEPALIVE_INTERVAL = 20
+
+# Maximum seconds to wait before resubscribing after losing the connection.
+MAX_RECONNECT_DELAY = 30
+
+LIVE_CLIENTS = Gauge(
+    "basil_live_clients",
+    "Clients connected to live update streams in this worker.",
+)
+
+LIVE_CLIENTS_DROPPED = Counter(
+    "basil_live_clients_dropped_total",
+    "Live update clients disconnected for falling too far behind.",
+)
+
+LIVE_EVENTS = Counter(
+    "basil_live_events_total",
+    "Series change events received over pub/sub by this worker.",
+)
+
+
+class LiveClient(object):
+    def __init__(self, tag: Optional[str]):
+        # None if the client follows all series.
+        self.tag: Optional[str] = tag
+        self.queue: asyncio.Queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self.dropped: bool = False
+
+    def push(self, message: str):
+        if self.dropped:
+            return
+
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped = True
+            LIVE_CLIENTS_DROPPED.inc()
+
+
+def format_event(kind: str, data: dict) -> str:
+    return "event: {}\ndata: {}\n\n".format(kind, json.dumps(data))
+
+
+class LiveHub(object):
+    """Fans out series change events to the clients connected to a worker."""
+
+    def __init__(self, redis: aioredis.Redis):
+        # used for lookups, not for the subscription itself
+        self.redis: aioredis.Redis = redis
+        self.clients: Dict[Optional[str], Set[LiveClient]] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def connect(self, tag: Optional[str]) -> LiveClient:
+        client = LiveClient(tag)
+        self.clients.setdefault(tag, set()).add(client)
+        LIVE_CLIENTS.inc()
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return client
+
+    def disconnect(self, client: LiveClient):
+        clients = self.clients.get(client.tag)
+        if clients is None or client not in clients:
+            return
+
+        clients.discard(client)
+        if len(clients) == 0:
+            del self.clients[client.tag]
+        LIVE_CLIENTS.dec()
+
+    def broadcast(self, message: str, tags: List[str]):
+        for key in [None] + tags:
+            for client in self.clients.get(key, ()):
+                client.push(message)
+
+    def broadcast_all(self, message: str):
+        for clients in self.clients.values():
+            for client in clients:
+                client.push(message)
+
+    async def dispatch(self, data: dict):
+        kind = data["type"]
+        if kind == "snippet":
+            tags = sorted(
+                await self.redis.smembers("snippet:" + data["message_id"] + ":series")
+            )
+        elif kind == "rename":
+            tags = [data["tag"], data["new_tag"]]
+        else:
+            tags = [data["tag"]]
+
+        self.broadcast(format_event(kind, dict(data, tags=tags)), tags)
+
+    async def run(self):
+        # This connection blocks waiting for messages, so it has its own
+        # client without a command timeout.
+        subscriber = redis_pool.create_redis(
+            config.primary_redis_url,
+            socket_connect_timeout=config.redis_connect_timeout,
+        )
+        delay = 1
+        first = True
+
+        while True:
+            try:
+                async with subscriber.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(events.EVENTS_CHANNEL)
+                    if not first:
+                        # events may have been missed while disconnected
+                        self.broadcast_all(format_event("reset", {}))
+                    first = False
+                    delay = 1
+
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+
+                        LIVE_EVENTS.inc()
+                        try:
+                            await self.dispatch(json.loads(message["data"]))
+                        except (RedisError, ValueError, KeyError):
+                            logging.exception("Could not dispatch live event")
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError):
+                logging.warning(
+                    "Lost live event subscription; retrying in {} s".format(delay),
+                    exc_info=True,
+                )
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+async def stream_events(hub: LiveHub, client: LiveClient, write):
+    """Write events for a client until it disconnects or is dropped."""
+    try:
+        await write(": connected\n\n")
+
+        while True:
+            try:
+                message = await asyncio.wait_for(client.queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await write(": keepalive\n\n")
+                continue
+
+            if client.dropped:
+                await write(format_event("reset", {}))
+                return
+
+            await write(message)
+    finally:
+        hub.disconnect(client)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+from sanic import Sanic, Blueprint, Request, response, exceptions
+
+from ..media import (
+    MediaCache,
+    MediaNotFound,
+    MediaUnavailable,
+    load_attachment_urls,
+    media_etag,
+)
+
+media_view = Blueprint("media", url_prefix="/media")
+app = Sanic.get_app("basil")
+
+# Attachments at a given path only change if their snippet is edited, so
+# browsers may reuse them for a day before revalidating with the ETag.
+MEDIA_CACHE_CONTROL = "public, max-age=86400"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into an inclusive byte range.
+
+    Returns None if the header should be ignored, and raises
+    RangeNotSatisfiable if no part of the range is within the content.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        # multiple ranges may be answered with the whole content
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if sep == "":
+        return None
+
+    try:
+        if first == "":
+            # the last N bytes
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - suffix), size - 1
+
+        start = int(first)
+        end = int(last) if last != "" else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+@media_view.get("/<message_id:int>/<n:int>")
+async def get_media(req: Request, message_id: int, n: int):
+    urls = await load_attachment_urls(app.ctx.redis, message_id)
+    if urls is None or n < 0 or n >= len(urls):
+        raise exceptions.NotFound("Could not find attachment")
+
+    # the ETag depends only on the URL, so revalidation needs no disk access
+    cache: MediaCache = app.ctx.media
+    etag = media_etag(cache.key(urls[n]))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": MEDIA_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = req.headers.get("If-None-Match")
+    if if_none_match is not None:
+        etags = [t.strip() for t in if_none_match.split(",")]
+        if "*" in etags or etag in etags or ("W/" + etag) in etags:
+            return response.empty(status=304, headers=headers)
+
+    try:
+        entry = await cache.get(urls[n])
+    except MediaNotFound:
+        raise exceptions.NotFound("Could not find attachment") from None
+    except MediaUnavailable:
+        return response.text("Could not fetch attachment", status=502)
+
+    size = len(entry.data)
+    byte_range = None
+    range_header = req.headers.get("Range")
+    if_range = req.headers.get("If-Range")
+    if range_header is not None and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = "bytes */{}".format(size)
+            return response.empty(status=416, headers=headers)
+
+    if byte_range is None:
+        return response.raw(
+            entry.data, headers=headers, content_type=entry.content_type
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+    return response.raw(
+        entry.data[start : end + 1],
+        status=206,
+        headers=headers,
+        content_type=entry.content_type,
+    )
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import hmac
+import time
+
+from aioredis import Redis
+from sanic import Sanic, Blueprint, response, exceptions
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from .. import tracing
+from ..config import config
+from ..metrics import REGISTRY, Gauge, Histogram
+from ..series import SERIES_INDEX_KEY
+
+# Totals are computed with SCAN, so refresh them at most this often (seconds).
+TOTALS_REFRESH_INTERVAL = 60
+
+metrics_view = Blueprint("metrics_view")
+app = Sanic.get_app("basil")
+
+HTTP_LATENCY = Histogram(
+    "basil_http_request_duration_seconds",
+    "Time taken to handle HTTP requests, by route.",
+    ("route", "method", "status"),
+)
+
+SERIES_TOTAL = Gauge("basil_series_total", "Number of series in the library.")
+SNIPPETS_TOTAL = Gauge("basil_snippets_total", "Number of stored snippets.")
+SESSIONS_TOTAL = Gauge(
+    "basil_sessions_total", "Number of web sessions with a logged-in user."
+)
+
+_last_totals_refresh: float = 0
+
+
+async def _count_keys(redis: Redis, pattern: str) -> int:
+    count = 0
+    async for _ in redis.scan_iter(match=pattern, count=1000):
+        count += 1
+    return count
+
+
+async def refresh_totals(redis: Redis):
+    global _last_totals_refresh
+
+    now = time.monotonic()
+    if now - _last_totals_refresh < TOTALS_REFRESH_INTERVAL:
+        return
+    _last_totals_refresh = now
+
+    SERIES_TOTAL.set(await redis.scard(SERIES_INDEX_KEY))
+    SNIPPETS_TOTAL.set(await _count_keys(redis, "snippet:*:content"))
+    SESSIONS_TOTAL.set(await _count_keys(redis, "sessions:users:*"))
+
+
+def _route_label(request: Request) -> str:
+    route = getattr(request, "route", None)
+    if route is None:
+        return "unmatched"
+    return "/" + route.path
+
+
+@app.middleware("request")
+async def start_request_timer(request: Request):
+    # Request middleware is run a second time when a handler raises, so keep
+    # the original start time around.
+    if not hasattr(request.ctx, "start_time"):
+        request.ctx.start_time = time.perf_counter()
+        tracing.start_trace("request", request.method + " " + _route_label(request))
+
+
+@app.middleware("response")
+async def record_request_metrics(request: Request, response: HTTPResponse):
+    start_time = getattr(request.ctx, "start_time", None)
+    if start_time is None:
+        return
+
+    tracing.end_trace()
+
+    HTTP_LATENCY.labels(_route_label(request), request.method, response.status).observe(
+        time.perf_counter() - start_time
+    )
+
+
+def is_authorized_scraper(request: Request) -> bool:
+    if len(config.metrics_token) == 0:
+        return False
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.casefold() != "bearer":
+        return False
+    return hmac.compare_digest(token.strip().encode(), config.metrics_token.encode())
+
+
+@metrics_view.get("/metrics")
+async def get_metrics(req: Request):
+    if not is_authorized_scraper(req):
+        # don't advertise the endpoint to anyone without the token
+        raise exceptions.NotFound("Requested URL /metrics not found")
+
+    await refresh_totals(app.ctx.redis)
+    return response.text(
+        REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from aiohttp import ClientSession, ClientResponse, ClientResponseError
+from aiohttp import ClientSession, ClientResponse, ClientResponseError, ClientError
 from aioredis import Redis, RedisError
+import asyncio
 import logging
 import secrets
 import time
@@ -13,10 +14,42 @@ from sanic.request import Request
 from sanic.response import redirect, HTTPResponse
 from sanic.exceptions import InvalidUsage, ServerError
 
+from .session import ensure_session
+
 STATE_START = "unauthenticated"
 STATE_INPROGRESS = "in-progress"
 STATE_AUTHORIZED = "authorized"
 REDIS_BASE_PREFIX = "sessions:auth"
+REFRESH_SCHEDULE_PREFIX = "sessions:refresh"
+REFRESH_LOCK_PREFIX = "sessions:refresh_lock"
+
+# Tokens are refreshed in the background once they are this close to expiring.
+REFRESH_WINDOW = 86400
+
+# Seconds between checks for tokens that are due to be refreshed.
+REFRESH_INTERVAL = 60
+
+# Maximum number of sessions refreshed per check.
+REFRESH_BATCH_SIZE = 50
+
+# How long to wait before retrying a failed refresh.
+REFRESH_RETRY_DELAY = 300
+
+# How long a worker may hold the refresh lock for a session.
+REFRESH_LOCK_TIMEOUT = 60
+
+# Release a refresh lock only if it is still held by the releasing worker,
+# and not by another worker that took it over after it expired.
+#
+# KEYS[1] is the lock key.
+#
+# ARGV[1] is the token the lock was taken with.
+RELEASE_LOCK_SCRIPT = r"""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 
 app = Sanic.get_app("basil")
 
@@ -40,6 +73,14 @@ class OAuth2API(object):
         self.client_secret: str = client_secret
         self.prefix: str = prefix
 
+    @property
+    def refresh_schedule_key(self) -> str:
+        """Sorted set of session IDs, scored by when their tokens need refreshing."""
+        return REFRESH_SCHEDULE_PREFIX + ":" + self.prefix
+
+    def auth_data_key(self, session_id: str) -> str:
+        return REDIS_BASE_PREFIX + ":" + self.prefix + ":" + session_id
+
     def authorization_url(self, nonce: str, scopes: str, **kwargs) -> str:
         qstring = urlencode(
             {
@@ -99,7 +140,7 @@ class OAuth2API(object):
 
     async def load_request_context(self, req: Request) -> OAuth2Context:
         return await OAuth2Context.load(
-            req.ctx.session, app.ctx.http_session, app.ctx.redis, self
+            ensure_session(req), app.ctx.http_session, app.ctx.redis, self
         )
 
 
@@ -110,7 +151,7 @@ class OAuth2Context(object):
         http_session: ClientSession,
         redis: Redis,
         api: OAuth2API,
-        **kwargs
+        **kwargs,
     ):
         self.session_id = session_id
         self.http = http_session
@@ -132,7 +173,7 @@ class OAuth2Context(object):
 
     @property
     def auth_data_key(self) -> str:
-        return REDIS_BASE_PREFIX + ":" + self.api.prefix + ":" + self.session_id
+        return self.api.auth_data_key(self.session_id)
 
     @property
     def expire_in(self) -> float:
@@ -149,9 +190,7 @@ class OAuth2Context(object):
     async def load(
         cls, session_id: str, http_session: ClientSession, redis: Redis, api: OAuth2API
     ) -> OAuth2Context:
-        data = await redis.hgetall(
-            REDIS_BASE_PREFIX + ":" + api.prefix + ":" + session_id
-        )
+        data = await redis.hgetall(api.auth_data_key(session_id))
         if data is None:
             data = {}
 
@@ -174,7 +213,10 @@ class OAuth2Context(object):
                 )
 
         try:
-            await self.redis.delete(self.auth_data_key)
+            async with self.redis.pipeline(transaction=True) as tr:
+                tr.delete(self.auth_data_key)
+                tr.zrem(self.api.refresh_schedule_key, self.session_id)
+                await tr.execute()
         except RedisError:
             logging.error(
                 "Could not delete Redis key {} for session {}".format(
@@ -251,6 +293,12 @@ class OAuth2Context(object):
                 )
                 tr.hdel(self.auth_data_key, "nonce", "landing")
                 tr.expireat(self.auth_data_key, int(self.expire_time))
+
+                if self.refresh_token is not None:
+                    tr.zadd(
+                        self.api.refresh_schedule_key,
+                        {self.session_id: self.expire_time - REFRESH_WINDOW},
+                    )
                 await tr.execute()
         except RedisError:
             raise ServerError("Could not save authorization data to Redis")
@@ -295,9 +343,10 @@ class OAuth2Context(object):
         await self._save_token(resp)
 
     async def credentials(self) -> Optional[Tuple[str, str]]:
-        """Get the access token and its type, refreshing as necessary.
+        """Get the access token and its type.
 
-        If the token is close to expiring, it will automatically be refreshed.
+        Tokens are refreshed ahead of expiry by `OAuth2RefreshScheduler`, so
+        this never calls out to the token endpoint.
         If the token has expired or has not been obtained yet, returns None.
         """
         if self.state != STATE_AUTHORIZED:
@@ -306,8 +355,6 @@ class OAuth2Context(object):
         if self.expire_in <= 0:
             await self.reset()
             return None
-        elif self.expire_in <= 86400:
-            await self.refresh()
 
         if self.token_type is None or self.access_token is None:
             return None
@@ -320,3 +367,110 @@ class OAuth2Context(object):
         if creds is None:
             return None
         return {"Authorization": creds[0] + " " + creds[1]}
+
+
+class OAuth2RefreshScheduler(object):
+    """Refreshes access tokens in the background before they expire.
+
+    Sessions are scheduled in a Redis sorted set when their tokens are saved.
+    Each web worker runs a scheduler; a per-session Redis lock ensures that
+    only one of them refreshes a given session at a time.
+    """
+
+    def __init__(self, api: OAuth2API, http_session: ClientSession, redis: Redis):
+        self.api: OAuth2API = api
+        self.http: ClientSession = http_session
+        self.redis: Redis = redis
+
+    def lock_key(self, session_id: str) -> str:
+        return REFRESH_LOCK_PREFIX + ":" + self.api.prefix + ":" + session_id
+
+    async def backfill(self):
+        """Schedule refreshes for authorized sessions created before scheduling existed."""
+        key: str
+        async for key in self.redis.scan_iter(
+            match=REDIS_BASE_PREFIX + ":" + self.api.prefix + ":*"
+        ):
+            session_id = key.rsplit(":", 1)[1]
+            if await self.redis.zscore(self.api.refresh_schedule_key, session_id):
+                continue
+
+            ctx = await OAuth2Context.load(session_id, self.http, self.redis, self.api)
+            if (
+                ctx.state == STATE_AUTHORIZED
+                and ctx.refresh_token is not None
+                and ctx.expire_time is not None
+            ):
+                await self.redis.zadd(
+                    self.api.refresh_schedule_key,
+                    {session_id: ctx.expire_time - REFRESH_WINDOW},
+                )
+
+    async def run(self):
+        try:
+            await self.backfill()
+        except Exception:
+            logging.exception("Could not backfill OAuth2 refresh schedule")
+
+        while True:
+            try:
+                await self.refresh_due()
+            except Exception:
+                logging.exception("Caught exception in OAuth2 refresh scheduler")
+
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    async def refresh_due(self):
+        due = await self.redis.zrangebyscore(
+            self.api.refresh_schedule_key,
+            "-inf",
+            time.time(),
+            start=0,
+            num=REFRESH_BATCH_SIZE,
+        )
+
+        for session_id in due:
+            await self.refresh_session(session_id)
+
+    async def refresh_session(self, session_id: str):
+        lock_key = self.lock_key(session_id)
+        lock_token = secrets.token_hex(16)
+        if not await self.redis.set(
+            lock_key, lock_token, nx=True, ex=REFRESH_LOCK_TIMEOUT
+        ):
+            # another worker is handling this session
+            return
+
+        try:
+            ctx = await OAuth2Context.load(session_id, self.http, self.redis, self.api)
+
+            if ctx.state != STATE_AUTHORIZED or ctx.refresh_token is None:
+                await self.redis.zrem(self.api.refresh_schedule_key, session_id)
+                return
+
+            if ctx.expire_in > REFRESH_WINDOW:
+                # already refreshed by someone else; make sure it's rescheduled
+                await self.redis.zadd(
+                    self.api.refresh_schedule_key,
+                    {session_id: ctx.expire_time - REFRESH_WINDOW},
+                )
+                return
+
+            try:
+                await ctx.refresh()
+                logging.info("Refreshed OAuth2 token for session " + session_id)
+            except (ServerError, ClientError):
+                logging.error(
+                    "Could not refresh token for session " + session_id, exc_info=True
+                )
+
+                if ctx.expire_in <= REFRESH_RETRY_DELAY:
+                    await ctx.reset()
+                else:
+                    await self.redis.zadd(
+                        self.api.refresh_schedule_key,
+                        {session_id: time.time() + REFRESH_RETRY_DELAY},
+                    )
+        finally:
+            release = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+            await release(keys=[lock_key], args=[lock_token])
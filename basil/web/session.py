@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import secrets
+from typing import Optional
+
+from itsdangerous import Signer, BadSignature
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from ..config import config
+
+SESSION_COOKIE_ID = "session"
+SESSION_COOKIE_MAX_AGE = 86400 * 7
+
+cookie_signer = Signer(
+    bytes.fromhex(config.cookie_signer_key), digest_method=hashlib.sha256
+)
+app = Sanic.get_app("basil")
+
+
+def ensure_session(request: Request) -> str:
+    """Get the session ID for a request, starting a new session if needed.
+
+    Session cookies are only issued through this function, so visitors who
+    never log in never get a session (or any session state in Redis).
+    """
+    if request.ctx.session is None:
+        request.ctx.session = secrets.token_urlsafe(16)
+        request.ctx.add_sess_cookie = True
+    return request.ctx.session
+
+
+@app.middleware("request")
+async def load_session_id(request: Request):
+    # Request middleware is run again if a handler raises an exception.
+    if hasattr(request.ctx, "session"):
+        return
+
+    sess_id: Optional[str] = None
+    try:
+        cookie_data = request.cookies[SESSION_COOKIE_ID]
+        sess_id = cookie_signer.unsign(cookie_data).decode("utf-8")
+    except (BadSignature, UnicodeDecodeError):
+        origin_ip = request.remote_addr
+        if origin_ip is None or len(origin_ip) == 0:
+            origin_ip = request.ip
+        logging.warning("IP {} presented invalid session cookie".format(origin_ip))
+    except KeyError:
+        pass
+
+    request.ctx.session = sess_id
+    request.ctx.add_sess_cookie = False
+
+
+@app.middleware("response")
+async def save_session_id(request: Request, response: HTTPResponse):
+    if getattr(request.ctx, "add_sess_cookie", False):
+        signed = cookie_signer.sign(request.ctx.session).decode("utf-8")
+        response.cookies[SESSION_COOKIE_ID] = signed
+        response.cookies[SESSION_COOKIE_ID]["secure"] = True
+        response.cookies[SESSION_COOKIE_ID]["max-age"] = SESSION_COOKIE_MAX_AGE
@@ -1,18 +1,32 @@
 from __future__ import annotations
 
+from datetime import datetime, timezone
 import discord
+from typing import Optional
 from jinja2 import Environment, PackageLoader, select_autoescape
 from sanic import Sanic, Blueprint, Request, response, exceptions
 import urllib.parse
 
-from ..series import Series, SeriesNotFound
+from ..author import Author
+from ..series import Series, SeriesNotFound, get_author_summaries
 from ..config import config
 
 view = Blueprint("view", url_prefix="/series")
+author_view = Blueprint("author_view", url_prefix="/authors")
 app = Sanic.get_app("basil")
 env = Environment(loader=PackageLoader("basil.web"), autoescape=select_autoescape())
 
+
+def format_timestamp(t: Optional[float]) -> str:
+    if t is None:
+        return "Unknown"
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+env.filters["timestamp"] = format_timestamp
+
 series_template = env.get_template("series.html.j2")
+author_template = env.get_template("author.html.j2")
 
 
 @view.get("/<name>")
@@ -24,7 +38,23 @@ async def series(_req: Request, name: str):
     except SeriesNotFound:
         raise exceptions.NotFound("Could not find series " + name)
 
+    await series.prepare_json()
     rendered = series_template.render(
         series=series, static_manifest=config.static_manifest
     )
     return response.html(rendered)
+
+
+@author_view.get("/<author_id:int>")
+async def author(_req: Request, author_id: int):
+    summaries = await get_author_summaries(app.ctx.redis, author_id)
+    if len(summaries) == 0:
+        raise exceptions.NotFound("Could not find author " + str(author_id))
+
+    rendered = author_template.render(
+        author=Author.get_by_id(author_id),
+        summaries=summaries,
+        wordcount=sum(summary.wordcount for summary in summaries),
+        static_manifest=config.static_manifest,
+    )
+    return response.html(rendered)
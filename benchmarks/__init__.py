@@ -0,0 +1,5 @@
+"""Benchmarks and load-testing tools for Basil.
+
+These are run as modules from the repository root, e.g.
+`python -m benchmarks.storage --help`.
+"""
@@ -0,0 +1,147 @@
+"""Synthetic library generator for benchmarks.
+
+Generated snippets look roughly like real ones: prose paragraphs up to
+Discord's 2000 character message limit, occasional content warning lines,
+user mentions and custom emoji. Generation is deterministic for a given seed.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import random
+from typing import List
+
+from basil.series import Series
+from basil.snippet import Snippet
+
+MAX_MESSAGE_LENGTH = 2000
+
+WORDS = """
+the a an and but or of to in on at by for with from into over under after
+before while as she he they it we you her his their its our your was were is
+are be been had has have did does said asked whispered shouted looked turned
+walked ran stood sat fell rose held took gave found left kept knew thought
+felt seemed became began light dark night morning evening sky sea river
+forest city tower door window road stone fire water wind storm rain snow
+blood bone hand eye face voice heart name sword blade shield ship crown
+letter book map key ring dream memory silence shadow ghost king queen
+knight witch dragon stranger friend brother sister mother father child
+old young cold warm quiet loud slow quick bright broken empty heavy soft
+""".split()
+
+CONTENT_WARNINGS = [
+    "violence",
+    "blood",
+    "death",
+    "body horror",
+    "language",
+    "self harm",
+    "abuse",
+    "gore",
+]
+
+CW_FORMATS = ["CW: {}", "(cw {})", "[TW: {}]", "||cw: {}||", "tw - {}"]
+
+
+@dataclass
+class DatasetParams:
+    series_count: int = 100
+    snippets_per_series: int = 20
+    min_length: int = 400
+    max_length: int = MAX_MESSAGE_LENGTH
+    cw_probability: float = 0.2
+    author_count: int = 25
+    seed: int = 0
+
+
+class DatasetGenerator(object):
+    def __init__(self, params: DatasetParams):
+        self.params: DatasetParams = params
+        self.rng = random.Random(params.seed)
+        self.next_id: int = 800000000000000000
+        self.author_ids: List[int] = [
+            self._snowflake() for _ in range(params.author_count)
+        ]
+        self.channel_ids: List[int] = [self._snowflake() for _ in range(5)]
+
+    def _snowflake(self) -> int:
+        self.next_id += self.rng.randint(1 << 22, 1 << 30)
+        return self.next_id
+
+    def sentence(self) -> str:
+        words = self.rng.choices(WORDS, k=self.rng.randint(5, 20))
+        return " ".join(words).capitalize() + self.rng.choice([".", ".", ".", "!", "?"])
+
+    def content(self) -> str:
+        p = self.params
+        target = self.rng.randint(p.min_length, p.max_length)
+        lines = []
+
+        if self.rng.random() < p.cw_probability:
+            cws = self.rng.sample(CONTENT_WARNINGS, k=self.rng.randint(1, 3))
+            lines.append(self.rng.choice(CW_FORMATS).format(", ".join(cws)))
+
+        length = sum(len(line) + 1 for line in lines)
+        paragraph: List[str] = []
+
+        while length < target:
+            s = self.sentence()
+            roll = self.rng.random()
+            if roll < 0.03:
+                s += " <@!" + str(self.rng.choice(self.author_ids)) + ">"
+            elif roll < 0.06:
+                s += " <:emote:" + str(self._snowflake()) + ">"
+
+            paragraph.append(s)
+            length += len(s) + 1
+
+            if self.rng.random() < 0.2:
+                lines.append(" ".join(paragraph))
+                lines.append("")
+                paragraph = []
+
+        if len(paragraph) > 0:
+            lines.append(" ".join(paragraph))
+
+        return "\n".join(lines)[: p.max_length].strip()
+
+    def title(self) -> str:
+        words = self.rng.choices(WORDS, k=self.rng.randint(1, 4))
+        return " ".join(w.capitalize() for w in words)
+
+    async def populate(self, redis) -> List[str]:
+        """Generate and save a library, returning the tags of all series."""
+        p = self.params
+        tags = []
+
+        for i in range(p.series_count):
+            author_id = self.rng.choice(self.author_ids)
+            channel_id = self.rng.choice(self.channel_ids)
+            snippets = []
+
+            for _ in range(p.snippets_per_series):
+                attachments = []
+                if self.rng.random() < 0.05:
+                    attachments.append(
+                        "https://cdn.discordapp.com/attachments/{}/{}/image.png".format(
+                            channel_id, self._snowflake()
+                        )
+                    )
+
+                snippet = Snippet(
+                    redis,
+                    self.content(),
+                    self._snowflake(),
+                    channel_id,
+                    author_id,
+                    attachments,
+                )
+                await snippet.save()
+                snippets.append(snippet)
+
+            tag = "{}_{}".format(self.title().replace(" ", "_").lower(), i)
+            series = Series(redis, tag, {author_id}, snippets, title=self.title())
+            await series.save()
+            tags.append(tag)
+
+        return tags
@@ -0,0 +1,95 @@
+"""Set up a self-contained environment for importing `basil` outside of a
+deployment.
+
+`basil.config` loads its configuration at import time, so `setup()` must be
+called before anything from `basil` is imported.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import secrets
+import tempfile
+from typing import Any, Dict, Optional
+
+_workdir: Optional[Path] = None
+
+
+def setup(reuse_existing: bool = False, **overrides: Any) -> Path:
+    """Write a throwaway config file and point `BASIL_CONFIG` at it.
+
+    If `reuse_existing` is set and `BASIL_CONFIG` is already set (for example,
+    by a parent process), the existing config file is used as-is.
+    """
+    global _workdir
+
+    if _workdir is not None:
+        return _workdir
+
+    if reuse_existing and "BASIL_CONFIG" in os.environ:
+        _workdir = Path(os.environ["BASIL_CONFIG"]).parent
+        return _workdir
+
+    _workdir = Path(tempfile.mkdtemp(prefix="basil-bench-"))
+    manifest_path = _workdir.joinpath("static_manifest.json")
+    config_path = _workdir.joinpath("config.json")
+
+    with manifest_path.open("w", encoding="utf-8") as f:
+        json.dump({"js": {}, "css": {}}, f)
+
+    config: Dict[str, Any] = {
+        "discord_log": str(_workdir.joinpath("discord.log")),
+        "static_manifest_path": str(manifest_path),
+        "token": "",
+        "cookie_signer_key": secrets.token_hex(32),
+        "client_id": "0",
+        "client_secret": "",
+        "primary_redis_url": "redis://localhost:6379/0",
+        "api_base_url": "http://localhost:8080",
+        "oauth2_redirect_uri": "http://localhost:8080/api/auth/authorized",
+        "login_redirect_target": "/series_index.html",
+        "summon_prefix": "b!",
+        "management_role_name": "",
+        "primary_server_id": 0,
+        "maintenance_mode": False,
+        "dev_mode": True,
+        "administrators": [],
+        "media_cache_dir": str(_workdir.joinpath("media")),
+    }
+    config.update(overrides)
+
+    with config_path.open("w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+    os.environ["BASIL_CONFIG"] = str(config_path)
+    return _workdir
+
+
+class StubClient(object):
+    """Stands in for `BasilClient` where only its cache lookups are used."""
+
+    guilds = []
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    def get_user(self, user_id: int):
+        return None
+
+    def get_all_channels(self):
+        return iter(())
+
+
+def config_data() -> Dict[str, Any]:
+    with open(os.environ["BASIL_CONFIG"], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def install_stub_client() -> StubClient:
+    from basil import main
+
+    client = StubClient()
+    main.BasilClient._inst = client
+    return client
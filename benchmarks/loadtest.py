@@ -0,0 +1,452 @@
+"""HTTP load test for the web API, with Discord stubbed out.
+
+Usage:
+
+    python -m benchmarks.loadtest [--concurrency C] [--duration SECONDS]
+                                  [--workers N] [--redis-url URL [--flush]]
+
+This boots `basil.web.app` in a child process without starting the Discord
+client. Discord's OAuth2 token and `/users/@me` endpoints are served by a
+local stub server (with configurable latency) running in this process, which
+also stands in for the CDN serving snippet attachments to `/media`, and
+`get_client()` returns a stub with no guilds. The harness then drives
+`/api/series`, `/api/series/<tag>`, `/series/<name>` and `/api/auth/me` at
+the given concurrency, using a mix of anonymous and logged-in sessions, and
+reports throughput and p50/p99 latency per endpoint.
+
+By default each worker uses its own in-memory stand-in for Redis, seeded with
+the same synthetic library. Pass `--redis-url` to use a real (empty) Redis
+database instead; as with the storage benchmarks, it is flushed afterwards,
+and a non-empty database is refused unless `--flush` is also given.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+import hashlib
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+import urllib.parse
+
+import aiohttp
+from aiohttp import web
+from itsdangerous import Signer
+
+from . import environment
+
+SESSION_PREFIX = "loadtest-session-"
+USER_ID_BASE = 900000000000000000
+TOKEN_LIFETIME = 7 * 86400
+
+# Size in bytes of the stub attachments served to the media proxy.
+ATTACHMENT_SIZE = 64 * 1024
+
+# endpoint name -> relative weight in the request mix
+DEFAULT_MIX = {"index": 3, "series": 3, "page": 2, "me": 4}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if len(sorted_values) == 0:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# Stub Discord API:
+
+
+class StubDiscordAPI(object):
+    def __init__(self, latency: float):
+        self.latency: float = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+
+        self.app = web.Application()
+        self.app.router.add_get("/users/@me", self.get_user)
+        self.app.router.add_post("/oauth2/token", self.token)
+        self.app.router.add_post("/oauth2/token/revoke", self.revoke)
+        self.app.router.add_get(
+            "/attachments/{channel_id}/{attachment_id}/{filename}", self.attachment
+        )
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self, port: int):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        self.calls["GET /users/@me"] += 1
+        await asyncio.sleep(self.latency)
+
+        auth = request.headers.get("Authorization", "")
+        try:
+            user_id = int(auth.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return web.json_response({"message": "401: Unauthorized"}, status=401)
+
+        return web.json_response(
+            {
+                "id": str(user_id),
+                "username": "user" + str(user_id)[-4:],
+                "discriminator": "0001",
+            }
+        )
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.calls["POST /oauth2/token"] += 1
+        await asyncio.sleep(self.latency)
+
+        data = await request.post()
+        grant = data.get("refresh_token") or data.get("code") or "0"
+        user_id = grant.rsplit("-", 1)[-1]
+
+        return web.json_response(
+            {
+                "access_token": "stub-" + user_id,
+                "token_type": "Bearer",
+                "refresh_token": "refresh-" + user_id,
+                "expires_in": TOKEN_LIFETIME,
+                "scope": "identify",
+            }
+        )
+
+    async def revoke(self, request: web.Request) -> web.Response:
+        self.calls["POST /oauth2/token/revoke"] += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response({})
+
+    async def attachment(self, request: web.Request) -> web.Response:
+        self.calls["GET /attachments"] += 1
+        await asyncio.sleep(self.latency)
+
+        # not a real image, but deterministic for each attachment
+        seed = request.match_info["attachment_id"].encode("utf-8")
+        body = hashlib.sha256(seed).digest() * (ATTACHMENT_SIZE // 32)
+        return web.Response(body=body, content_type="image/png")
+
+
+# Server process:
+
+
+async def seed(redis, args: argparse.Namespace):
+    from .dataset import DatasetGenerator, DatasetParams
+    from basil.web.api.auth import oauth2_api
+    from basil.web.oauth2 import OAuth2Context, STATE_AUTHORIZED
+
+    params = DatasetParams(
+        series_count=args.series, snippets_per_series=args.snippets, seed=args.seed
+    )
+    await DatasetGenerator(params).populate(redis)
+
+    expire_time = time.time() + TOKEN_LIFETIME
+    for i in range(args.sessions):
+        ctx = OAuth2Context(SESSION_PREFIX + str(i), None, redis, oauth2_api)
+        user_id = USER_ID_BASE + i
+
+        await redis.hset(
+            ctx.auth_data_key,
+            mapping={
+                "state": STATE_AUTHORIZED,
+                "access_token": "stub-" + str(user_id),
+                "token_type": "Bearer",
+                "refresh_token": "refresh-" + str(user_id),
+                "expire_time": str(expire_time),
+                "scopes": "identify",
+            },
+        )
+
+
+def serve(args: argparse.Namespace):
+    environment.setup(reuse_existing=True)
+
+    from basil.config import config
+    from basil.web import app
+    from basil.web.api import auth
+    from . import memory_redis
+
+    environment.install_stub_client()
+
+    auth.DISCORD_API_URL = args.upstream
+    auth.oauth2_api.authorize_url = args.upstream + "/oauth2/authorize"
+    auth.oauth2_api.token_url = args.upstream + "/oauth2/token"
+    auth.oauth2_api.revoke_url = args.upstream + "/oauth2/token/revoke"
+    config.media_upstream = args.upstream
+
+    if args.redis_url is None:
+        # nothing to health-check; the shared pool is never used
+        config.redis_health_check_interval = 0
+
+        @app.before_server_start
+        async def use_memory_redis(app, loop):
+            app.ctx.redis = memory_redis.create()
+            await seed(app.ctx.redis, args)
+
+    else:
+        config.primary_redis_url = args.redis_url
+
+        @app.main_process_start
+        async def seed_redis(app, loop):
+            from basil.redis_pool import create_redis
+
+            redis = create_redis(args.redis_url)
+            if await redis.dbsize() > 0 and not args.flush:
+                raise RuntimeError("refusing to seed a non-empty database")
+            await redis.flushdb()
+            await seed(redis, args)
+
+        @app.main_process_stop
+        async def flush_redis(app, loop):
+            from basil.redis_pool import create_redis
+
+            await create_redis(args.redis_url).flushdb()
+
+    app.run(host="127.0.0.1", port=args.port, workers=args.workers, access_log=False)
+
+
+# Load generator:
+
+
+class LoadGenerator(object):
+    def __init__(self, base_url: str, args: argparse.Namespace):
+        config = environment.config_data()
+        signer = Signer(
+            bytes.fromhex(config["cookie_signer_key"]), digest_method=hashlib.sha256
+        )
+
+        self.base_url: str = base_url
+        self.args: argparse.Namespace = args
+        self.rng = random.Random(args.seed)
+        self.cookies: List[str] = [
+            signer.sign(SESSION_PREFIX + str(i)).decode("utf-8")
+            for i in range(args.sessions)
+        ]
+        self.tags: List[str] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+        mix = dict(DEFAULT_MIX)
+        for item in args.mix.split(",") if args.mix else []:
+            name, weight = item.split("=")
+            mix[name.strip()] = float(weight)
+        self.endpoints: List[str] = list(mix.keys())
+        self.weights: List[float] = list(mix.values())
+
+    def request_path(self, endpoint: str) -> str:
+        if endpoint == "index":
+            return "/api/series"
+        elif endpoint == "me":
+            return "/api/auth/me"
+
+        tag = urllib.parse.quote(self.rng.choice(self.tags), safe="")
+        if endpoint == "series":
+            return "/api/series/" + tag
+        elif endpoint == "page":
+            return "/series/" + tag
+        raise ValueError("unknown endpoint " + endpoint)
+
+    async def wait_ready(self, session: aiohttp.ClientSession, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                async with session.get(self.base_url + "/api/series") as resp:
+                    if resp.status == 200:
+                        self.tags = [s["tag"] for s in await resp.json()]
+                        return
+            except aiohttp.ClientError:
+                pass
+
+            if time.monotonic() > deadline:
+                raise TimeoutError("server did not become ready")
+            await asyncio.sleep(0.5)
+
+    async def worker(self, session: aiohttp.ClientSession, deadline: float):
+        while time.monotonic() < deadline:
+            endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+            headers = {}
+            if self.rng.random() < self.args.auth_ratio:
+                headers["Cookie"] = "session=" + self.rng.choice(self.cookies)
+
+            start = time.perf_counter()
+            try:
+                async with session.get(
+                    self.base_url + self.request_path(endpoint), headers=headers
+                ) as resp:
+                    await resp.read()
+                    if resp.status >= 400:
+                        self.errors[endpoint] += 1
+            except aiohttp.ClientError:
+                self.errors[endpoint] += 1
+            self.latencies[endpoint].append(time.perf_counter() - start)
+
+    async def run(self) -> float:
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(
+            connector=connector, cookie_jar=aiohttp.DummyCookieJar()
+        ) as session:
+            await self.wait_ready(session, self.args.startup_timeout)
+
+            start = time.monotonic()
+            deadline = start + self.args.duration
+            await asyncio.gather(
+                *(self.worker(session, deadline) for _ in range(self.args.concurrency))
+            )
+            return time.monotonic() - start
+
+    def report(self, elapsed: float):
+        print(
+            "{:<10} {:>9} {:>9} {:>10} {:>10} {:>8}".format(
+                "endpoint", "requests", "req/s", "p50 ms", "p99 ms", "errors"
+            )
+        )
+
+        all_latencies: List[float] = []
+        for endpoint in self.endpoints:
+            values = sorted(self.latencies[endpoint])
+            all_latencies.extend(values)
+            self._report_line(endpoint, values, self.errors[endpoint], elapsed)
+
+        all_latencies.sort()
+        self._report_line("total", all_latencies, sum(self.errors.values()), elapsed)
+
+    @staticmethod
+    def _report_line(name: str, values: List[float], errors: int, elapsed: float):
+        print(
+            "{:<10} {:>9} {:>9.1f} {:>10.2f} {:>10.2f} {:>8}".format(
+                name,
+                len(values),
+                len(values) / elapsed,
+                percentile(values, 0.5) * 1000,
+                percentile(values, 0.99) * 1000,
+                errors,
+            )
+        )
+
+
+async def drive(args: argparse.Namespace) -> int:
+    environment.setup()
+
+    if args.redis_url is not None and not args.flush:
+        from basil.redis_pool import create_redis
+
+        redis = create_redis(args.redis_url)
+        if await redis.dbsize() > 0:
+            print(
+                "refusing to run against a non-empty database (pass --flush to override)",
+                file=sys.stderr,
+            )
+            return 1
+
+    upstream_port = free_port()
+    server_port = args.port or free_port()
+    stub = StubDiscordAPI(args.upstream_latency)
+    await stub.start(upstream_port)
+
+    cmd = [
+        sys.executable,
+        "-m",
+        "benchmarks.loadtest",
+        "--serve",
+        "--port",
+        str(server_port),
+        "--upstream",
+        "http://127.0.0.1:{}".format(upstream_port),
+        "--workers",
+        str(args.workers),
+        "--series",
+        str(args.series),
+        "--snippets",
+        str(args.snippets),
+        "--sessions",
+        str(args.sessions),
+        "--seed",
+        str(args.seed),
+    ]
+    if args.redis_url is not None:
+        cmd += ["--redis-url", args.redis_url]
+    if args.flush:
+        cmd.append("--flush")
+
+    server = subprocess.Popen(cmd, env=os.environ.copy())
+    try:
+        generator = LoadGenerator("http://127.0.0.1:{}".format(server_port), args)
+        print(
+            "Running {} concurrent clients for {} s against {} worker(s)...".format(
+                args.concurrency, args.duration, args.workers
+            )
+        )
+        elapsed = await generator.run()
+    finally:
+        server.terminate()
+        server.wait()
+        await stub.stop()
+
+    print()
+    generator.report(elapsed)
+
+    print()
+    print("Upstream (stub Discord API) calls:")
+    for route, count in sorted(stub.calls.items()):
+        print("    {:<28} {:>8}".format(route, count))
+
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--snippets", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--auth-ratio",
+        type=float,
+        default=0.5,
+        help="fraction of requests made with a logged-in session",
+    )
+    parser.add_argument(
+        "--mix",
+        default=None,
+        help="request weights, e.g. 'index=1,series=4,page=1,me=2'",
+    )
+    parser.add_argument(
+        "--upstream-latency",
+        type=float,
+        default=0.05,
+        help="simulated Discord API latency in seconds",
+    )
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--flush", action="store_true")
+    parser.add_argument("--port", type=int, default=None)
+
+    # used internally when launching the server process:
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        sys.exit(asyncio.run(drive(args)))
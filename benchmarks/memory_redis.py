@@ -0,0 +1,571 @@
+"""An in-memory stand-in for the subset of `aioredis.Redis` used by Basil.
+
+This behaves like a client created with `decode_responses=True`: all values
+are stored and returned as strings. It exists so that the storage code can be
+benchmarked without a Redis server; it does not model network latency, so
+results from it mostly reflect CPU cost and the number of awaits made.
+
+Lua scripts cannot be run directly, so each script used by Basil has a Python
+equivalent registered in `SCRIPT_IMPLEMENTATIONS`, keyed by script source.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+ScriptImpl = Callable[["MemoryRedis", List[str], List[str]], Awaitable[Any]]
+SCRIPT_IMPLEMENTATIONS: Dict[str, ScriptImpl] = {}
+
+
+class Stream(list):
+    """Stream storage: a list of (ID, fields) entries in ID order."""
+
+
+class WrongTypeError(Exception):
+    pass
+
+
+class ZSet(dict):
+    """Sorted set storage: maps members to scores."""
+
+
+def script_implementation(source: str):
+    def wrapper(func: ScriptImpl) -> ScriptImpl:
+        SCRIPT_IMPLEMENTATIONS[source] = func
+        return func
+
+    return wrapper
+
+
+def _encode(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    elif isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MemoryScript(object):
+    def __init__(self, client: Any, source: str):
+        try:
+            self.impl: ScriptImpl = SCRIPT_IMPLEMENTATIONS[source]
+        except KeyError:
+            raise NotImplementedError(
+                "no in-memory implementation registered for script"
+            ) from None
+        self.client = client
+
+    async def __call__(self, keys=None, args=None, client=None):
+        if client is None:
+            client = self.client
+
+        keys = [_encode(k) for k in (keys or [])]
+        args = [_encode(a) for a in (args or [])]
+
+        if isinstance(client, MemoryPipeline):
+            client._queue(self.impl, client.redis, keys, args)
+            return client
+        return await self.impl(client, keys, args)
+
+
+class MemoryPipeline(object):
+    """Queues calls and runs them in order when `execute` is awaited."""
+
+    def __init__(self, redis: MemoryRedis):
+        self.redis: MemoryRedis = redis
+        self.stack: List[Any] = []
+
+    async def __aenter__(self) -> MemoryPipeline:
+        return self
+
+    async def __aexit__(self, *exc):
+        self.stack = []
+
+    def _queue(self, func, *args, **kwargs):
+        self.stack.append((func, args, kwargs))
+        return self
+
+    def register_script(self, source: str) -> MemoryScript:
+        return MemoryScript(self, source)
+
+    def __getattr__(self, name: str):
+        method = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            return self._queue(method, *args, **kwargs)
+
+        return queue
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        stack, self.stack = self.stack, []
+        results = []
+
+        for func, args, kwargs in stack:
+            try:
+                results.append(await func(*args, **kwargs))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class MemoryRedis(object):
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+
+    def _get_typed(self, key: str, kind: type) -> Optional[Any]:
+        value = self.data.get(key)
+        if value is not None and type(value) is not kind:
+            raise WrongTypeError(key)
+        return value
+
+    def _get_or_create(self, key: str, kind: type) -> Any:
+        value = self._get_typed(key, kind)
+        if value is None:
+            value = kind()
+            self.data[key] = value
+        return value
+
+    def _drop_if_empty(self, key: str):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, str) and len(value) == 0:
+            del self.data[key]
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    def register_script(self, source: str) -> MemoryScript:
+        return MemoryScript(self, source)
+
+    # Keys
+
+    async def exists(self, *keys: str) -> int:
+        return sum(1 for k in keys if k in self.data)
+
+    async def delete(self, *keys: str) -> int:
+        count = 0
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                count += 1
+        return count
+
+    async def rename(self, src: str, dst: str) -> bool:
+        try:
+            self.data[dst] = self.data.pop(src)
+        except KeyError:
+            raise KeyError("no such key: " + src) from None
+        return True
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        return key in self.data
+
+    async def expireat(self, key: str, when: int) -> bool:
+        return key in self.data
+
+    async def scan_iter(self, match: str = None, count: int = None, _type=None):
+        for key in list(self.data.keys()):
+            if match is None or fnmatch.fnmatchcase(key, match):
+                yield key
+
+    async def memory_usage(self, key: str, samples: int = None) -> Optional[int]:
+        value = self.data.get(key)
+        if value is None:
+            return None
+        elif isinstance(value, str):
+            return len(value.encode("utf-8"))
+        return sum(len(_encode(v)) for v in value)
+
+    async def flushdb(self):
+        self.data.clear()
+
+    async def dbsize(self) -> int:
+        return len(self.data)
+
+    # Strings
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._get_typed(key, str)
+
+    async def mget(self, keys, *args) -> List[Optional[str]]:
+        if isinstance(keys, str):
+            keys = [keys]
+        return [self._get_typed(k, str) for k in list(keys) + list(args)]
+
+    async def set(self, key: str, value: Any, nx: bool = False, **kwargs) -> bool:
+        if nx and key in self.data:
+            return None
+        self.data[key] = _encode(value)
+        return True
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._get_typed(key, str) or 0) + amount
+        self.data[key] = str(value)
+        return value
+
+    # Sets
+
+    async def sadd(self, key: str, *values: Any) -> int:
+        s: Set[str] = self._get_or_create(key, set)
+        before = len(s)
+        s.update(_encode(v) for v in values)
+        return len(s) - before
+
+    async def srem(self, key: str, *values: Any) -> int:
+        s: Optional[Set[str]] = self._get_typed(key, set)
+        if s is None:
+            return 0
+
+        before = len(s)
+        s.difference_update(_encode(v) for v in values)
+        self._drop_if_empty(key)
+        return before - len(s)
+
+    async def sunionstore(self, dest: str, keys, *args) -> int:
+        if isinstance(keys, str):
+            keys = [keys]
+        union: Set[str] = set()
+        for key in list(keys) + list(args):
+            union.update(self._get_typed(key, set) or ())
+
+        self.data.pop(dest, None)
+        if len(union) > 0:
+            self.data[dest] = union
+        return len(union)
+
+    async def spop(self, key: str, count: int = None):
+        s: Optional[Set[str]] = self._get_typed(key, set)
+        if count is None:
+            if not s:
+                return None
+            member = s.pop()
+            self._drop_if_empty(key)
+            return member
+
+        popped = [s.pop() for _ in range(min(count, len(s)))] if s else []
+        self._drop_if_empty(key)
+        return popped
+
+    async def scard(self, key: str) -> int:
+        return len(self._get_typed(key, set) or ())
+
+    async def sismember(self, key: str, value: Any) -> bool:
+        return _encode(value) in (self._get_typed(key, set) or ())
+
+    async def smembers(self, key: str) -> Set[str]:
+        return set(self._get_typed(key, set) or ())
+
+    async def sscan_iter(self, key: str, match: str = None, count: int = None):
+        for member in list(self._get_typed(key, set) or ()):
+            if match is None or fnmatch.fnmatchcase(member, match):
+                yield member
+
+    # Hashes
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._get_typed(key, dict) or {})
+
+    async def hget(self, key: str, field: str) -> Optional[str]:
+        return (self._get_typed(key, dict) or {}).get(field)
+
+    async def hmget(self, key: str, fields, *args) -> List[Optional[str]]:
+        h = self._get_typed(key, dict) or {}
+        return [h.get(_encode(f)) for f in list(fields) + list(args)]
+
+    async def hset(self, key: str, field=None, value=None, mapping=None) -> int:
+        h: Dict[str, str] = self._get_or_create(key, dict)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+
+        added = 0
+        for k, v in items.items():
+            if _encode(k) not in h:
+                added += 1
+            h[_encode(k)] = _encode(v)
+        return added
+
+    async def hmset(self, key: str, mapping: Dict[str, Any]) -> bool:
+        await self.hset(key, mapping=mapping)
+        return True
+
+    async def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        h: Dict[str, str] = self._get_or_create(key, dict)
+        value = int(h.get(_encode(field), 0)) + amount
+        h[_encode(field)] = str(value)
+        return value
+
+    async def hdel(self, key: str, *fields: str) -> int:
+        h = self._get_typed(key, dict)
+        if h is None:
+            return 0
+
+        count = 0
+        for f in fields:
+            if h.pop(f, None) is not None:
+                count += 1
+        self._drop_if_empty(key)
+        return count
+
+    # Sorted sets
+
+    async def zadd(
+        self,
+        key: str,
+        mapping: Dict[Any, float],
+        nx: bool = False,
+        xx: bool = False,
+        **kwargs,
+    ) -> int:
+        z: Dict[str, float] = self._get_or_create(key, ZSet)
+        added = 0
+        for member, score in mapping.items():
+            exists = _encode(member) in z
+            if (nx and exists) or (xx and not exists):
+                continue
+            if not exists:
+                added += 1
+            z[_encode(member)] = float(score)
+        self._drop_if_empty(key)
+        return added
+
+    async def zincrby(self, key: str, amount: float, member: Any) -> float:
+        z: Dict[str, float] = self._get_or_create(key, ZSet)
+        z[_encode(member)] = z.get(_encode(member), 0.0) + float(amount)
+        return z[_encode(member)]
+
+    async def zrem(self, key: str, *members: Any) -> int:
+        z = self._get_typed(key, ZSet)
+        if z is None:
+            return 0
+
+        count = 0
+        for m in members:
+            if z.pop(_encode(m), None) is not None:
+                count += 1
+        self._drop_if_empty(key)
+        return count
+
+    async def zscore(self, key: str, member: Any) -> Optional[float]:
+        return (self._get_typed(key, ZSet) or {}).get(_encode(member))
+
+    async def zcard(self, key: str) -> int:
+        return len(self._get_typed(key, ZSet) or ())
+
+    def _sorted_items(self, key: str, reverse: bool = False):
+        z = self._get_typed(key, ZSet) or {}
+        return sorted(z.items(), key=lambda kv: (kv[1], kv[0]), reverse=reverse)
+
+    @staticmethod
+    def _slice(items, start, num, withscores: bool):
+        if start is not None and num is not None:
+            items = items[start : start + num if num >= 0 else None]
+        if withscores:
+            return [(m, s) for m, s in items]
+        return [m for m, _ in items]
+
+    @staticmethod
+    def _bound(value) -> float:
+        # handles "-inf" and "+inf" as well as numbers
+        return float(value)
+
+    async def zrangebyscore(
+        self, key, min, max, start=None, num=None, withscores=False, **kwargs
+    ):
+        lo, hi = self._bound(min), self._bound(max)
+        items = [kv for kv in self._sorted_items(key) if lo <= kv[1] <= hi]
+        return self._slice(items, start, num, withscores)
+
+    async def zrevrangebyscore(
+        self, key, max, min, start=None, num=None, withscores=False, **kwargs
+    ):
+        lo, hi = self._bound(min), self._bound(max)
+        items = [kv for kv in self._sorted_items(key, True) if lo <= kv[1] <= hi]
+        return self._slice(items, start, num, withscores)
+
+    async def zrange(self, key, start, end, desc=False, withscores=False, **kwargs):
+        items = self._sorted_items(key, desc)
+        end = len(items) if end == -1 else end + 1
+        return self._slice(items[start:end], None, None, withscores)
+
+    async def zrevrange(self, key, start, end, withscores=False, **kwargs):
+        return await self.zrange(key, start, end, desc=True, withscores=withscores)
+
+    # Pub/sub
+
+    async def publish(self, channel: str, message: Any) -> int:
+        # there are never any subscribers
+        return 0
+
+    # Streams
+
+    @staticmethod
+    def _stream_id(value: str, default_seq: int) -> Tuple[int, int]:
+        ms, _, seq = value.partition("-")
+        return (int(ms), int(seq) if seq else default_seq)
+
+    async def xadd(
+        self, key: str, fields: Dict[str, Any], id: str = "*", maxlen=None, **kwargs
+    ) -> str:
+        stream: Stream = self._get_or_create(key, Stream)
+        ms = int(time.time() * 1000)
+        seq = 0
+        if len(stream) > 0:
+            last_ms, last_seq = self._stream_id(stream[-1][0], 0)
+            if ms <= last_ms:
+                ms, seq = last_ms, last_seq + 1
+
+        entry_id = "{}-{}".format(ms, seq)
+        stream.append((entry_id, {k: _encode(v) for k, v in fields.items()}))
+        if maxlen is not None and len(stream) > maxlen:
+            del stream[: len(stream) - maxlen]
+        return entry_id
+
+    def _stream_range(self, key: str, min: str, max: str) -> List[Tuple[str, dict]]:
+        lo = (0, 0) if min == "-" else self._stream_id(min, 0)
+        hi = None if max == "+" else self._stream_id(max, 2 ** 64)
+        return [
+            (entry_id, dict(fields))
+            for entry_id, fields in (self._get_typed(key, Stream) or ())
+            if lo <= self._stream_id(entry_id, 0)
+            and (hi is None or self._stream_id(entry_id, 0) <= hi)
+        ]
+
+    async def xrange(self, key: str, min: str = "-", max: str = "+", count=None):
+        return self._stream_range(key, min, max)[:count]
+
+    async def xrevrange(self, key: str, max: str = "+", min: str = "-", count=None):
+        return list(reversed(self._stream_range(key, min, max)))[:count]
+
+
+# Python equivalents of the Lua scripts in basil.series:
+
+
+def _register_series_scripts():
+    from basil import series
+
+    @script_implementation(series.TITLE_INDEX_REMOVE_SCRIPT)
+    async def title_index_remove(redis: MemoryRedis, keys, argv):
+        await redis.delete(keys[0])
+        await redis.srem(keys[2], argv[0])
+        if await redis.scard(keys[2]) == 0:
+            await redis.delete(keys[2])
+            await redis.srem(keys[1], argv[1])
+
+    @script_implementation(series.TITLE_INDEX_RENAME_SCRIPT)
+    async def title_index_rename(redis: MemoryRedis, keys, argv):
+        await redis.set(keys[0], argv[1])
+        await redis.srem(keys[2], argv[0])
+        await redis.sadd(keys[3], argv[0])
+        await redis.sadd(keys[1], argv[3])
+        if await redis.scard(keys[2]) == 0:
+            await redis.delete(keys[2])
+            await redis.srem(keys[1], argv[2])
+
+    @script_implementation(series.NORMALIZED_INDEX_REMOVE_SCRIPT)
+    async def normalized_index_remove(redis: MemoryRedis, keys, argv):
+        await redis.srem(keys[1], argv[0])
+        if await redis.scard(keys[1]) == 0:
+            await redis.delete(keys[1])
+            await redis.srem(keys[0], argv[1])
+
+    @script_implementation(series.NORMALIZED_INDEX_RENAME_SCRIPT)
+    async def normalized_index_rename(redis: MemoryRedis, keys, argv):
+        await redis.srem(keys[1], argv[0])
+        await redis.sadd(keys[2], argv[1])
+        await redis.sadd(keys[0], argv[3])
+        if await redis.scard(keys[1]) == 0:
+            await redis.delete(keys[1])
+            await redis.srem(keys[0], argv[2])
+
+    @script_implementation(series.RESOLVE_SCRIPT)
+    async def resolve(redis: MemoryRedis, keys, argv):
+        if await redis.exists(keys[0]):
+            return ["found", argv[0]]
+
+        ambiguous = set()
+        for subindex in keys[1:3]:
+            matches = [
+                tag
+                for tag in await redis.smembers(subindex)
+                if await redis.zscore(keys[3], tag) is not None
+            ]
+            if len(matches) == 1:
+                return ["found", matches[0]]
+            ambiguous.update(matches)
+
+        if len(ambiguous) == 0:
+            return []
+        return ["ambiguous"] + sorted(ambiguous)
+
+    @script_implementation(series.SAVE_SUMMARY_SCRIPT)
+    async def save_summary(redis: MemoryRedis, keys, argv):
+        if ((await redis.get(keys[0])) or "") != argv[0]:
+            return 0
+
+        await redis.hset(keys[1], mapping=dict(zip(argv[1::2], argv[2::2])))
+        return 1
+
+
+# Python equivalent of the Lua script in basil.codec:
+
+
+def _register_codec_scripts():
+    from basil import codec
+
+    @script_implementation(codec.RECOMPRESS_SCRIPT)
+    async def recompress(redis: MemoryRedis, keys, argv):
+        if await redis.get(keys[0]) == argv[0]:
+            await redis.set(keys[0], argv[1])
+            return 1
+        return 0
+
+
+# Python equivalent of the Lua script in basil.snippet_gc:
+
+
+def _register_snippet_gc_scripts():
+    from basil import snippet_gc
+
+    @script_implementation(snippet_gc.COLLECT_SCRIPT)
+    async def collect(redis: MemoryRedis, keys, argv):
+        if await redis.exists(keys[0]):
+            await redis.zrem(keys[1], argv[0])
+            return 0
+
+        marked = await redis.zscore(keys[1], argv[0])
+        if marked is None:
+            await redis.zadd(keys[1], {argv[0]: float(argv[1])})
+            return 0
+
+        if float(argv[1]) - marked < float(argv[2]):
+            return 0
+
+        await redis.delete(*keys[2:])
+        await redis.zrem(keys[1], argv[0])
+        return 1
+
+
+# Python equivalent of the Lua script in basil.web.oauth2:
+
+
+def _register_oauth2_scripts():
+    from basil.web import oauth2
+
+    @script_implementation(oauth2.RELEASE_LOCK_SCRIPT)
+    async def release_lock(redis: MemoryRedis, keys, argv):
+        if await redis.get(keys[0]) == argv[0]:
+            return await redis.delete(keys[0])
+        return 0
+
+
+def create() -> MemoryRedis:
+    """Create an empty in-memory store, registering script implementations."""
+    if len(SCRIPT_IMPLEMENTATIONS) == 0:
+        _register_series_scripts()
+        _register_codec_scripts()
+        _register_snippet_gc_scripts()
+        _register_oauth2_scripts()
+    return MemoryRedis()
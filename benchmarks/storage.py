@@ -0,0 +1,275 @@
+"""Benchmarks for the series/snippet storage and serialization hot paths.
+
+Usage:
+
+    python -m benchmarks.storage [--series N] [--snippets M] [--redis-url URL]
+                                 [--compare RESULTS_FILE]
+
+By default this runs against an in-memory stand-in for Redis. Pass
+`--redis-url` to run against a real (empty) Redis database instead; the
+database is flushed before and after the run, so never point this at a
+database holding real data.
+
+Results are written to `benchmarks/results/<commit>-<backend>.json`, so runs on
+different commits can be compared with `--compare`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import asdict
+import json
+from pathlib import Path
+import random
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import environment
+
+environment.setup()
+
+from basil import search
+from basil.series import Series
+from . import memory_redis
+from .dataset import WORDS, DatasetGenerator, DatasetParams
+
+RESULTS_DIR = Path(__file__).parent.joinpath("results")
+
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return rev + ("-dirty" if len(dirty) > 0 else "")
+
+
+class Benchmark(object):
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], ops: int = 1):
+        self.name: str = name
+        self.func: Callable[[], Awaitable[Any]] = func
+        self.ops: int = ops
+
+    async def run(self, repeat: int) -> Dict[str, float]:
+        # warm up caches and code paths before timing:
+        await self.func()
+
+        timings: List[float] = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await self.func()
+            timings.append((time.perf_counter() - start) / self.ops)
+
+        return {
+            "min_ms": min(timings) * 1000,
+            "median_ms": statistics.median(timings) * 1000,
+            "mean_ms": statistics.fmean(timings) * 1000,
+            "ops": self.ops,
+            "repeat": repeat,
+        }
+
+
+def build_benchmarks(redis, tags: List[str], sample_size: int) -> List[Benchmark]:
+    from basil.web import app
+    from basil.web.api import series as series_api
+
+    # Blueprint route decorators replace the handler with a (route, handler) tuple.
+    _, get_all_series = series_api.get_all_series
+
+    rng = random.Random(1)
+    sample = rng.sample(tags, min(sample_size, len(tags)))
+    loaded: List[Series] = []
+
+    async def load_sample():
+        loaded.clear()
+        for tag in sample:
+            loaded.append(await Series.load(redis, tag))
+
+    async def serialize_dicts():
+        for s in loaded:
+            s.as_dict
+
+    async def serialize_json():
+        for s in loaded:
+            s.as_json
+
+    async def wordcount():
+        for s in loaded:
+            s.wordcount()
+
+    app.ctx.redis = redis
+    app.ctx.http_session = None
+    anonymous_request = SimpleNamespace(
+        args={}, ctx=SimpleNamespace(session=None, add_sess_cookie=False)
+    )
+
+    async def all_series():
+        await get_all_series(anonymous_request)
+
+    title_queries = [Series.normalize_name(t)[:4] for t in sample]
+    tag_queries = [t.replace("_", " ").upper() for t in sample]
+
+    async def find_by_title():
+        for q in title_queries:
+            await Series.find_by_title(redis, q)
+
+    async def search_by_tag():
+        for q in tag_queries:
+            await Series.search_by_tag(redis, q)
+
+    async def resolve():
+        for s in loaded:
+            await Series.resolve(redis, s.tag.upper(), next(iter(s.author_ids)))
+
+    search_queries = [" ".join(rng.sample(WORDS, 3)) for _ in sample]
+
+    async def full_text_search():
+        for q in search_queries:
+            await search.search(redis, q)
+
+    n = len(sample)
+    return [
+        Benchmark("series_load", load_sample, n),
+        Benchmark("as_dict", serialize_dicts, n),
+        Benchmark("as_json", serialize_json, n),
+        Benchmark("wordcount", wordcount, n),
+        Benchmark("get_all_series", all_series),
+        Benchmark("find_by_title", find_by_title, n),
+        Benchmark("search_by_tag", search_by_tag, n),
+        Benchmark("resolve", resolve, n),
+        Benchmark("search", full_text_search, n),
+    ]
+
+
+def compare(current: Dict[str, Any], baseline_path: Path):
+    with baseline_path.open("r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    if baseline["params"] != current["params"]:
+        print("warning: baseline was generated with different dataset parameters")
+
+    print()
+    print(
+        "{:<20} {:>12} {:>12} {:>9}".format(
+            "benchmark", "baseline ms", "current ms", "change"
+        )
+    )
+    for name, result in current["results"].items():
+        try:
+            old = baseline["results"][name]["median_ms"]
+        except KeyError:
+            continue
+
+        new = result["median_ms"]
+        change = (new - old) / old * 100 if old > 0 else 0
+        print("{:<20} {:>12.3f} {:>12.3f} {:>+8.1f}%".format(name, old, new, change))
+
+
+async def main(args: argparse.Namespace) -> int:
+    environment.install_stub_client()
+
+    if args.redis_url is not None:
+        from basil.redis_pool import create_redis
+
+        redis = create_redis(args.redis_url)
+        if await redis.dbsize() > 0 and not args.flush:
+            print(
+                "refusing to run against a non-empty database (pass --flush to override)",
+                file=sys.stderr,
+            )
+            return 1
+        await redis.flushdb()
+        backend = "redis"
+    else:
+        redis = memory_redis.create()
+        backend = "memory"
+
+    params = DatasetParams(
+        series_count=args.series,
+        snippets_per_series=args.snippets,
+        seed=args.seed,
+    )
+
+    print(
+        "Generating {} series with {} snippets each ({} backend)...".format(
+            params.series_count, params.snippets_per_series, backend
+        )
+    )
+    tags = await DatasetGenerator(params).populate(redis)
+
+    results: Dict[str, Any] = {}
+    try:
+        for bench in build_benchmarks(redis, tags, args.sample):
+            results[bench.name] = await bench.run(args.repeat)
+            print(
+                "{:<20} median {:>10.3f} ms/op   min {:>10.3f} ms/op".format(
+                    bench.name,
+                    results[bench.name]["median_ms"],
+                    results[bench.name]["min_ms"],
+                )
+            )
+    finally:
+        if backend == "redis":
+            await redis.flushdb()
+
+    revision = git_revision()
+    output = {
+        "revision": revision,
+        "timestamp": time.time(),
+        "backend": backend,
+        "params": dict(asdict(params), sample=args.sample),
+        "results": results,
+    }
+
+    out_path: Optional[Path] = args.output
+    if out_path is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        out_path = RESULTS_DIR.joinpath("{}-{}.json".format(revision, backend))
+
+    with out_path.open("w", encoding="utf-8") as f:
+        json.dump(output, f, indent=4)
+    print("Wrote results to " + str(out_path))
+
+    if args.compare is not None:
+        compare(output, args.compare)
+
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--snippets", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--sample", type=int, default=25, help="series used per benchmark iteration"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--flush", action="store_true")
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="results file to compare against"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
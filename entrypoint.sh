@@ -1,2 +1,2 @@
 #!/bin/bash
-pipenv run python3.8 -u /opt/basil/run.py
\ No newline at end of file
+pipenv run python3.8 -u /opt/basil/run.py "$@"
\ No newline at end of file
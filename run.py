@@ -1,4 +1,7 @@
+import sys
+
 import basil
 
 if __name__ == "__main__":
-    basil.app_main()
+    # "all" (default), "bot" or "web"
+    basil.app_main(*sys.argv[1:2])
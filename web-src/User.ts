@@ -2,7 +2,7 @@ import $ from "jquery";
 import { Author } from "./components/Author";
 
 export interface LoginData {
-    session_id: string;
+    session_id: string | null;
     dev_mode: boolean;
     user_data?: Author;
 }
@@ -13,6 +13,7 @@ export interface TrimmedSnippet {
 export interface Snippet extends TrimmedSnippet {
     content: string;
     attachment_urls: string[];
+    media_urls: string[];
 }
 
 function checkImage(url: string): { isImage: boolean, isSpoiler: boolean } {
@@ -80,22 +81,25 @@ discordMarkdown.rules.url.html = function (node: unknown, output: (content: stri
 
 class AttachmentImage {
     attachment_url: string;
+    media_url: string;
     root: JQuery;
 
-    constructor(attachment_url: string) {
+    constructor(attachment_url: string, media_url: string) {
         this.attachment_url = attachment_url;
+        this.media_url = media_url;
         this.root = $("<div>", { "class": "d-attachment-wrapper d-img-wrapper" });
 
+        // the proxied URL has no filename, so check the original for spoilers
         var imgStatus = checkImage(attachment_url);
 
         var linkElem = addSubelement(this.root, "a", {
-            "href": attachment_url,
+            "href": media_url,
             "class": "d-link",
             "target": "_blank"
         });
 
         var imgElem = addSubelement(linkElem, "img", {
-            "src": attachment_url,
+            "src": media_url,
             "class": "d-img" + (imgStatus.isSpoiler ? " d-img-spoiler" : "")
         });
 
@@ -132,12 +136,12 @@ export class SnippetView {
             $(ev.target).toggleClass("d-spoiler-show");
         });
 
-        for (let attachment_url of snippet.attachment_urls) {
-            let view = new AttachmentImage(attachment_url);
+        snippet.attachment_urls.forEach((attachment_url, idx) => {
+            let view = new AttachmentImage(attachment_url, snippet.media_urls[idx]);
 
             this.attachment_views.push(view);
             snippetElem.append(view.root);
-        }
+        });
 
         $(snippetElem).find(".d-img-wrapper").each((idx, elem) => {
             $(elem).find(".d-spoiler-cover").on("click", (ev) => {